@@ -1,24 +1,136 @@
+import time
+
+_SCRIPT_T0 = time.perf_counter()  # rerun마다 스크립트 실행 시작 시각 (import-time report)
+
 import os
 import math
-import time
+import random
 import json
+import base64
+import codecs
+import cProfile
+import hashlib
+import heapq
+import html
+import importlib
 import logging
+import mmap
+import pstats
+import re
+import struct
+import sys
+import threading
+import unicodedata
+from array import array
+from io import BytesIO
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
-from typing import Optional, Dict, Any, List, Tuple, Callable, Set
+from typing import Optional, Dict, Any, List, Tuple, Callable, Set, Iterable, Iterator
 
-import requests
 import streamlit as st
-import pydeck as pdk
 
 # =========================
 # Logging
 # =========================
-logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO"),
-    format="%(asctime)s | %(levelname)s | %(message)s",
-)
+# rerun마다 스크립트가 다시 실행되므로 핸들러가 없을 때(프로세스 첫 실행) 한 번만 설정
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        format="%(asctime)s | %(levelname)s | %(message)s",
+    )
 logger = logging.getLogger("travel-maker")
 
+# 실행 중에 쓰는 파일(트래픽 로그/번들 저장소/프로파일/HTTP fixture)의 기본 위치 — 소스 트리(data/) 밖
+APP_CACHE_DIR = os.getenv("APP_CACHE_DIR") or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "travel-maker"
+)
+
+# =========================
+# Lazy imports / import-time report
+# =========================
+# 무거운 의존성은 실제로 쓰는 순간에 로드 → 1·2단계 화면의 cold start에서 빠짐
+# - requests: 첫 HTTP 호출 / pydeck: 지도 렌더 / openai: 키가 있을 때 call_openai_plan / reportlab: PDF export
+@st.cache_resource(show_spinner=False)
+def import_report() -> Dict[str, Any]:
+    """
+    프로세스 단위 import/스크립트 오버헤드 기록 (디버그 패널, /metrics)
+    - imports: 지연 로드된 모듈 → 첫 import 소요(ms) / failed: 모듈 → 오류
+    - cold_module_ms: 첫 실행의 모듈 본문(import+정의) 시간, last_*_ms: 직전 rerun의 module/main 시간
+    """
+    return {
+        "lock": threading.Lock(),
+        "imports": {},
+        "failed": {},
+        "runs": 0,
+        "cold_module_ms": None,
+        "last_module_ms": None,
+        "last_main_ms": None,
+    }
+
+
+def lazy_import(name: str):
+    mod = sys.modules.get(name)
+    if mod is not None:
+        return mod
+    t0 = time.perf_counter()
+    try:
+        mod = importlib.import_module(name)
+    except Exception as e:
+        import_report()["failed"][name] = f"{type(e).__name__}: {e}"
+        raise
+    ms = (time.perf_counter() - t0) * 1000
+    import_report()["imports"].setdefault(name, round(ms, 1))
+    metrics().set("travelmaker_import_seconds", ms / 1000, module=name)
+    logger.info("lazy import %s: %.0fms", name, ms)
+    return mod
+
+
+class _LazyModule:
+    """속성에 처음 접근할 때 import (`except requests.Timeout` 같은 참조도 그대로 동작)"""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attr: str):
+        return getattr(lazy_import(self._name), attr)
+
+
+requests = _LazyModule("requests")
+pdk = _LazyModule("pydeck")
+
+
+def _openai_client_cls():
+    try:
+        return lazy_import("openai").OpenAI
+    except Exception:
+        return None
+
+
+def _reportlab() -> Optional[Tuple[Any, Any, Any]]:
+    """(A4, canvas 모듈, mm) — reportlab이 없으면 None"""
+    try:
+        pagesizes = lazy_import("reportlab.lib.pagesizes")
+        canvas = lazy_import("reportlab.pdfgen.canvas")
+        units = lazy_import("reportlab.lib.units")
+    except Exception:
+        return None
+    return pagesizes.A4, canvas, units.mm
+
+
+def record_script_run(phase: str, started: float) -> None:
+    """phase: module(스크립트 본문, rerun마다 반복되는 오버헤드) | main(렌더)"""
+    ms = (time.perf_counter() - started) * 1000
+    rep = import_report()
+    with rep["lock"]:
+        if phase == "module":
+            rep["runs"] += 1
+            if rep["cold_module_ms"] is None:
+                rep["cold_module_ms"] = round(ms, 1)
+        rep[f"last_{phase}_ms"] = round(ms, 1)
+    metrics().observe("travelmaker_script_seconds", ms / 1000, phase=phase)
+
 # =========================
 # External APIs
 # =========================
@@ -27,6 +139,7 @@ AMADEUS_BASE_URL = "https://test.api.amadeus.com"
 def get_amadeus_token(client_id: str, client_secret: str) -> str:
     if not client_id or not client_secret:
         raise ApiError("Amadeus API 키가 비어 있어요.")
+    cache_miss("amadeus_token")
 
     url = f"{AMADEUS_BASE_URL}/v1/security/oauth2/token"
     data = {
@@ -35,7 +148,7 @@ def get_amadeus_token(client_id: str, client_secret: str) -> str:
         "client_secret": client_secret,
     }
 
-    r = requests.post(url, data=data, timeout=10)
+    r = _http("POST", url, data=data, timeout=10)
     r.raise_for_status()
     return r.json()["access_token"]
 
@@ -49,18 +162,10 @@ NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
 OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
 
 try:
-    from openai import OpenAI
-except Exception:
-    OpenAI = None
-
-try:
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas as rl_canvas
-    from reportlab.lib.units import mm
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 except Exception:
-    A4 = None
-    rl_canvas = None
-    mm = None
+    add_script_run_ctx = None
+    get_script_run_ctx = None
 
 # =========================
 # UI Theme
@@ -172,61 +277,87 @@ CSS = f"""
 # =========================
 # Session State (structured)
 # =========================
+def default_app_state() -> Dict[str, Any]:
+    return {
+        "input": {
+            "travel_month": "상관없음",
+            "party_type": "친구",
+            "party_count": 2,
+            "destination_scope": "국내",
+            "destination_text": "",
+            "duration": "3일",
+            "travel_style": ["힐링"],
+            "budget": 1000000,
+            "start_date": date.today(),
+            "start_city": "서울",
+            "travel_mode": "자유여행",
+        },
+        "ui": {
+            "openai_api_key": "",
+            "move_mode": "자동",
+            "include_return_to_center": True,
+            "show_map": True,
+            "show_budget": True,
+            "show_checklist": True,
+            "enable_edit": True,
+            "poi_radius_km": 8,
+            "poi_limit": 50,
+            "poi_types": ["관광", "맛집", "카페", "자연", "문화"],
+            "debug_panel": False,
+            "openai_api_key": "",
+            "amadeus_client_id": "",
+            "amadeus_client_secret": "",
+            "use_amadeus_hotel": False,
+        },
+        "cache": {
+            "last_payload_sig": None,
+            "last_bundle": None,
+            "page3_inputs": None,
+            "compare": None,
+        },
+        "runtime": {
+            "itinerary_edits": {},
+            "poi_user_exclude_ids": set(),  # ✅ now exclude by poi_id ("n123"/"w456"/"r789")
+            "last_render_ms": None,
+        },
+        "hotel": {
+            "stars": [3, 4],
+            "max_price_per_night": 0,
+            "limit": 3,
+            "reorder_by_hotel": True,
+        },
+    }
+
+
 def init_state():
     if "step" not in st.session_state:
         st.session_state.step = 1
 
     if "app" not in st.session_state:
-        st.session_state.app = {
-            "input": {
-                "travel_month": "상관없음",
-                "party_type": "친구",
-                "party_count": 2,
-                "destination_scope": "국내",
-                "destination_text": "",
-                "duration": "3일",
-                "travel_style": ["힐링"],
-                "budget": 1000000,
-                "start_date": date.today(),
-                "start_city": "서울",
-                "travel_mode": "자유여행",
-            },
-            "ui": {
-                "openai_api_key": "",
-                "move_mode": "자동",
-                "include_return_to_center": True,
-                "show_map": True,
-                "show_budget": True,
-                "show_checklist": True,
-                "enable_edit": True,
-                "poi_radius_km": 8,
-                "poi_limit": 50,
-                "poi_types": ["관광", "맛집", "카페", "자연", "문화"],
-                "debug_panel": False,
-                "openai_api_key": "",
-                "amadeus_client_id": "",
-                "amadeus_client_secret": "",
-                "use_amadeus_hotel": False,
-            },
-            "cache": {
-                "last_payload_sig": None,
-                "last_bundle": None,
-            },
-            "runtime": {
-                "itinerary_edits": {},
-                "poi_user_exclude_ids": set(),  # ✅ now exclude by osm_id
-            },
-            "hotel": {
-                "stars": [3, 4],
-                "max_price_per_night": 0,
-                "limit": 3,
-                "reorder_by_hotel": True,
-            },
-        }
+        st.session_state.app = default_app_state()
+
+
+# Streamlit 밖(벤치마크/배치)에서는 스레드별로 상태를 붙여서 sget/sset이 그걸 보게 함
+_detached = threading.local()
+
+
+def _app_state() -> Dict[str, Any]:
+    state = getattr(_detached, "app", None)
+    return st.session_state.app if state is None else state
+
+
+@contextmanager
+def detached_session(state: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    prev = getattr(_detached, "app", None)
+    _detached.app = state
+    try:
+        yield state
+    finally:
+        _detached.app = prev
 
 
 def sget(path: str, default=None):
-    cur = st.session_state.app
+    cur = _app_state()
     for k in path.split("."):
         if not isinstance(cur, dict) or k not in cur:
             return default
@@ -235,7 +366,7 @@ def sget(path: str, default=None):
 
 
 def sset(path: str, value):
-    cur = st.session_state.app
+    cur = _app_state()
     keys = path.split(".")
     for k in keys[:-1]:
         cur = cur.setdefault(k, {})
@@ -254,6 +385,18 @@ STAY_MINUTES = {
     "유흥": 120,
     "편의": 20,
 }
+DAY_START_MIN = 9 * 60  # 하루 일정 시작 09:00
+DAY_BUDGET_MIN = 480  # 이동+체류 8시간
+
+
+def poi_stay_minutes(poi: Dict[str, Any]) -> int:
+    return STAY_MINUTES.get(poi.get("type"), 60)
+
+
+def format_clock(minutes: float) -> str:
+    h, m = divmod(int(round(minutes)), 60)
+    return f"{h:02d}:{m:02d}"
+
 # =========================
 # Hotel Helpers
 # =========================
@@ -268,7 +411,7 @@ def amadeus_hotels_by_geocode(lat, lon, token, radius_km=5):
         "hotelSource": "ALL",
     }
 
-    r = requests.get(url, headers=headers, params=params, timeout=12)
+    r = _http("GET", url, headers=headers, params=params, timeout=12)
     r.raise_for_status()
     return r.json().get("data", [])
     
@@ -283,14 +426,15 @@ def amadeus_hotel_offers(hotel_ids, token, checkin, checkout, adults):
         "currency": "KRW",
     }
 
-    r = requests.get(url, headers=headers, params=params, timeout=15)
+    r = _http("GET", url, headers=headers, params=params, timeout=15)
     r.raise_for_status()
     return r.json().get("data", [])
     
-def fetch_hotels_amadeus(center_lat, center_lon, payload, hotel_opts):
+def fetch_hotels_amadeus(center_lat, center_lon, payload, hotel_opts, amadeus):
+    cache_lookup("amadeus_token")
     token = get_amadeus_token(
-        sget("ui.amadeus_client_id"),
-        sget("ui.amadeus_client_secret"),
+        amadeus.get("client_id", ""),
+        amadeus.get("client_secret", ""),
     )
 
     nights = duration_to_days(payload["duration"])
@@ -398,30 +542,44 @@ def score_hotel(hotel, center_lat, center_lon, styles, max_price):
 
     return round(score, 3)
 
-def recommend_hotels(poi_daymap, styles, hotel_opts, payload=None):
-    center = compute_itinerary_center(poi_daymap)
-    if not center:
-        return []
-
-    lat, lon = center
+@st.cache_data(show_spinner=False, ttl=60 * 30)  # ✅ 30 min (요금은 자주 바뀜)
+def fetch_hotels_amadeus_cached(lat, lon, start_date, duration, party_count, client_id, client_secret):
+    # 조회에 쓰는 값만 키로 → compare 변형/재생성이 같은 일정 중심이면 재사용. 실패(예외)는 캐시 안 됨
+    cache_miss("hotels")
+    return fetch_hotels_amadeus(
+        lat,
+        lon,
+        {"start_date": start_date, "duration": duration, "party_count": party_count},
+        {},
+        {"client_id": client_id, "client_secret": client_secret},
+    )
 
-    use_amadeus = bool(sget("ui.use_amadeus_hotel"))
-    hotels = []
 
+def fetch_hotel_candidates(lat, lon, hotel_opts, payload=None, amadeus=None):
+    # amadeus: {"client_id", "client_secret"} 이면 실제 데이터, None이면 mock
     try:
-        if use_amadeus and payload:
-            hotels = fetch_hotels_amadeus(lat, lon, payload, hotel_opts)
-        else:
-            hotels = fetch_hotels_mock(
-                lat,
-                lon,
-                hotel_opts.get("stars", []),
-                hotel_opts.get("max_price_per_night"),
-                hotel_opts.get("limit", 3),
+        if amadeus and payload:
+            cache_lookup("hotels")
+            return fetch_hotels_amadeus_cached(
+                round(lat, 6),
+                round(lon, 6),
+                payload["start_date"],
+                payload["duration"],
+                payload["party_count"],
+                amadeus.get("client_id", ""),
+                amadeus.get("client_secret", ""),
             )
+        return fetch_hotels_mock(
+            lat,
+            lon,
+            hotel_opts.get("stars", []),
+            hotel_opts.get("max_price_per_night"),
+            hotel_opts.get("limit", 3),
+        )
     except Exception as e:
         logger.warning("Amadeus 실패 → mock fallback: %s", e)
-        hotels = fetch_hotels_mock(
+        count_fallback("amadeus_mock")
+        return fetch_hotels_mock(
             lat,
             lon,
             hotel_opts.get("stars", []),
@@ -429,6 +587,15 @@ def recommend_hotels(poi_daymap, styles, hotel_opts, payload=None):
             hotel_opts.get("limit", 3),
         )
 
+
+def recommend_hotels(poi_daymap, styles, hotel_opts, payload=None, amadeus=None):
+    center = compute_itinerary_center(poi_daymap)
+    if not center:
+        return []
+
+    lat, lon = center
+    hotels = fetch_hotel_candidates(lat, lon, hotel_opts, payload=payload, amadeus=amadeus)
+
     scored = []
     for h in hotels:
         s = score_hotel(h, lat, lon, styles, hotel_opts.get("max_price_per_night"))
@@ -516,7 +683,7 @@ def _request_json(
     last_exc = None
     for attempt in range(retries + 1):
         try:
-            r = requests.request(method, url, params=params, data=data, headers=headers, timeout=timeout)
+            r = _http(method, url, params=params, data=data, headers=headers, timeout=timeout)
             # overpass can 429/504; treat as retryable
             if r.status_code in (429, 500, 502, 503, 504):
                 raise requests.HTTPError(f"{name} retryable status={r.status_code}", response=r)
@@ -539,278 +706,2072 @@ def _request_json(
     raise ApiError(f"{name} 호출 실패: {last_exc}")
 
 
-# =========================
-# Geocoding (Nominatim) - improved selection
-# =========================
-@st.cache_data(show_spinner=False, ttl=60 * 60 * 24 * 7)  # ✅ 7 days
-def geocode_place(query: str) -> Optional[Dict[str, Any]]:
-    if not query or not query.strip():
-        return None
-
-    headers = {"User-Agent": f"{APP_NAME}/1.0 (streamlit)"}
-    params = {
-        "q": query,
-        "format": "json",
-        "limit": 3,  # ✅ get a few candidates
-        "addressdetails": 1,
-    }
+def _request_stream(
+    method: str,
+    url: str,
+    *,
+    params: Optional[dict] = None,
+    data: Optional[bytes] = None,
+    headers: Optional[dict] = None,
+    timeout: int = 12,
+    retries: int = 2,
+    backoff: float = 0.5,
+    name: str = "API",
+) -> "requests.Response":
+    """
+    _request_json과 같은 재시도 규칙이지만 body를 읽지 않고 열린 Response를 반환.
+    - 호출자가 iter_content로 조금씩 읽고 close() 해야 함
+    """
+    last_exc = None
+    for attempt in range(retries + 1):
+        r = None
+        try:
+            r = _http(method, url, params=params, data=data, headers=headers, timeout=timeout, stream=True)
+            if r.status_code in (429, 500, 502, 503, 504):
+                raise requests.HTTPError(f"{name} retryable status={r.status_code}", response=r)
+            r.raise_for_status()
+            return r
+        except (requests.Timeout, requests.ConnectionError) as e:
+            last_exc = e
+            logger.warning("%s timeout/conn error (attempt %s/%s): %s", name, attempt + 1, retries + 1, e)
+        except requests.HTTPError as e:
+            last_exc = e
+            code = getattr(e.response, "status_code", None)
+            logger.warning("%s http error (attempt %s/%s): %s", name, attempt + 1, retries + 1, code)
+        except Exception as e:
+            last_exc = e
+            logger.exception("%s unknown error: %s", name, e)
 
-    try:
-        time.sleep(0.15)  # ✅ be nice to nominatim
-        data = _request_json("GET", NOMINATIM_URL, params=params, headers=headers, timeout=12, retries=1, name="Nominatim")
-        if not data:
-            return None
+        if r is not None:
+            r.close()
+        if attempt < retries:
+            time.sleep(backoff * (2**attempt))
 
-        # Prefer city/town, then administrative, then best importance
-        def score(item: dict) -> float:
-            t = item.get("type") or ""
-            cls = item.get("class") or ""
-            imp = float(item.get("importance") or 0.0)
-            s = imp
-            if t in ("city", "town"):
-                s += 2.0
-            if cls == "place":
-                s += 0.4
-            if t in ("administrative",):
-                s += 0.6
-            # Penalize country-level matches a bit
-            if t == "country" or cls == "boundary":
-                s -= 1.2
-            return s
-
-        best = sorted(data, key=score, reverse=True)[0]
-        return {
-            "lat": float(best["lat"]),
-            "lon": float(best["lon"]),
-            "display_name": best.get("display_name", query),
-            "raw": {"type": best.get("type"), "class": best.get("class"), "importance": best.get("importance")},
-        }
-    except Exception:
-        return None
+    raise ApiError(f"{name} 호출 실패: {last_exc}")
 
 
 # =========================
-# Weather (Open-Meteo)
+# HTTP fixtures (record / replay)
 # =========================
-@st.cache_data(show_spinner=False, ttl=60 * 60)  # ✅ 1 hour
-def fetch_open_meteo_forecast(lat: float, lon: float, days: int) -> Optional[Dict[str, Any]]:
-    try:
-        n = max(1, min(days, 16))
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum",
-            "timezone": "auto",
-            "forecast_days": n,
-        }
-        j = _request_json("GET", OPEN_METEO_URL, params=params, timeout=12, retries=1, name="Open-Meteo(Forecast)")
-        d = (j or {}).get("daily", {}) or {}
-        times = d.get("time", [])
-        tmax = d.get("temperature_2m_max", [])
-        tmin = d.get("temperature_2m_min", [])
-        prcp = d.get("precipitation_sum", [])
-        if not times or not tmax or not tmin:
-            return None
-        daily = []
-        for i in range(min(len(times), len(tmax), len(tmin), len(prcp))):
-            daily.append({"date": times[i], "tmax": tmax[i], "tmin": tmin[i], "prcp": prcp[i]})
-        return {"daily": daily}
-    except Exception:
-        return None
+HTTP_FIXTURES_DIR = os.getenv("HTTP_FIXTURES_DIR", os.path.join(APP_CACHE_DIR, "fixtures", "http"))
+HTTP_FIXTURES_MODE = os.getenv("HTTP_FIXTURES_MODE", "")  # "" | "record" | "replay" | "cache"
+_FIXTURE_SECRET_KEYS = {"authorization", "client_id", "client_secret", "api_key", "apikey", "key"}
 
 
-@st.cache_data(show_spinner=False, ttl=60 * 60 * 6)  # ✅ 6 hours
-def fetch_open_meteo_recent_snapshot(lat: float, lon: float) -> Optional[Dict[str, Any]]:
-    try:
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum",
-            "timezone": "auto",
-            "forecast_days": 7,
-        }
-        j = _request_json("GET", OPEN_METEO_URL, params=params, timeout=12, retries=1, name="Open-Meteo(Snapshot)")
-        d = (j or {}).get("daily", {}) or {}
-        tmax = d.get("temperature_2m_max", [])
-        tmin = d.get("temperature_2m_min", [])
-        prcp = d.get("precipitation_sum", [])
-        if not tmax or not tmin:
+class HttpFixtures:
+    """
+    업스트림 응답을 파일로 녹화/재생하는 전송 계층.
+    - 키 = sha1(method, url, params, body) — 인증 헤더/시크릿 필드는 키에도 파일에도 안 남김
+    - record: 실제 호출 후 <root>/<host>/<key>.json 저장
+    - replay: 파일에서 응답 복원 + 지연(latency_ms ± jitter_ms)/오류(error_rate) 주입
+      없는 fixture는 ConnectionError → 기존 재시도/폴백 경로 그대로 탐
+    - cache: max_age_s 안의 파일이 있으면 재생, 없으면 실제 호출 후 200만 저장
+      → 프로세스 간 공유 디스크 캐시(cli.py batch 워커들이 같은 geocode/Overpass 응답 재사용)
+    - call(): HTTP가 아닌 SDK 호출(OpenAI)도 같은 방식으로 JSON 결과를 녹화/재생
+    """
+
+    def __init__(
+        self,
+        root: str,
+        mode: str = "replay",
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+        max_age_s: Optional[float] = None,
+    ):
+        if mode not in ("record", "replay", "cache"):
+            raise ValueError(f"unknown fixture mode: {mode}")
+        self.root = root
+        self.mode = mode
+        self.max_age_s = max_age_s
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0, "injected_errors": 0}
+
+    @staticmethod
+    def _scrub(obj: Any) -> Any:
+        if isinstance(obj, dict):
+            return {k: v for k, v in sorted(obj.items()) if str(k).lower() not in _FIXTURE_SECRET_KEYS}
+        return obj
+
+    def key(self, method: str, url: str, params: Any = None, data: Any = None) -> str:
+        body = data if isinstance(data, (bytes, str)) else json.dumps(self._scrub(data), sort_keys=True, default=str)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        h = hashlib.sha1()
+        h.update(f"{method.upper()} {url}\n".encode("utf-8"))
+        h.update(json.dumps(self._scrub(params), sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\n")
+        h.update(body or b"")
+        return h.hexdigest()[:20]
+
+    def _path(self, group: str, key: str) -> str:
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", group), f"{key}.json")
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _inject(self, name: str) -> None:
+        # 재생 시 지연/오류 주입
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms))
+            fail = self._rng.random() < self.error_rate
+        if delay:
+            time.sleep(delay / 1000.0)
+        if fail:
+            self._count("injected_errors")
+            raise requests.Timeout(f"{name}: injected failure")
+
+    def _load(self, path: str, name: str) -> Dict[str, Any]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                rec = json.load(f)
+        except FileNotFoundError:
+            self._count("misses")
+            raise requests.ConnectionError(f"{name}: no fixture ({path})")
+        self._count("hits")
+        return rec
+
+    def _load_cached(self, path: str) -> Optional[Dict[str, Any]]:
+        # cache 모드: 없거나 max_age_s보다 오래됐으면 None(= 실제 호출)
+        try:
+            if self.max_age_s is not None and time.time() - os.path.getmtime(path) > self.max_age_s:
+                self._count("misses")
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                rec = json.load(f)
+        except (OSError, ValueError):
+            self._count("misses")
             return None
-        return {
-            "avg_max": round(sum(tmax) / len(tmax), 1),
-            "avg_min": round(sum(tmin) / len(tmin), 1),
-            "total_prcp": round(sum(prcp) if prcp else 0.0, 1),
+        self._count("hits")
+        return rec
+
+    def discard(self, method: str, url: str, params: Any = None, data: Any = None) -> None:
+        # 200이지만 내용이 망가진 응답(예: Overpass runtime error remark)을 캐시/녹화에서 제거
+        host = url.split("/")[2] if "://" in url else "local"
+        try:
+            os.remove(self._path(host, self.key(method, url, params, data)))
+        except OSError:
+            pass
+
+    def _save(self, path: str, rec: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rec, f, ensure_ascii=False, indent=1, default=str)
+        os.replace(tmp, path)
+        self._count("recorded")
+
+    def request(self, method: str, url: str, *, params=None, data=None, headers=None, timeout=None, stream=False):
+        host = url.split("/")[2] if "://" in url else "local"
+        path = self._path(host, self.key(method, url, params, data))
+        if self.mode == "replay":
+            self._inject(host)
+            return self._response(self._load(path, host))
+        if self.mode == "cache":
+            rec = self._load_cached(path)
+            if rec is not None:
+                return self._response(rec)
+
+        r = requests.request(method, url, params=params, data=data, headers=headers, timeout=timeout)
+        rec = {
+            "method": method.upper(),
+            "url": url,
+            "params": self._scrub(params),
+            "status": r.status_code,
+            "content_type": r.headers.get("Content-Type"),
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
         }
-    except Exception:
-        return None
+        try:
+            rec["body"] = r.content.decode("utf-8")
+        except UnicodeDecodeError:
+            rec["body_b64"] = base64.b64encode(r.content).decode("ascii")
+        if self.mode == "record" or r.status_code == 200:
+            self._save(path, rec)
+        return r
+
+    @staticmethod
+    def _response(rec: Dict[str, Any]) -> "requests.Response":
+        r = requests.Response()
+        r.status_code = rec["status"]
+        r.url = rec["url"]
+        r.headers["Content-Type"] = rec.get("content_type") or "application/json"
+        r.encoding = "utf-8"
+        r._content = base64.b64decode(rec["body_b64"]) if "body_b64" in rec else rec["body"].encode("utf-8")
+        r._content_consumed = True
+        return r
+
+    def call(self, name: str, key_obj: Any, fn: Callable[[], Any]) -> Any:
+        path = self._path(name, self.key("CALL", name, key_obj))
+        if self.mode == "replay":
+            self._inject(name)
+            return self._load(path, name)["result"]
+        if self.mode == "cache":
+            rec = self._load_cached(path)
+            if rec is not None:
+                return rec["result"]
+        result = fn()
+        self._save(path, {"name": name, "result": result, "recorded_at": datetime.now().isoformat(timespec="seconds")})
+        return result
+
+
+_http_fixtures_override: Optional[HttpFixtures] = None
+
+
+@st.cache_resource(show_spinner=False)
+def _env_http_fixtures(root: str, mode: str) -> Optional[HttpFixtures]:
+    return HttpFixtures(root, mode) if mode else None
+
+
+def set_http_fixtures(fx: Optional[HttpFixtures]) -> None:
+    # 벤치마크/배치 스크립트용(Streamlit 리런마다 모듈 전역이 초기화되니 앱에선 환경변수로)
+    global _http_fixtures_override
+    _http_fixtures_override = fx
+
+
+def http_fixtures() -> Optional[HttpFixtures]:
+    if _http_fixtures_override is not None:
+        return _http_fixtures_override
+    return _env_http_fixtures(HTTP_FIXTURES_DIR, HTTP_FIXTURES_MODE) if HTTP_FIXTURES_MODE else None
+
+
+def _http(method: str, url: str, **kwargs) -> "requests.Response":
+    trace_add("requests")
+    upstream = _upstream_label(url)
+    t0 = time.perf_counter()
+    fx = http_fixtures()
+    try:
+        if fx is not None:
+            r = fx.request(method, url, **kwargs)
+        else:
+            r = requests.request(method, url, **kwargs)
+    except Exception as e:
+        observe_upstream(upstream, time.perf_counter() - t0, type(e).__name__)
+        raise
+    observe_upstream(upstream, time.perf_counter() - t0, str(r.status_code))
+    if not kwargs.get("stream"):
+        trace_add("bytes", len(r.content or b""))
+    return r
 
 
 # =========================
-# Overpass POI
+# Tracing
 # =========================
-def _radius_to_bbox(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
-    lat_deg = radius_km / 110.574
-    lon_deg = radius_km / (111.320 * math.cos(math.radians(lat)) + 1e-9)
-    return (lat - lat_deg, lon - lon_deg, lat + lat_deg, lon + lon_deg)
+class Span:
+    __slots__ = ("name", "start", "end", "attrs", "children")
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs: Dict[str, Any] = dict(attrs or {})
+        self.children: List["Span"] = []
+
+    @property
+    def ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000.0
+
+    def to_dict(self, t0: Optional[float] = None) -> Dict[str, Any]:
+        t0 = self.start if t0 is None else t0
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - t0) * 1000.0, 1),
+            "ms": round(self.ms, 1),
+            "attrs": dict(self.attrs),
+            "children": [c.to_dict(t0) for c in self.children],
+        }
 
 
-def _overpass_query_bbox(south, west, north, east) -> str:
-    # (keep it simple: nodes only; stable & fast)
-    return f"""
-    [out:json][timeout:25];
-    (
-      node["tourism"~"attraction|museum|viewpoint"]({south},{west},{north},{east});
-      node["leisure"="park"]({south},{west},{north},{east});
-      node["natural"~"peak|beach"]({south},{west},{north},{east});
-      node["historic"~"monument|castle|memorial"]({south},{west},{north},{east});
-      node["amenity"~"restaurant|cafe|bar"]({south},{west},{north},{east});
-    );
-    out center;
-    """
+_trace_local = threading.local()
+_trace_lock = threading.Lock()
 
+# 루트 span은 이 시간(ms) 이상일 때만 INFO(그 밖엔 DEBUG) — 매 rerun의 "render"가 로그를 채우지 않게
+TRACE_LOG_MIN_MS = float(os.getenv("TRACE_LOG_MIN_MS", "200") or 0)
+# 자식 span 줄: 기본 DEBUG, TRACE_LOG_SPANS=1이면 INFO
+TRACE_LOG_SPANS = os.getenv("TRACE_LOG_SPANS", "0") != "0"
 
-def _poi_type(tags: Dict[str, Any]) -> str:
-    if "amenity" in tags:
-        v = tags["amenity"]
-        if v == "restaurant":
-            return "맛집"
-        if v == "cafe":
-            return "카페"
-        if v == "bar":
-            return "유흥"
-        return "편의"
-    if "tourism" in tags:
-        v = tags["tourism"]
-        if v == "museum":
-            return "문화"
-        if v in ["attraction", "viewpoint"]:
-            return "관광"
-        return "관광"
-    if tags.get("leisure") == "park":
-        return "자연"
-    if "natural" in tags:
-        return "자연"
-    if "historic" in tags:
-        return "문화"
-    return "관광"
 
+def _current_span() -> Optional[Span]:
+    return getattr(_trace_local, "span", None)
 
-def _poi_quality_score(tags: Dict[str, Any]) -> float:
-    """
-    강화된 POI 품질 휴리스틱:
-    - 실제 방문 가치가 낮은 잡음 POI 제거
-    """
-    s = 0.0
 
-    # 신뢰 신호
-    if tags.get("wikidata"):
-        s += 0.35
-    if tags.get("wikipedia"):
-        s += 0.35
-    if tags.get("image"):
-        s += 0.2
-    if tags.get("website"):
-        s += 0.1
-    if tags.get("opening_hours"):
-        s += 0.05
-    if tags.get("tourism") == "museum":
-        s += 0.12
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    # 진행 중인 trace가 없으면 아무것도 안 함(오버헤드 ≈ 0)
+    parent = _current_span()
+    if parent is None:
+        yield None
+        return
+    s = Span(name, attrs)
+    with _trace_lock:
+        parent.children.append(s)
+    _trace_local.span = s
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        _trace_local.span = parent
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Span]:
+    # 루트 span: 끝나면 JSON 로그(루트 1줄 + 자식 span 줄은 DEBUG). 이미 trace 안이면 그냥 자식 span
+    if _current_span() is not None:
+        with span(name, **attrs) as s:
+            yield s
+        return
+    root = Span(name, attrs)
+    _trace_local.span = root
+    try:
+        yield root
+    finally:
+        root.end = time.perf_counter()
+        _trace_local.span = None
+        _log_trace(root)
 
-    # ❌ 맛집 잡음 제거
-    if tags.get("amenity") == "restaurant":
-        if not any(tags.get(k) for k in ("opening_hours", "website", "cuisine", "wikidata")):
-            s -= 0.3
 
-    # ❌ 관광지 잡음 제거
-    if tags.get("tourism") == "attraction":
-        if not any(tags.get(k) for k in ("wikidata", "wikipedia", "description")):
-            s -= 0.25
+def trace_add(key: str, n: float = 1) -> None:
+    s = _current_span()
+    if s is not None:
+        with _trace_lock:
+            s.attrs[key] = s.attrs.get(key, 0) + n
 
-    # ❌ 너무 일반적인 이름
-    nm = (tags.get("name") or "").strip().lower()
-    if nm in ("park", "cafe", "restaurant") or len(nm) <= 2:
-        s -= 0.2
 
-    return round(s, 3)
+def trace_set(**attrs) -> None:
+    s = _current_span()
+    if s is not None:
+        with _trace_lock:
+            s.attrs.update(attrs)
 
 
-@st.cache_data(show_spinner=False, ttl=60 * 60 * 24)  # ✅ 1 day
-def fetch_pois_overpass(lat: float, lon: float, radius_km: float, limit: int):
-    south, west, north, east = _radius_to_bbox(lat, lon, radius_km)
-    query = _overpass_query_bbox(south, west, north, east)
+def _trace_bytes(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    for c in chunks:
+        trace_add("bytes", len(c))
+        yield c
 
-    for url in OVERPASS_URLS:
-        try:
-            j = _request_json(
-                "POST",
-                url,
-                data=query.encode("utf-8"),
-                timeout=35,
-                retries=1,
-                backoff=0.8,
-                name=f"Overpass({url})",
+
+def _log_trace(root: Span) -> None:
+    root_level = logging.INFO if root.ms >= TRACE_LOG_MIN_MS else logging.DEBUG
+    span_level = logging.INFO if TRACE_LOG_SPANS else logging.DEBUG
+    if not logger.isEnabledFor(max(root_level, span_level)):
+        return
+    trace_id = hashlib.sha1(f"{root.start}-{threading.get_ident()}".encode("utf-8")).hexdigest()[:12]
+
+    def walk(s: Span, parent: Optional[str], depth: int):
+        level = root_level if depth == 0 else span_level
+        if logger.isEnabledFor(level):
+            logger.log(
+                level,
+                json.dumps(
+                    {
+                        "event": "span",
+                        "trace": trace_id,
+                        "root": root.name,
+                        "span": s.name,
+                        "parent": parent,
+                        "depth": depth,
+                        "start_ms": round((s.start - root.start) * 1000.0, 1),
+                        "ms": round(s.ms, 1),
+                        "attrs": s.attrs,
+                    },
+                    ensure_ascii=False,
+                    default=str,
+                )
             )
-            elements = (j or {}).get("elements", []) or []
+        for c in s.children:
+            walk(c, s.name, depth + 1)
 
-            pois = []
-            for el in elements:
-                tags = el.get("tags", {}) or {}
-                name = tags.get("name")
-                if not name:
+    walk(root, None, 0)
+
+
+def flatten_trace(node: Dict[str, Any], depth: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+    out = [(depth, node)]
+    for c in node.get("children", []):
+        out += flatten_trace(c, depth + 1)
+    return out
+
+
+# =========================
+# Metrics (Prometheus text format)
+# =========================
+# METRICS_PORT가 있으면 http://METRICS_HOST:METRICS_PORT/metrics, METRICS_FILE이 있으면 주기적으로 파일 기록
+# (node_exporter textfile collector 등). 둘 다 없으면 집계만 하고 노출 안 함.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_INTERVAL_S = float(os.getenv("METRICS_INTERVAL_S", "15") or 15)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_DEFS: Dict[str, Tuple[str, str]] = {
+    "travelmaker_upstream_requests_total": ("counter", "HTTP/SDK calls to upstream APIs by outcome"),
+    "travelmaker_upstream_request_seconds": ("histogram", "Upstream call latency (streams: time to headers)"),
+    "travelmaker_fallbacks_total": ("counter", "Degraded paths taken (overpass_last_pois, overpass_empty, amadeus_mock, openai_rule_based)"),
+    "travelmaker_cache_lookups_total": ("counter", "Cache lookups by cache"),
+    "travelmaker_cache_misses_total": ("counter", "Cache misses by cache"),
+    "travelmaker_cache_hit_ratio": ("gauge", "1 - misses/lookups since process start"),
+    "travelmaker_plan_seconds": ("histogram", "generate_bundle wall time (built bundles only)"),
+    "travelmaker_stage_seconds": ("histogram", "generate_bundle stage wall time"),
+    "travelmaker_bundles_in_progress": ("gauge", "generate_bundle calls currently running"),
+    "travelmaker_last_plan_pois": ("gauge", "POIs used by the most recent plan"),
+    "travelmaker_profiles_saved_total": ("counter", "Profiles written to PROFILE_DIR"),
+    "travelmaker_warmup_items": ("gauge", "Startup cache warm-up progress (total/done/failed)"),
+    "travelmaker_import_seconds": ("gauge", "First import time of lazily loaded modules"),
+    "travelmaker_script_seconds": ("histogram", "Streamlit script run time per rerun (phase=module|main)"),
+    "travelmaker_compare_seconds": ("histogram", "compare_plans wall time (shared stages + all variants)"),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_text(labels: LabelKey, extra: str = "") -> str:
+    parts = [
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class MetricsRegistry:
+    """
+    프로세스 단위 counter/gauge/histogram (라벨별 시계열). 모든 세션/스레드가 공유.
+    - render(): Prometheus text exposition format 0.0.4
+    """
+
+    def __init__(self, defs: Dict[str, Tuple[str, str]], buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.defs = dict(defs)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[LabelKey, float]] = {}
+        self._hists: Dict[str, Dict[LabelKey, List[float]]] = {}  # [bucket counts..., sum, count]
+
+    def _series(self, name: str, kind: str) -> Dict[LabelKey, Any]:
+        if self.defs.get(name, (None,))[0] != kind:
+            raise KeyError(f"{name} is not a declared {kind}")
+        return (self._hists if kind == "histogram" else self._values).setdefault(name, {})
+
+    def inc(self, name: str, n: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series(name, self.defs.get(name, ("counter",))[0])
+            series[key] = series.get(key, 0.0) + n
+
+    def set(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series(name, "gauge")[key] = float(value)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series(name, "histogram")
+            h = series.get(key)
+            if h is None:
+                h = series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0.0)
+
+    def _hit_ratios(self) -> None:
+        lookups = self._values.get("travelmaker_cache_lookups_total", {})
+        misses = self._values.get("travelmaker_cache_misses_total", {})
+        ratios = self._values.setdefault("travelmaker_cache_hit_ratio", {})
+        for key, n in lookups.items():
+            if n:
+                ratios[key] = max(0.0, 1.0 - misses.get(key, 0.0) / n)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            self._hit_ratios()
+            for name, (kind, help_text) in self.defs.items():
+                series = self._hists.get(name) if kind == "histogram" else self._values.get(name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key in sorted(series):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_label_text(key)} {_fmt_value(series[key])}")
+                        continue
+                    h = series[key]
+                    for b, n in zip(self.buckets + (math.inf,), h[: len(self.buckets)] + [h[-1]]):
+                        le = 'le="%s"' % _fmt_value(b)
+                        lines.append(f"{name}_bucket{_label_text(key, le)} {_fmt_value(n)}")
+                    lines.append(f"{name}_sum{_label_text(key)} {repr(round(h[-2], 6))}")
+                    lines.append(f"{name}_count{_label_text(key)} {_fmt_value(h[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource(show_spinner=False)
+def metrics() -> MetricsRegistry:
+    return MetricsRegistry(METRIC_DEFS)
+
+
+def cache_lookup(cache: str) -> None:
+    trace_add("cache_lookups")
+    metrics().inc("travelmaker_cache_lookups_total", cache=cache)
+
+
+def cache_miss(cache: str) -> None:
+    # st.cache_data 함수 본문 첫 줄에서 호출(본문은 miss일 때만 실행됨)
+    trace_add("cache_misses")
+    metrics().inc("travelmaker_cache_misses_total", cache=cache)
+
+
+def count_fallback(kind: str) -> None:
+    trace_add(f"fallback_{kind}")
+    metrics().inc("travelmaker_fallbacks_total", kind=kind)
+
+
+_UPSTREAM_PREFIXES = [
+    (NOMINATIM_URL, "nominatim"),
+    (OPEN_METEO_URL, "open_meteo"),
+    (AMADEUS_BASE_URL, "amadeus"),
+] + [(u, "overpass") for u in OVERPASS_URLS]
+
+
+def _upstream_label(url: str) -> str:
+    for prefix, label in _UPSTREAM_PREFIXES:
+        if url.startswith(prefix):
+            return label
+    return url.split("://", 1)[-1].split("/", 1)[0] or "other"
+
+
+def observe_upstream(upstream: str, seconds: float, outcome: str) -> None:
+    m = metrics()
+    m.inc("travelmaker_upstream_requests_total", upstream=upstream, outcome=outcome)
+    m.observe("travelmaker_upstream_request_seconds", seconds, upstream=upstream)
+
+
+def _write_metrics_file(path: str) -> None:
+    # 같은 디렉터리에 쓰고 rename → 스크레이퍼가 반쯤 쓴 파일을 읽지 않음
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(metrics().render())
+    os.replace(tmp, path)
+
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_exporters() -> Dict[str, Any]:
+    """
+    프로세스당 1번: METRICS_PORT → /metrics HTTP 서버(데몬 스레드), METRICS_FILE → 주기적 파일 기록.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    started: Dict[str, Any] = {}
+
+    if METRICS_PORT:
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics().render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            started["http"] = f"http://{METRICS_HOST}:{server.server_address[1]}/metrics"
+            logger.info("metrics endpoint: %s", started["http"])
+        except OSError as e:
+            logger.warning("metrics endpoint failed (%s:%s): %s", METRICS_HOST, METRICS_PORT, e)
+
+    if METRICS_FILE:
+
+        def loop():
+            while True:
+                try:
+                    _write_metrics_file(METRICS_FILE)
+                except Exception as e:
+                    logger.warning("metrics file write failed (%s): %s", METRICS_FILE, e)
+                time.sleep(max(1.0, METRICS_INTERVAL_S))
+
+        threading.Thread(target=loop, name="metrics-file", daemon=True).start()
+        started["file"] = METRICS_FILE
+
+    return started
+
+
+# =========================
+# Profiling (opt-in)
+# =========================
+# PROFILE_SAMPLE_RATE: 이 비율의 요청은 cProfile(결정적, 요청 스레드만)
+# PROFILE_SLOW_MS: 나머지 요청엔 스택 샘플러(워커 스레드 포함, ms는 스레드 합산)를 붙여두고, 이 시간을 넘긴 것만 저장
+# 저장: PROFILE_DIR/<시각>-<대상>-<서명>-<ms>ms.json (+ cProfile이면 .prof), 최신 PROFILE_KEEP개만 유지
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(APP_CACHE_DIR, "profiles"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0") or 0)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5") or 5)
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50") or 50)
+PROFILE_MAX_DEPTH = 96
+
+
+def _code_label(code) -> str:
+    # pstats와 같은 모양: file:line(func)
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class StackSampler:
+    """
+    sys._current_frames()를 주기적으로 떠서 붙은(attach) 스레드들의 스택을 집계.
+    - 요청 스레드 + _run_parallel 워커만 보므로 다른 세션 스레드는 섞이지 않음
+    """
+
+    kind = "sampler"
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval_s = max(0.001, interval_ms / 1000.0)
+        self.stacks: Dict[Tuple[str, ...], int] = {}
+        self.samples = 0
+        self._threads: Set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def attach(self) -> None:
+        with self._lock:
+            self._threads.add(threading.get_ident())
+
+    def detach(self) -> None:
+        with self._lock:
+            self._threads.discard(threading.get_ident())
+
+    def start(self) -> None:
+        self.attach()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            frames = sys._current_frames()
+            with self._lock:
+                tids = list(self._threads)
+            for tid in tids:
+                f = frames.get(tid)
+                stack: List[str] = []
+                while f is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    stack.append(_code_label(f.f_code))
+                    f = f.f_back
+                if stack:
+                    key = tuple(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                    self.samples += 1
+
+    def functions(self) -> List[Dict[str, Any]]:
+        ms = self.interval_s * 1000.0
+        self_n: Dict[str, int] = {}
+        cum_n: Dict[str, int] = {}
+        for stack, n in self.stacks.items():
+            self_n[stack[-1]] = self_n.get(stack[-1], 0) + n
+            for func in set(stack):
+                cum_n[func] = cum_n.get(func, 0) + n
+        return [
+            {"func": func, "self_ms": round(self_n.get(func, 0) * ms, 1), "cum_ms": round(n * ms, 1), "samples": n}
+            for func, n in cum_n.items()
+        ]
+
+    def folded(self, limit: int = 300) -> List[str]:
+        # flamegraph.pl / speedscope가 읽는 collapsed stack 형식
+        top = sorted(self.stacks.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [f"{';'.join(stack)} {n}" for stack, n in top]
+
+
+class CProfileCapture:
+    kind = "cprofile"
+
+    def __init__(self):
+        self.prof = cProfile.Profile()
+
+    def attach(self) -> None:
+        pass  # 결정적 프로파일은 요청 스레드만(워커 시간은 _run_parallel 대기로 보임)
+
+    def detach(self) -> None:
+        pass
+
+    def start(self) -> None:
+        self.prof.enable()
+
+    def stop(self) -> None:
+        self.prof.disable()
+
+    def functions(self) -> List[Dict[str, Any]]:
+        out = []
+        for (path, line, name), (_cc, nc, tt, ct, _callers) in pstats.Stats(self.prof).stats.items():
+            out.append(
+                {
+                    "func": f"{os.path.basename(path)}:{line}({name})",
+                    "self_ms": round(tt * 1000.0, 2),
+                    "cum_ms": round(ct * 1000.0, 2),
+                    "calls": nc,
+                }
+            )
+        return out
+
+    def folded(self, limit: int = 300) -> List[str]:
+        return []
+
+
+_profile_local = threading.local()
+
+
+def _current_profile():
+    return getattr(_profile_local, "capture", None)
+
+
+def _rotate_profiles(root: str, keep: int) -> None:
+    docs = sorted(f for f in os.listdir(root) if f.endswith(".json"))
+    for name in docs[: max(0, len(docs) - keep)]:
+        for path in (os.path.join(root, name), os.path.join(root, name[: -len(".json")] + ".prof")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _save_profile(capture, target: str, sig_id: str, elapsed_ms: float) -> Optional[str]:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = datetime.now()
+    base = f"{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}-{target}-{sig_id or 'nosig'}-{int(elapsed_ms)}ms"
+    path = os.path.join(PROFILE_DIR, base + ".json")
+    doc = {
+        "target": target,
+        "sig": sig_id,
+        "kind": capture.kind,
+        "ms": round(elapsed_ms, 1),
+        "created": now.isoformat(timespec="seconds"),
+        "interval_ms": PROFILE_INTERVAL_MS if capture.kind == "sampler" else None,
+        "functions": sorted(capture.functions(), key=lambda f: f["self_ms"], reverse=True),
+        "stacks": capture.folded(),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False)
+    if isinstance(capture, CProfileCapture):
+        capture.prof.dump_stats(os.path.join(PROFILE_DIR, base + ".prof"))
+    _rotate_profiles(PROFILE_DIR, PROFILE_KEEP)
+    return path
+
+
+@contextmanager
+def profiled(target: str, sig: Any = "") -> Iterator[None]:
+    """
+    generate_bundle/page3 프로파일 훅. 꺼져 있거나 이미 바깥에서 잡는 중이면 그냥 통과.
+    - sig: 서명 문자열 또는 끝날 때 호출할 함수(page3는 렌더 후에야 서명을 앎)
+    """
+    if (PROFILE_SLOW_MS <= 0 and PROFILE_SAMPLE_RATE <= 0) or _current_profile() is not None:
+        yield
+        return
+
+    capture = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        capture = CProfileCapture()
+        try:
+            capture.start()
+        except ValueError:
+            capture = None  # 다른 세션이 이미 프로파일러 사용 중(3.12+) → 샘플러로
+    if capture is None and PROFILE_SLOW_MS > 0:
+        capture = StackSampler()
+        capture.start()
+    if capture is None:
+        yield
+        return
+
+    _profile_local.capture = capture
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        capture.stop()
+        _profile_local.capture = None
+        if capture.kind == "cprofile" or elapsed_ms >= PROFILE_SLOW_MS:
+            try:
+                sig_text = sig() if callable(sig) else sig
+                sig_id = hashlib.sha1(sig_text.encode("utf-8")).hexdigest()[:12] if sig_text else ""
+                path = _save_profile(capture, target, sig_id, elapsed_ms)
+                metrics().inc("travelmaker_profiles_saved_total", target=target, kind=capture.kind)
+                logger.info("profile saved (%s, %.0fms): %s", target, elapsed_ms, path)
+            except Exception as e:
+                logger.warning("profile save failed: %s", e)
+
+
+def list_profiles(root: str = PROFILE_DIR) -> List[Dict[str, Any]]:
+    if not os.path.isdir(root):
+        return []
+    out = []
+    for name in sorted(f for f in os.listdir(root) if f.endswith(".json")):
+        try:
+            with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except Exception as e:
+            logger.warning("profile load failed (%s): %s", name, e)
+            continue
+        out.append({"file": name, **{k: doc.get(k) for k in ("target", "sig", "kind", "ms", "created")}, "doc": doc})
+    return out
+
+
+def profile_top(doc: Dict[str, Any], n: int = 20, sort: str = "self_ms") -> List[Dict[str, Any]]:
+    return sorted(doc.get("functions") or [], key=lambda f: f.get(sort, 0), reverse=True)[:n]
+
+
+def diff_profiles(a: Dict[str, Any], b: Dict[str, Any], n: int = 20, sort: str = "self_ms") -> List[Dict[str, Any]]:
+    # b - a, 함수별(file:line(func)) — 변화량 절댓값 큰 순
+    fa = {f["func"]: f.get(sort, 0.0) for f in a.get("functions") or []}
+    fb = {f["func"]: f.get(sort, 0.0) for f in b.get("functions") or []}
+    rows = [
+        {"func": func, "a": fa.get(func, 0.0), "b": fb.get(func, 0.0), "delta": round(fb.get(func, 0.0) - fa.get(func, 0.0), 2)}
+        for func in set(fa) | set(fb)
+    ]
+    return sorted(rows, key=lambda r: abs(r["delta"]), reverse=True)[:n]
+
+
+# =========================
+# Concurrency helpers
+# =========================
+class _RateLimiter:
+    """
+    요청 시작 간격을 min_interval 이상으로 유지(스레드 간 공유, 슬롯 예약 후 lock 밖에서 대기).
+    - shared: multiprocessing.Value('d') 를 주면 다음 슬롯을 프로세스 간에도 공유(배치 워커)
+    """
+
+    def __init__(self, min_interval: float, shared: Any = None):
+        self.min_interval = min_interval
+        self._shared = shared
+        self._lock = shared.get_lock() if shared is not None else threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._shared is not None:
+                slot = max(now, self._shared.value)
+                self._shared.value = slot + self.min_interval
+            else:
+                slot = max(now, self._next)
+                self._next = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# 배치(cli.py batch) 워커가 프로세스 시작 시 채움 → 아래 limiter/slot이 프로세스 간 공유 객체를 씀
+_shared_limits: Dict[str, Any] = {}
+OVERPASS_MAX_CONCURRENCY = int(os.getenv("OVERPASS_MAX_CONCURRENCY", "4") or 4)
+
+
+def install_shared_limits(nominatim_next: Any = None, overpass_slots: Any = None) -> None:
+    _shared_limits.update({"nominatim": nominatim_next, "overpass": overpass_slots})
+
+
+@st.cache_resource(show_spinner=False)
+def _nominatim_limiter() -> _RateLimiter:
+    # ✅ be nice to nominatim — 세션/rerun/스레드 전체에서 하나만
+    return _RateLimiter(0.15, shared=_shared_limits.get("nominatim"))
+
+
+@st.cache_resource(show_spinner=False)
+def _overpass_slots():
+    return _shared_limits.get("overpass") or threading.BoundedSemaphore(OVERPASS_MAX_CONCURRENCY)
+
+
+def _run_parallel(fn: Callable[[Any], Any], items: Iterable[Any], max_workers: int = 4) -> List[Any]:
+    """
+    items를 스레드로 병렬 처리하고 입력 순서대로 결과 반환.
+    - 워커에도 현재 ScriptRunContext를 붙여서 st.cache_data가 경고 없이 동작
+    - detached_session 상태, 현재 trace span, 진행 중인 프로파일 샘플러도 워커로 전달
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(x) for x in items]
+
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+    detached = getattr(_detached, "app", None)
+    parent_span = _current_span()
+    capture = _current_profile()
+
+    def run(x):
+        if ctx is not None and add_script_run_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        _trace_local.span = parent_span
+        if capture is not None:
+            capture.attach()
+        try:
+            if detached is None:
+                return fn(x)
+            with detached_session(detached):
+                return fn(x)
+        finally:
+            _trace_local.span = None
+            if capture is not None:
+                capture.detach()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as ex:
+        return list(ex.map(run, items))
+
+
+# =========================
+# Geocoding (Nominatim) - improved selection
+# =========================
+# Prefer city/town, then administrative, then best importance
+def _geocode_score(item: dict) -> float:
+    t = item.get("type") or ""
+    cls = item.get("class") or ""
+    imp = float(item.get("importance") or 0.0)
+    s = imp
+    if t in ("city", "town"):
+        s += 2.0
+    if cls == "place":
+        s += 0.4
+    if t in ("administrative",):
+        s += 0.6
+    # Penalize country-level matches a bit
+    if t == "country" or cls == "boundary":
+        s -= 1.2
+    return s
+
+
+# =========================
+# Local gazetteer (mmap)
+# =========================
+# data/gazetteer.tsv: 정규화 키로 정렬된 한 줄 = 별칭 하나
+#   key \t name \t lat \t lon \t class \t type \t importance \t display_name
+# 원본은 data/gazetteer_places.tsv, `python cli.py build-gazetteer`로 재생성
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.tsv"),
+)
+
+
+def _gazetteer_norm(text: str) -> str:
+    t = unicodedata.normalize("NFKC", text or "").strip().lower()
+    t = re.sub(r",\s*city$", "", t)  # generate_bundle의 해외 도시 힌트
+    return re.sub(r"[\s.,'’\-_/()]+", "", t)
+
+
+class Gazetteer:
+    """
+    정렬된 TSV를 mmap으로 열고 줄 단위 이분탐색.
+    - 정확히 일치 → 없으면 접두 일치(후보가 한 장소로 모이고, 라틴은 키 길이에 비례해 충분히 길 때만)
+    - 후보 선택은 Nominatim과 같은 _geocode_score
+    """
+
+    MAX_PREFIX_SCAN = 32
+    MIN_LATIN_PREFIX = 4
+    MIN_LATIN_PREFIX_RATIO = 0.6
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._size = len(self._mm)
+
+    def _line(self, start: int) -> Tuple[bytes, int]:
+        end = self._mm.find(b"\n", start)
+        if end == -1:
+            end = self._size
+        return self._mm[start:end], end
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._mm.rfind(b"\n", 0, mid) + 1
+            line, end = self._line(start)
+            if line.split(b"\t", 1)[0] < key:
+                lo = end + 1
+            else:
+                hi = start
+        return lo
+
+    def _iter_from(self, key: bytes) -> Iterator[Tuple[bytes, List[str]]]:
+        pos = self._lower_bound(key)
+        while pos < self._size:
+            line, end = self._line(pos)
+            pos = end + 1
+            if not line.strip():
+                continue
+            k, rest = line.split(b"\t", 1)
+            yield k, rest.decode("utf-8").rstrip("\r").split("\t")
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        q = _gazetteer_norm(query)
+        if not q:
+            return None
+        qb = q.encode("utf-8")
+
+        exact: List[List[str]] = []
+        prefix: List[Tuple[bytes, List[str]]] = []
+        for k, cols in self._iter_from(qb):
+            if k == qb:
+                exact.append(cols)
+            elif k.startswith(qb) and len(prefix) < self.MAX_PREFIX_SCAN:
+                prefix.append((k, cols))
+            else:
+                break
+
+        cands = exact
+        if not cands:
+            # 접두 일치는 한 장소로 수렴할 때만. 라틴은 4자 이상 + 모든 후보 키 길이의 60% 이상
+            # (예: "vancou" → vancouver ✓, "san"/"par"/"tok"/"van" ✗ → Nominatim이 판단)
+            if not prefix or len({c[0] for _, c in prefix}) != 1:
+                return None
+            if any("가" <= ch <= "힣" for ch in q):
+                if len(q) < 2:
+                    return None
+            elif len(q) < self.MIN_LATIN_PREFIX or any(
+                len(q) < self.MIN_LATIN_PREFIX_RATIO * len(k.decode("utf-8")) for k, _ in prefix
+            ):
+                return None
+            cands = [c for _, c in prefix]
+
+        items = [
+            {"name": c[0], "lat": c[1], "lon": c[2], "class": c[3], "type": c[4], "importance": c[5], "display_name": c[6]}
+            for c in cands
+        ]
+        best = max(items, key=_geocode_score)
+        return {
+            "lat": float(best["lat"]),
+            "lon": float(best["lon"]),
+            "display_name": best["display_name"],
+            "raw": {"type": best["type"], "class": best["class"], "importance": float(best["importance"]), "source": "gazetteer"},
+        }
+
+
+def build_gazetteer(src_path: str, out_path: str) -> Dict[str, int]:
+    """places TSV(이름|별칭... 한 줄 = 한 장소) → 키 정렬된 조회용 TSV."""
+    rows: Dict[str, Tuple[str, ...]] = {}
+    places = 0
+    with open(src_path, encoding="utf-8") as f:
+        for raw in f:
+            line = raw.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            names, lat, lon, cls, typ, imp, display = line.split("\t")
+            aliases = [n for n in names.split("|") if n.strip()]
+            places += 1
+            for alias in aliases:
+                key = _gazetteer_norm(alias)
+                if not key:
                     continue
+                cand = (aliases[0], lat, lon, cls, typ, imp, display)
+                prev = rows.get(key)
+                # 같은 키가 여러 장소면 점수 높은 쪽만 유지
+                if prev is None or _geocode_score({"type": typ, "class": cls, "importance": imp}) > _geocode_score(
+                    {"type": prev[4], "class": prev[3], "importance": prev[5]}
+                ):
+                    rows[key] = cand
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = f"{out_path}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        # UTF-8 바이트 순 == 코드포인트 순 → mmap 이분탐색과 일치
+        for key in sorted(rows):
+            f.write("\t".join((key,) + rows[key]) + "\n")
+    os.replace(tmp, out_path)
+    return {"places": places, "keys": len(rows)}
+
+
+@st.cache_resource(show_spinner=False)
+def _load_gazetteer(path: str) -> Optional[Gazetteer]:
+    if not os.path.exists(path):
+        return None
+    try:
+        return Gazetteer(path)
+    except Exception as e:
+        logger.warning("gazetteer load failed (%s): %s", path, e)
+        return None
+
+
+@st.cache_data(show_spinner=False, ttl=60 * 60 * 24 * 7)  # ✅ 7 days
+def _geocode_lookup(query: str) -> Optional[Dict[str, Any]]:
+    """
+    gazetteer → Nominatim. 결과 없음은 None(캐시됨), 호출 실패는 예외(캐시 안 됨 → 다음에 재시도).
+    """
+    cache_miss("geocode")  # 본문은 캐시 miss일 때만 실행됨
+    # ✅ 자주 쓰는 도시/지역은 로컬 gazetteer로 즉시 응답 → miss만 Nominatim
+    gaz = _load_gazetteer(GAZETTEER_PATH)
+    if gaz is not None:
+        try:
+            hit = gaz.lookup(query)
+            if hit:
+                return hit
+        except Exception as e:
+            logger.warning("gazetteer lookup failed: %s", e)
+
+    headers = {"User-Agent": f"{APP_NAME}/1.0 (streamlit)"}
+    params = {
+        "q": query,
+        "format": "json",
+        "limit": 3,  # ✅ get a few candidates
+        "addressdetails": 1,
+    }
+
+    _nominatim_limiter().wait()
+    data = _request_json("GET", NOMINATIM_URL, params=params, headers=headers, timeout=12, retries=1, name="Nominatim")
+    if not data:
+        return None
+
+    best = sorted(data, key=_geocode_score, reverse=True)[0]
+    return {
+        "lat": float(best["lat"]),
+        "lon": float(best["lon"]),
+        "display_name": best.get("display_name", query),
+        "raw": {"type": best.get("type"), "class": best.get("class"), "importance": best.get("importance")},
+    }
+
+
+def geocode_place(query: str) -> Optional[Dict[str, Any]]:
+    if not query or not query.strip():
+        return None
+    cache_lookup("geocode")
+    try:
+        return _geocode_lookup(query)
+    except Exception:
+        return None
+
+
+def geocode_many(queries: List[str], max_workers: int = 4) -> List[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    여러 장소를 한 번에 지오코딩 → 입력 순서대로 [(geo, err)].
+    - 공백 정리 후 중복 제거, gazetteer hit은 바로 응답
+    - 나머지는 병렬로 _geocode_lookup(캐시 → Nominatim, 공유 rate limit)
+    """
+    norm = [" ".join((q or "").split()) for q in queries]
+    uniq = list(dict.fromkeys(q for q in norm if q))
+
+    resolved: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]] = {}
+    misses: List[str] = []
+    gaz = _load_gazetteer(GAZETTEER_PATH)
+    for q in uniq:
+        hit = None
+        if gaz is not None:
+            try:
+                hit = gaz.lookup(q)
+            except Exception as e:
+                logger.warning("gazetteer lookup failed: %s", e)
+        if hit:
+            trace_add("gazetteer_hits")
+            resolved[q] = (hit, None)
+        else:
+            misses.append(q)
+
+    def one(q: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        cache_lookup("geocode")
+        try:
+            geo = _geocode_lookup(q)
+            return geo, (None if geo else "검색 결과 없음")
+        except Exception as e:
+            return None, str(e)
+
+    for q, out in zip(misses, _run_parallel(one, misses, max_workers=max_workers)):
+        resolved[q] = out
+
+    return [resolved[q] if q else (None, "빈 입력") for q in norm]
+
+
+# =========================
+# Weather (Open-Meteo)
+# =========================
+WEATHER_BUCKET_DEG = 0.1  # ≈ 11 km: 근처 지오코드(같은 도시의 다른 표기 등)는 같은 캐시 항목 공유
+WEATHER_MAX_DAYS = 16  # Open-Meteo 예보 최대 범위
+
+
+def _weather_bucket(lat: float, lon: float) -> Tuple[float, float]:
+    return (
+        round(round(lat / WEATHER_BUCKET_DEG) * WEATHER_BUCKET_DEG, 4),
+        round(round(lon / WEATHER_BUCKET_DEG) * WEATHER_BUCKET_DEG, 4),
+    )
+
+
+@st.cache_data(show_spinner=False, ttl=60 * 60)  # ✅ 1 hour
+def _fetch_open_meteo_daily(lat: float, lon: float) -> Optional[List[Dict[str, Any]]]:
+    # 버킷 좌표당 1회, 가장 넓은 창(16일) → 스냅샷/예보는 여기서 잘라 씀
+    cache_miss("weather")
+    try:
+        params = {
+            "latitude": lat,
+            "longitude": lon,
+            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum",
+            "timezone": "auto",
+            "forecast_days": WEATHER_MAX_DAYS,
+        }
+        j = _request_json("GET", OPEN_METEO_URL, params=params, timeout=12, retries=1, name="Open-Meteo")
+        d = (j or {}).get("daily", {}) or {}
+        times = d.get("time", [])
+        tmax = d.get("temperature_2m_max", [])
+        tmin = d.get("temperature_2m_min", [])
+        prcp = d.get("precipitation_sum", [])
+        if not times or not tmax or not tmin:
+            return None
+        daily = []
+        for i in range(min(len(times), len(tmax), len(tmin), len(prcp))):
+            if tmax[i] is None or tmin[i] is None:
+                continue
+            daily.append({"date": times[i], "tmax": tmax[i], "tmin": tmin[i], "prcp": prcp[i] or 0.0})
+        return daily or None
+    except Exception:
+        return None
+
+
+def fetch_open_meteo_daily(lat: float, lon: float) -> Optional[List[Dict[str, Any]]]:
+    cache_lookup("weather")
+    return _fetch_open_meteo_daily(*_weather_bucket(lat, lon))
+
+
+def fetch_open_meteo_forecast(lat: float, lon: float, days: int, start: Optional[date] = None) -> Optional[Dict[str, Any]]:
+    # start가 있으면 그 날짜부터(여행 날짜와 맞춤), 없으면 오늘부터
+    daily = fetch_open_meteo_daily(lat, lon)
+    if not daily:
+        return None
+    if start is not None:
+        first = start.isoformat()
+        daily = [w for w in daily if w["date"] >= first]
+    daily = daily[: max(1, min(days, WEATHER_MAX_DAYS))]
+    return {"daily": daily} if daily else None
+
+
+def fetch_open_meteo_recent_snapshot(lat: float, lon: float) -> Optional[Dict[str, Any]]:
+    daily = (fetch_open_meteo_daily(lat, lon) or [])[:7]
+    if not daily:
+        return None
+    return {
+        "avg_max": round(sum(w["tmax"] for w in daily) / len(daily), 1),
+        "avg_min": round(sum(w["tmin"] for w in daily) / len(daily), 1),
+        "total_prcp": round(sum(w["prcp"] for w in daily), 1),
+    }
+
+
+# =========================
+# Climatology (월 평년값)
+# =========================
+CLIMATE_PATH = os.getenv(
+    "CLIMATE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "climatology.bin"),
+)
+CLIMATE_MAGIC = b"TMCLIM01"
+CLIMATE_CELL_DEG = 1.0  # ≈ 110km: 월 평년값은 이 정도 해상도면 충분
+
+_CLIMATE_HEADER = struct.Struct("<8sIId")  # magic, n_cells, meta_len, cell_deg
+_CLIMATE_CELL = struct.Struct("<q" + "hhHBB" * 12)  # cell_key + 월별(tmax×10, tmin×10, prcp mm×10, 비 온 날, 표본 연수)
+_DAYS_IN_MONTH = [31, 28.25, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+class ClimateNormals:
+    """
+    mmap으로 여는 월 평년값 표(셀 키 정렬 → 이분탐색).
+    - 셀 하나 = 104바이트(_CLIMATE_CELL.size), 전 세계 육지 1° 격자여도 수 MB
+    - 해당 셀에 값이 없으면(해안/섬) 주변 8칸 중 표본 많은 칸으로
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_cells, meta_len, cell_deg = _CLIMATE_HEADER.unpack_from(self._mm, 0)
+        if magic != CLIMATE_MAGIC:
+            raise ValueError(f"not a climatology file: {path}")
+        off = _CLIMATE_HEADER.size
+        self.meta = json.loads(self._mm[off : off + meta_len].decode("utf-8"))
+        self.cell_deg = cell_deg
+        self.n_cells = n_cells
+        self._cells_off = off + meta_len
+
+    def _find(self, key: int) -> Optional[Tuple]:
+        lo, hi = 0, self.n_cells
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from("<q", self._mm, self._cells_off + mid * _CLIMATE_CELL.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_cells:
+            rec = _CLIMATE_CELL.unpack_from(self._mm, self._cells_off + lo * _CLIMATE_CELL.size)
+            if rec[0] == key:
+                return rec
+        return None
+
+    def month(self, lat: float, lon: float, month: int) -> Optional[Dict[str, Any]]:
+        r0, c0 = _poi_cell_rc(lat, lon, self.cell_deg)
+        best = None
+        for dr, dc in [(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
+            rec = self._find(_poi_cell_key(r0 + dr, c0 + dc, self.cell_deg))
+            if rec is None:
+                continue
+            tmax, tmin, prcp, rain_days, years = rec[1 + (month - 1) * 5 : 6 + (month - 1) * 5]
+            if years and (best is None or years > best["years"]):
+                best = {
+                    "month": month,
+                    "tmax": tmax / 10,
+                    "tmin": tmin / 10,
+                    "prcp": round(prcp / 10),
+                    "rain_days": rain_days,
+                    "years": years,
+                }
+            if best and (dr, dc) == (0, 0):
+                break
+        return best
+
+
+def write_climatology(
+    samples: Iterable[Tuple[float, float, str, float, float, float]],
+    path: str,
+    source: str = "",
+    cell_deg: float = CLIMATE_CELL_DEG,
+) -> Dict[str, Any]:
+    """
+    일별 관측/재분석 값 (lat, lon, "YYYY-MM-DD", tmax, tmin, prcp) → 셀×월 평년값 파일.
+    - 기온: 일 평균, 강수: 일 평균 × 월 일수(부분 월 데이터도 치우치지 않게)
+    - 비 온 날: 1mm 이상 비율 × 월 일수
+    """
+    acc: Dict[Tuple[int, int], List[Any]] = {}
+    n = 0
+    for lat, lon, day, tmax, tmin, prcp in samples:
+        if tmax is None or tmin is None:
+            continue
+        key = _poi_cell_key(*_poi_cell_rc(lat, lon, cell_deg), cell_deg)
+        m = int(day[5:7]) - 1
+        a = acc.get((key, m))
+        if a is None:
+            a = acc[(key, m)] = [0.0, 0.0, 0.0, 0, 0, set()]
+        a[0] += tmax
+        a[1] += tmin
+        a[2] += prcp or 0.0
+        a[3] += 1 if (prcp or 0.0) >= 1.0 else 0
+        a[4] += 1
+        a[5].add(day[:4])
+        n += 1
+
+    cells: Dict[int, List[int]] = {}
+    for (key, m), (stx, stn, sp, rd, cnt, yrs) in acc.items():
+        row = cells.setdefault(key, [0] * 60)
+        row[m * 5 : m * 5 + 5] = [
+            int(round(stx / cnt * 10)),
+            int(round(stn / cnt * 10)),
+            min(65535, int(round(sp / cnt * _DAYS_IN_MONTH[m] * 10))),
+            min(255, int(round(rd / cnt * _DAYS_IN_MONTH[m]))),
+            min(255, len(yrs)),
+        ]
+
+    meta = json.dumps(
+        {"built_at": datetime.now().isoformat(timespec="seconds"), "source": source, "samples": n},
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_CLIMATE_HEADER.pack(CLIMATE_MAGIC, len(cells), len(meta), cell_deg))
+        f.write(meta)
+        for key in sorted(cells):
+            f.write(_CLIMATE_CELL.pack(key, *cells[key]))
+    os.replace(tmp, path)
+    return {"cells": len(cells), "samples": n, "bytes": os.path.getsize(path)}
+
+
+@st.cache_resource(show_spinner=False)
+def _load_climatology(path: str) -> Optional[ClimateNormals]:
+    if not os.path.exists(path):
+        return None
+    try:
+        clim = ClimateNormals(path)
+        logger.info("Climatology loaded: %s (%s cells)", path, clim.n_cells)
+        return clim
+    except Exception as e:
+        logger.warning("Climatology load failed (%s): %s", path, e)
+        return None
+
+
+def climate_normals(lat: float, lon: float, month: int) -> Optional[Dict[str, Any]]:
+    # 파일이 없으면 None → 호출부는 month_hint로
+    clim = _load_climatology(CLIMATE_PATH)
+    return clim.month(lat, lon, month) if clim else None
+
+
+def format_climate(c: Dict[str, Any]) -> str:
+    return f"{c['month']}월 평년: {c['tmin']:.0f}~{c['tmax']:.0f}°C, 강수 {c['prcp']}mm(비 온 날 약 {c['rain_days']}일)"
+
+
+# =========================
+# Overpass POI
+# =========================
+def _radius_to_bbox(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    lat_deg = radius_km / 110.574
+    lon_deg = radius_km / (111.320 * math.cos(math.radians(lat)) + 1e-9)
+    return (lat - lat_deg, lon - lon_deg, lat + lat_deg, lon + lon_deg)
+
+
+# (key, op, value, 카테고리별 서버측 상한 가중치) — _poi_type 분류와 1:1로 맞춤
+# op "~"는 Overpass 정규식(부분 일치), "="는 정확히 일치
+OVERPASS_CATEGORIES: List[Tuple[str, str, str, float]] = [
+    ("tourism", "~", "attraction|museum|viewpoint", 1.0),
+    ("leisure", "=", "park", 0.6),
+    ("natural", "~", "peak|beach", 0.4),
+    ("historic", "~", "monument|castle|memorial", 0.6),
+    ("amenity", "=", "restaurant", 1.0),
+    ("amenity", "=", "cafe", 0.6),
+    ("amenity", "=", "bar", 0.3),
+]
+
+
+def _is_poi_candidate(tags: Dict[str, Any]) -> bool:
+    # 오프라인 빌드(pbf/dump)에서 Overpass 쿼리와 같은 필터를 적용
+    if not tags.get("name"):
+        return False
+    for k, op, v, _ in OVERPASS_CATEGORIES:
+        val = tags.get(k)
+        if val is None:
+            continue
+        if (op == "=" and val == v) or (op == "~" and re.search(v, str(val))):
+            return True
+    return False
+
+
+# 분류/품질 점수에 실제로 쓰는 태그만 유지
+POI_TAG_KEYS = (
+    "name",
+    "amenity",
+    "tourism",
+    "leisure",
+    "natural",
+    "historic",
+    "wikidata",
+    "wikipedia",
+    "image",
+    "website",
+    "opening_hours",
+    "cuisine",
+    "description",
+)
+
+
+def _bbox_area_km2(south, west, north, east) -> float:
+    mid = math.radians((south + north) / 2.0)
+    return abs(north - south) * 110.574 * abs(east - west) * 111.320 * math.cos(mid)
+
+
+def _overpass_budget(area_km2: float) -> Tuple[int, int]:
+    """
+    bbox 면적 → ([timeout:]초, [maxsize:]바이트).
+    - 작게 잡을수록 Overpass 디스패처가 빨리 받아줌(혼잡 시 429 감소)
+    """
+    if area_km2 <= 80:
+        return 20, 16 * 1024 * 1024
+    if area_km2 <= 400:
+        return 30, 48 * 1024 * 1024
+    return 50, 128 * 1024 * 1024
+
+
+def _overpass_query_bbox(south, west, north, east, limit: int = 50) -> str:
+    """
+    카테고리별 상한 + 면적 기반 timeout/maxsize.
+    - 이름 없는 원소는 서버에서 제외(["name"])
+    - node: 좌표+태그(out qt) / way·relation: 태그+중심점만(out tags center qt) → 멤버/노드 목록 전송 X
+    - qt: id 정렬 대신 quadtile 순서라 서버 출력이 빠름
+      (상한에 걸리면 잘리는 쪽이 공간적으로 치우칠 수 있어서 상한은 limit의 3배로 넉넉히)
+    """
+    timeout_s, maxsize = _overpass_budget(_bbox_area_km2(south, west, north, east))
+    bbox = f"{south:.6f},{west:.6f},{north:.6f},{east:.6f}"
+    base_cap = max(60, 3 * int(limit))
+
+    # 전역 [bbox:]로 selector마다 좌표 반복 X
+    parts = [f"[out:json][timeout:{timeout_s}][maxsize:{maxsize}][bbox:{bbox}];"]
+    for k, op, v, weight in OVERPASS_CATEGORIES:
+        sel = f'["{k}"{op}"{v}"]'
+        cap = max(20, int(base_cap * weight))
+        parts.append(f'node{sel}["name"];')
+        parts.append(f"out qt {cap};")
+        parts.append(f'(way{sel}["name"];relation{sel}["name"];);')
+        parts.append(f"out tags center qt {cap};")
+    return "\n".join(parts)
+
+
+class _JsonStreamReader:
+    """
+    청크 단위 bytes를 조금씩 디코딩하는 최소 JSON 리더.
+    - 버퍼에는 아직 안 읽은 꼬리만 남김 → 응답 크기와 무관하게 메모리 일정
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _more(self) -> bool:
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self.buf = self.buf[self.pos :] + text
+                self.pos = 0
+                return True
+        self.buf = self.buf[self.pos :] + self._utf8.decode(b"", final=True)
+        self.pos = 0
+        self.eof = True
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more() or (self.eof and self.pos >= len(self.buf)):
+                raise ValueError("JSON stream ended unexpectedly")
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"JSON stream: expected {ch!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, self.pos)
+                # 구분자 없이 끝난 토큰은 잘렸을 수 있음(예: "0." + "6", "12" + "3")
+                if self.eof or (end < len(self.buf) and self.buf[end] in ",]}: \t\r\n"):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._more()
+
+
+def _iter_json_array_items(chunks: Iterable[bytes], key: str, rest: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    """
+    최상위 객체의 `key` 배열 원소를 하나씩 yield.
+    - rest가 None이면 다른 키 값은 파싱 후 버리고, 배열이 끝나면 나머지 body는 읽지 않음
+    - rest(dict)를 주면 배열 앞뒤의 다른 최상위 키도 끝까지 읽어서 채움(예: Overpass가 배열 뒤에 붙이는 "remark")
+    """
+    rd = _JsonStreamReader(chunks)
+    rd.expect("{")
+    while rd.peek() != "}":
+        k = rd.value()
+        rd.expect(":")
+        if k != key:
+            v = rd.value()
+            if rest is not None:
+                rest[k] = v
+        else:
+            rd.expect("[")
+            if rd.peek() != "]":
+                while True:
+                    yield rd.value()
+                    if rd.peek() == "]":
+                        break
+                    rd.expect(",")
+            rd.pos += 1
+            if rest is None:
+                return
+        if rd.peek() == ",":
+            rd.pos += 1
+
+
+def _iter_overpass_pois(elements: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    # 이름/좌표/id 없는 원소는 바로 버림
+    for el in elements:
+        if not isinstance(el, dict):
+            continue
+        tags = el.get("tags", {}) or {}
+        name = tags.get("name")
+        if not name:
+            continue
+
+        plat = el.get("lat") or (el.get("center", {}) or {}).get("lat")
+        plon = el.get("lon") or (el.get("center", {}) or {}).get("lon")
+        if plat is None or plon is None:
+            continue
+
+        pid = el.get("id")
+        if pid is None:
+            continue
+
+        yield {
+            "name": name,
+            "lat": float(plat),
+            "lon": float(plon),
+            "type": _poi_type(tags),
+            "tags": {k: tags[k] for k in POI_TAG_KEYS if k in tags},
+            "osm_id": int(pid),
+            "osm_type": el.get("type") or "node",
+            "quality": round(_poi_quality_score(tags), 3),
+        }
+
+
+def _poi_type(tags: Dict[str, Any]) -> str:
+    if "amenity" in tags:
+        v = tags["amenity"]
+        if v == "restaurant":
+            return "맛집"
+        if v == "cafe":
+            return "카페"
+        if v == "bar":
+            return "유흥"
+        return "편의"
+    if "tourism" in tags:
+        v = tags["tourism"]
+        if v == "museum":
+            return "문화"
+        if v in ["attraction", "viewpoint"]:
+            return "관광"
+        return "관광"
+    if tags.get("leisure") == "park":
+        return "자연"
+    if "natural" in tags:
+        return "자연"
+    if "historic" in tags:
+        return "문화"
+    return "관광"
+
+
+def _poi_quality_score(tags: Dict[str, Any]) -> float:
+    """
+    강화된 POI 품질 휴리스틱:
+    - 실제 방문 가치가 낮은 잡음 POI 제거
+    """
+    s = 0.0
+
+    # 신뢰 신호
+    if tags.get("wikidata"):
+        s += 0.35
+    if tags.get("wikipedia"):
+        s += 0.35
+    if tags.get("image"):
+        s += 0.2
+    if tags.get("website"):
+        s += 0.1
+    if tags.get("opening_hours"):
+        s += 0.05
+    if tags.get("tourism") == "museum":
+        s += 0.12
 
-                plat = el.get("lat") or (el.get("center", {}) or {}).get("lat")
-                plon = el.get("lon") or (el.get("center", {}) or {}).get("lon")
-                if plat is None or plon is None:
-                    continue
+    # ❌ 맛집 잡음 제거
+    if tags.get("amenity") == "restaurant":
+        if not any(tags.get(k) for k in ("opening_hours", "website", "cuisine", "wikidata")):
+            s -= 0.3
 
-                pid = el.get("id")
-                if pid is None:
-                    continue
+    # ❌ 관광지 잡음 제거
+    if tags.get("tourism") == "attraction":
+        if not any(tags.get(k) for k in ("wikidata", "wikipedia", "description")):
+            s -= 0.25
 
-                pois.append(
-                    {
-                        "name": name,
-                        "lat": float(plat),
-                        "lon": float(plon),
-                        "type": _poi_type(tags),
-                        "tags": tags,
-                        "osm_id": int(pid),
-                        "quality": round(_poi_quality_score(tags), 3),
-                    }
-                )
+    # ❌ 너무 일반적인 이름
+    nm = (tags.get("name") or "").strip().lower()
+    if nm in ("park", "cafe", "restaurant") or len(nm) <= 2:
+        s -= 0.2
 
-            # ✅ dedupe by (name, lat, lon)
-            seen = set()
-            deduped = []
-            for p in pois:
-                key = (p["name"], round(p["lat"], 5), round(p["lon"], 5))
-                if key in seen:
-                    continue
-                seen.add(key)
-                deduped.append(p)
+    return round(s, 3)
 
-            # ✅ Rank: type bias + quality + closeness to center
-            def rank(p):
-                type_boost = {"관광": 0.15, "문화": 0.15, "자연": 0.12, "맛집": 0.08, "카페": 0.05, "유흥": 0.03}.get(
-                    p["type"], 0.0
-                )
-                dist = haversine_km(lat, lon, p["lat"], p["lon"])
-                # closeness bonus (<= radius)
-                closeness = max(0.0, 1.0 - dist / max(0.8, radius_km))
-                return type_boost + p["quality"] + 0.25 * closeness
 
-            deduped.sort(key=rank, reverse=True)
-            return deduped[: max(0, int(limit))]
-        except Exception:
+POI_RANK_TYPE_BOOST = {"관광": 0.15, "문화": 0.15, "자연": 0.12, "맛집": 0.08, "카페": 0.05, "유흥": 0.03}
+
+
+def _poi_key(p: Dict[str, Any]) -> Tuple[str, float, float]:
+    return (p["name"], round(p["lat"], 5), round(p["lon"], 5))
+
+
+def poi_id(p: Dict[str, Any]) -> str:
+    # node/way/relation은 번호 공간이 따로라 osm_id만으로는 겹침 → 타입 첫 글자 + 번호("w123")
+    return f"{(p.get('osm_type') or 'node')[0]}{int(p['osm_id'])}"
+
+
+def parse_poi_id(v: Any) -> str:
+    # 예전 입력(숫자만)은 node로 취급
+    v = str(v).strip()
+    if v[:1] in ("n", "w", "r") and v[1:].isdigit():
+        return v
+    return f"n{int(v)}"
+
+
+def _poi_rank_fn(lat: float, lon: float, radius_km: float) -> Callable[[Dict[str, Any]], float]:
+    """
+    수집 단계 랭크(type bias + quality + 중심 근접도).
+    - 반경 20km 이내라 equirectangular 근사로 충분 → 원소마다 삼각함수 4번 대신 곱셈만
+    """
+    k_lat = math.radians(1.0) * 6371.0
+    k_lon = k_lat * math.cos(math.radians(lat))
+    reach = max(0.8, radius_km)
+
+    def rank(p: Dict[str, Any]) -> float:
+        dist = math.hypot((p["lat"] - lat) * k_lat, (p["lon"] - lon) * k_lon)
+        # closeness bonus (<= radius)
+        closeness = max(0.0, 1.0 - dist / reach)
+        return POI_RANK_TYPE_BOOST.get(p["type"], 0.0) + p["quality"] + 0.25 * closeness
+
+    return rank
+
+
+def _top_k_unique(
+    items: Iterable[Dict[str, Any]],
+    k: int,
+    score: Callable[[Dict[str, Any]], Any],
+    key: Callable[[Dict[str, Any]], Any] = _poi_key,
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    """
+    dedupe + 점수 + top-k를 한 패스로(min-heap, 크기 k).
+    - 중복 판정은 힙에 남아있는 후보끼리만 → 메모리 O(k)
+    - 동점이면 먼저 들어온 항목 우선(= stable sort 후 슬라이스와 동일)
+    - 반환: [(score, item)] 점수 내림차순
+    """
+    if k <= 0:
+        return []
+    heap: List[Tuple[Any, int, Any, Dict[str, Any]]] = []
+    kept: Set[Any] = set()
+    for seq, it in enumerate(items):
+        kk = key(it)
+        if kk in kept:
             continue
+        entry = (score(it), -seq, kk, it)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+            kept.add(kk)
+        elif entry[:2] > heap[0][:2]:
+            evicted = heapq.heapreplace(heap, entry)
+            kept.discard(evicted[2])
+            kept.add(kk)
+
+    heap.sort(key=lambda e: (e[0], e[1]), reverse=True)
+    return [(e[0], e[3]) for e in heap]
+
+
+@st.cache_resource(show_spinner=False)
+def _last_pois_store() -> Dict[str, Any]:
+    # 지역(0.1° 격자)별 마지막 Overpass 성공 결과 — 전 미러 실패 시 fallback.
+    # 세션 상태가 아니라 프로세스 공유(cache_data 함수/워커 스레드에서 세션에 쓰면 안 됨)
+    return {"lock": threading.Lock(), "items": OrderedDict()}
+
+
+LAST_POIS_MAX = 64
+
+
+def _last_pois_key(lat: float, lon: float) -> Tuple[float, float]:
+    return (round(lat, 1), round(lon, 1))
+
+
+def _last_pois_put(lat: float, lon: float, pois: List[Dict[str, Any]]) -> None:
+    store = _last_pois_store()
+    key = _last_pois_key(lat, lon)
+    with store["lock"]:
+        store["items"][key] = pois
+        store["items"].move_to_end(key)
+        while len(store["items"]) > LAST_POIS_MAX:
+            store["items"].popitem(last=False)
+
+
+def _last_pois_get(lat: float, lon: float) -> Optional[List[Dict[str, Any]]]:
+    store = _last_pois_store()
+    with store["lock"]:
+        return store["items"].get(_last_pois_key(lat, lon))
+
+
+@st.cache_data(show_spinner=False, ttl=60 * 60 * 24)  # ✅ 1 day
+def fetch_pois_overpass(lat: float, lon: float, radius_km: float, limit: int):
+    cache_miss("pois")
+    south, west, north, east = _radius_to_bbox(lat, lon, radius_km)
+    query = _overpass_query_bbox(south, west, north, east, limit=limit)
+    # 서버 timeout보다 조금 더 기다려야 서버측 timeout remark를 받을 수 있음(아래에서 remark 확인)
+    http_timeout = _overpass_budget(_bbox_area_km2(south, west, north, east))[0] + 10
+
+    top_n = max(0, int(limit))
+    if top_n == 0:
+        return []
+
+    # ✅ Rank: type bias + quality + closeness to center
+    rank = _poi_rank_fn(lat, lon, radius_km)
+
+    # ✅ 오프라인 인덱스가 bbox를 완전히 덮으면 네트워크 X
+    idx = _load_poi_index(POI_INDEX_PATH)
+    if idx is not None and idx.covers(south, west, north, east):
+        trace_set(source="poi_index")
+        ranked = _top_k_unique(idx.iter_bbox(south, west, north, east), top_n, rank, key=lambda c: c["_rec"])
+        return [{**idx.materialize(c), "rank": round(sc, 4)} for sc, c in ranked]
+
+    # ✅ 동시 Overpass 호출 수 상한(배치에선 프로세스 간 공유 세마포어)
+    last_err: Optional[Exception] = None
+    with _overpass_slots():
+        for url in OVERPASS_URLS:
+            r = None
+            try:
+                r = _request_stream(
+                    "POST",
+                    url,
+                    data=query.encode("utf-8"),
+                    timeout=http_timeout,
+                    retries=1,
+                    backoff=0.8,
+                    name=f"Overpass({url})",
+                )
+                rest: Dict[str, Any] = {}
+                elements = _iter_json_array_items(_trace_bytes(r.iter_content(chunk_size=64 * 1024)), "elements", rest)
+
+                # ✅ streaming: dedupe + rank + top-N을 한 번에(메모리 상한 = top_n)
+                ranked = _top_k_unique(_iter_overpass_pois(elements), top_n, rank)
+                # 서버측 timeout/메모리 초과는 200 + 잘린 elements + 배열 뒤 "remark" → 다음 미러로(어느 캐시에도 안 남김)
+                remark = str(rest.get("remark") or "")
+                if remark.startswith("runtime error"):
+                    fx = http_fixtures()
+                    if fx is not None:
+                        fx.discard("POST", url, data=query.encode("utf-8"))
+                    logger.warning("Overpass(%s) partial result: %s", url, remark[:160])
+                    raise ApiError(f"Overpass({url}): {remark[:160]}")
+                pois = [{**p, "rank": round(sc, 4)} for sc, p in ranked]
+                if pois:
+                    _last_pois_put(lat, lon, pois)
+                return pois
+            except Exception as e:
+                last_err = e
+                continue
+            finally:
+                if r is not None:
+                    r.close()
+
+    # ❗ 전 미러 실패 → 예외(st.cache_data는 예외를 캐시 안 함). 지역별 마지막 성공 결과 fallback은 호출 쪽에서
+    raise ApiError(f"Overpass 전 미러 실패: {last_err}")
+
+
+def fetch_pois_or_last(lat: float, lon: float, radius_km: float, limit: int) -> List[Dict[str, Any]]:
+    # fetch_pois_overpass + 실패 시 같은 지역의 마지막 성공 결과(캐시 밖에서 → 실패가 24시간 고정되지 않음)
+    try:
+        return fetch_pois_overpass(lat, lon, radius_km=radius_km, limit=limit)
+    except Exception:
+        cached = _last_pois_get(lat, lon)
+        if not cached:
+            count_fallback("overpass_empty")
+            raise
+    count_fallback("overpass_last_pois")
+    return cached[: max(0, int(limit))]
+
+
+# =========================
+# Offline POI index (mmap)
+# =========================
+# cli.py build-poi-index 로 만든 파일. 있으면 커버 영역은 Overpass 없이 바로 응답.
+# 레이아웃: header | meta(JSON) | cells[(cell_key, start, count)] (key 정렬) | records | blob(JSON)
+POI_INDEX_PATH = os.getenv(
+    "POI_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "poi_index.bin"),
+)
+POI_INDEX_MAGIC = b"TMPOIX01"
+POI_INDEX_CELL_DEG = 0.05  # ≈ 5.5km
+
+POI_TYPE_CODES = ["관광", "문화", "자연", "맛집", "카페", "유흥", "편의"]
+
+_POI_INDEX_HEADER = struct.Struct("<8sIIId")  # magic, n_cells, n_records, meta_len, cell_deg
+_POI_INDEX_CELL = struct.Struct("<qII")  # cell_key, first record, record count
+_POI_INDEX_REC = struct.Struct("<ddqfB3xII")  # lat, lon, osm_id, quality, type_code, blob_off, blob_len
+
+
+def _poi_cell_rc(lat: float, lon: float, cell_deg: float) -> Tuple[int, int]:
+    return int(math.floor((lat + 90.0) / cell_deg)), int(math.floor((lon + 180.0) / cell_deg))
+
+
+def _poi_cell_key(row: int, col: int, cell_deg: float) -> int:
+    return row * int(math.ceil(360.0 / cell_deg)) + col
+
+
+class PoiIndex:
+    """
+    mmap으로 여는 읽기 전용 공간 인덱스.
+    - bbox 조회: 행(row)마다 셀 테이블 이분탐색 1번 → 해당 행의 레코드는 연속 구간
+    - 후보는 좌표/타입/품질만 담은 가벼운 dict, 이름/태그는 materialize()에서만 디코딩
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_cells, n_records, meta_len, cell_deg = _POI_INDEX_HEADER.unpack_from(self._mm, 0)
+        if magic != POI_INDEX_MAGIC:
+            raise ValueError(f"not a POI index: {path}")
+
+        off = _POI_INDEX_HEADER.size
+        self.meta = json.loads(self._mm[off : off + meta_len].decode("utf-8"))
+        self.coverage = [tuple(b) for b in self.meta.get("coverage", [])]
+        self.cell_deg = cell_deg
+        self.n_cells = n_cells
+        self.n_records = n_records
+        self._cells_off = off + meta_len
+        self._recs_off = self._cells_off + n_cells * _POI_INDEX_CELL.size
+        self._blob_off = self._recs_off + n_records * _POI_INDEX_REC.size
+
+    def covers(self, south, west, north, east) -> bool:
+        return any(s <= south and w <= west and n >= north and e >= east for s, w, n, e in self.coverage)
+
+    def _cell(self, i: int) -> Tuple[int, int, int]:
+        return _POI_INDEX_CELL.unpack_from(self._mm, self._cells_off + i * _POI_INDEX_CELL.size)
+
+    def _lower_bound(self, key: int) -> int:
+        lo, hi = 0, self.n_cells
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._cell(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def iter_bbox(self, south, west, north, east) -> Iterator[Dict[str, Any]]:
+        r0, c0 = _poi_cell_rc(south, west, self.cell_deg)
+        r1, c1 = _poi_cell_rc(north, east, self.cell_deg)
+        for row in range(r0, r1 + 1):
+            lo_key = _poi_cell_key(row, c0, self.cell_deg)
+            hi_key = _poi_cell_key(row, c1, self.cell_deg)
+            i = self._lower_bound(lo_key)
+            if i >= self.n_cells:
+                continue
+            key, first, _ = self._cell(i)
+            if key > hi_key:
+                continue
+            last = first
+            while i < self.n_cells:
+                key, start, count = self._cell(i)
+                if key > hi_key:
+                    break
+                last = start + count
+                i += 1
+
+            a = self._recs_off + first * _POI_INDEX_REC.size
+            b = self._recs_off + last * _POI_INDEX_REC.size
+            for j, (lat, lon, _, quality, tcode, _, _) in enumerate(_POI_INDEX_REC.iter_unpack(self._mm[a:b])):
+                if south <= lat <= north and west <= lon <= east:
+                    yield {
+                        "lat": lat,
+                        "lon": lon,
+                        "type": POI_TYPE_CODES[tcode],
+                        "quality": round(quality, 3),
+                        "_rec": first + j,
+                    }
+
+    def materialize(self, cand: Dict[str, Any]) -> Dict[str, Any]:
+        lat, lon, osm_id, quality, tcode, blob_off, blob_len = _POI_INDEX_REC.unpack_from(
+            self._mm, self._recs_off + cand["_rec"] * _POI_INDEX_REC.size
+        )
+        start = self._blob_off + blob_off
+        blob = json.loads(self._mm[start : start + blob_len].decode("utf-8"))
+        return {
+            "name": blob["n"],
+            "lat": lat,
+            "lon": lon,
+            "type": POI_TYPE_CODES[tcode],
+            "tags": blob.get("t", {}),
+            "osm_id": int(osm_id),
+            "osm_type": blob.get("o", "node"),
+            "quality": round(quality, 3),
+        }
 
-    # ❗ Overpass 실패 fallback
-    cached = sget("cache.last_pois")
-    if cached:
-        return cached[: max(0, int(limit))]
 
-    return []
+def write_poi_index(
+    pois: Iterable[Dict[str, Any]],
+    path: str,
+    coverage: List[Tuple[float, float, float, float]],
+    source: str = "",
+    cell_deg: float = POI_INDEX_CELL_DEG,
+) -> Dict[str, Any]:
+    """
+    _iter_overpass_pois 형태의 POI들을 인덱스 파일로 기록(임시 파일 → rename).
+    - (name, lat, lon) 중복은 빌드 때 제거 → 런타임 후보는 레코드 번호로 유일
+    """
+    seen: Set[Tuple[str, float, float]] = set()
+    rows: List[Tuple[int, float, Dict[str, Any]]] = []
+    for p in pois:
+        k = _poi_key(p)
+        if k in seen:
+            continue
+        seen.add(k)
+        r, c = _poi_cell_rc(p["lat"], p["lon"], cell_deg)
+        rows.append((_poi_cell_key(r, c, cell_deg), -float(p.get("quality") or 0.0), p))
+    rows.sort(key=lambda x: (x[0], x[1]))
+
+    cells: List[Tuple[int, int, int]] = []
+    recs = bytearray()
+    blob = bytearray()
+    for i, (key, _, p) in enumerate(rows):
+        if cells and cells[-1][0] == key:
+            cells[-1] = (key, cells[-1][1], cells[-1][2] + 1)
+        else:
+            cells.append((key, i, 1))
+        b = json.dumps({"n": p["name"], "t": p.get("tags", {}), "o": p.get("osm_type", "node")}, ensure_ascii=False).encode("utf-8")
+        recs += _POI_INDEX_REC.pack(
+            p["lat"],
+            p["lon"],
+            int(p["osm_id"]),
+            float(p.get("quality") or 0.0),
+            POI_TYPE_CODES.index(p["type"]) if p["type"] in POI_TYPE_CODES else 0,
+            len(blob),
+            len(b),
+        )
+        blob += b
+
+    meta = json.dumps(
+        {
+            "built_at": datetime.now().isoformat(timespec="seconds"),
+            "source": source,
+            "coverage": [list(map(float, bb)) for bb in coverage],
+            "records": len(rows),
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_POI_INDEX_HEADER.pack(POI_INDEX_MAGIC, len(cells), len(rows), len(meta), cell_deg))
+        f.write(meta)
+        for cell in cells:
+            f.write(_POI_INDEX_CELL.pack(*cell))
+        f.write(recs)
+        f.write(blob)
+    os.replace(tmp, path)
+    return {"records": len(rows), "cells": len(cells), "bytes": os.path.getsize(path)}
+
+
+@st.cache_resource(show_spinner=False)
+def _load_poi_index(path: str) -> Optional[PoiIndex]:
+    if not os.path.exists(path):
+        return None
+    try:
+        idx = PoiIndex(path)
+        logger.info("POI index loaded: %s (%s records)", path, idx.n_records)
+        return idx
+    except Exception as e:
+        logger.warning("POI index load failed (%s): %s", path, e)
+        return None
 
 
 # =========================
@@ -892,9 +2853,15 @@ def _kmeans_like(points: List[Tuple[float, float]], k: int, iters: int = 10) ->
     return assign
 
 
-def _nearest_neighbor_order(pois: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _nearest_neighbor_order(
+    pois: List[Dict[str, Any]], matrix: Optional["TravelTimeMatrix"] = None
+) -> List[Dict[str, Any]]:
     if len(pois) <= 2:
         return pois
+    ids = matrix.ids(pois) if matrix is not None else None
+    if ids is not None:
+        order = _nearest_neighbor_ids(pois, ids, matrix)
+        return [pois[i] for i in order]
     remaining = pois[:]
     mean_lat = sum(p["lat"] for p in remaining) / len(remaining)
     mean_lon = sum(p["lon"] for p in remaining) / len(remaining)
@@ -913,20 +2880,35 @@ def _nearest_neighbor_order(pois: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return route
 
 
+def _nearest_neighbor_ids(pois: List[Dict[str, Any]], ids: List[int], matrix: "TravelTimeMatrix") -> List[int]:
+    # _nearest_neighbor_order와 같은 순서, 거리만 행렬에서 조회 (반환: pois 내 위치)
+    mean_lat = sum(p["lat"] for p in pois) / len(pois)
+    mean_lon = sum(p["lon"] for p in pois) / len(pois)
+    remaining = list(range(len(pois)))
+    start = min(remaining, key=lambda i: (pois[i]["lat"] - mean_lat) ** 2 + (pois[i]["lon"] - mean_lon) ** 2)
+    remaining.remove(start)
+    route = [start]
+    while remaining:
+        last = ids[route[-1]]
+        nxt = min(remaining, key=lambda i: matrix.km(last, ids[i]))
+        remaining.remove(nxt)
+        route.append(nxt)
+    return route
+
+
 def build_itinerary_from_pois(
     pois: List[Dict[str, Any]],
     styles: List[str],
     days: int,
     radius_km,  
-    exclude_ids: Optional[Set[int]] = None,
+    exclude_ids: Optional[Set[str]] = None,
+    matrix: Optional["TravelTimeMatrix"] = None,
 ) -> Dict[int, List[Dict[str, Any]]]:
     exclude_ids = exclude_ids or set()
     if not pois:
         return {d: [] for d in range(1, days + 1)}
 
-    filtered = [p for p in pois if int(p.get("osm_id") or -1) not in exclude_ids]
-    scored = [(poi_score(p, styles), p) for p in filtered]
-    scored.sort(key=lambda x: x[0], reverse=True)
+    filtered = [p for p in pois if p.get("osm_id") is None or poi_id(p) not in exclude_ids]
 
     if radius_km <= 4:
         per_day = 6
@@ -934,149 +2916,779 @@ def build_itinerary_from_pois(
         per_day = 5
     else:
         per_day = 4
-    max_pick = max(6, min(len(scored), days * per_day))
-    picked = [p for _, p in scored[:max_pick]]
+    max_pick = max(6, min(len(filtered), days * per_day))
+
+    # ✅ 스타일 점수 + 수집 단계 rank(동점 처리)를 한 패스 top-k로 → 전체 정렬 X
+    ranked = _top_k_unique(filtered, max_pick, lambda p: (poi_score(p, styles), float(p.get("rank") or 0.0)))
+    picked = [p for _, p in ranked]
 
     points = [(p["lat"], p["lon"]) for p in picked]
     k = min(days, len(picked))
     clusters = _kmeans_like(points, k=k, iters=12)
 
-    day_map: Dict[int, List[Dict[str, Any]]] = {d: [] for d in range(1, days + 1)}
-    for p, c in zip(picked, clusters):
-        day = c + 1
-        if day <= days:
-            day_map[day].append(p)
+    day_map: Dict[int, List[Dict[str, Any]]] = {d: [] for d in range(1, days + 1)}
+    for p, c in zip(picked, clusters):
+        day = c + 1
+        if day <= days:
+            day_map[day].append(p)
+
+    for d in range(1, days + 1):
+        day_map[d] = _nearest_neighbor_order(day_map[d], matrix=matrix)
+
+    return day_map
+
+
+def infer_move_mode(styles: List[str], radius_km: float) -> str:
+    if "로드트립" in styles:
+        return "차량"
+    if radius_km <= 3:
+        return "도보"
+    return "대중교통"
+
+
+def move_speed_kmh(mode: str) -> float:
+    return {"도보": 4.5, "대중교통": 18.0, "차량": 28.0}.get(mode, 18.0)
+
+
+def leg_overhead_min(mode: str) -> float:
+    return {"도보": 3.0, "대중교통": 10.0, "차량": 8.0}.get(mode, 8.0)
+
+
+def _density_factor(n_points: int, radius_km: float) -> float:
+    # Density adjustment (more points in smaller radius => slower)
+    density = n_points / max(1.0, radius_km)
+    return max(0.72, 1.15 - 0.06 * density)
+
+
+def _leg_overhead(km: float, mode: str) -> float:
+    # Short leg => less overhead
+    local_overhead = leg_overhead_min(mode)
+    if km < 0.8:
+        local_overhead *= 0.6
+    elif km > 8 and mode == "대중교통":
+        local_overhead += 5
+    return local_overhead
+
+
+def _leg_minutes(km: float, mode: str, speed: float) -> float:
+    return (km / max(3.0, speed)) * 60.0 + _leg_overhead(km, mode)
+
+
+class TravelTimeMatrix:
+    """
+    플랜 POI들의 쌍별 거리/이동시간 서비스.
+    - groups: 연속 구간 크기 목록(멀티시티의 경유지별 POI 수). 행은 자기 구간 안의 POI까지만 계산
+      → 도시 간 쌍은 계산 X. 구간 밖 조회(드묾)는 그 자리에서 직접 계산
+    - km: 행(row) 단위로 필요할 때 한 번만 haversine
+    - 모드별: 밀도 보정 전 주행시간 + 구간 오버헤드를 행마다 한 번 계산
+      → 조회 = travel / density_factor + overhead (= _leg_minutes와 같은 값)
+    """
+
+    def __init__(self, pois: List[Dict[str, Any]], groups: Optional[List[int]] = None):
+        self.n = len(pois)
+        self._lat = [float(p["lat"]) for p in pois]
+        self._lon = [float(p["lon"]) for p in pois]
+        # i → 행이 덮는 [lo, hi) 범위
+        self._span: List[Tuple[int, int]] = []
+        lo = 0
+        for size in (groups or [self.n]):
+            self._span.extend([(lo, lo + size)] * size)
+            lo += size
+        assert lo == self.n, "groups must cover all POIs"
+        self._index: Dict[Tuple[str, float, float], int] = {}
+        for i, p in enumerate(pois):
+            self._index.setdefault(_poi_key(p), i)
+        self._km_rows: List[Optional[array]] = [None] * self.n
+        self._mode_rows: Dict[str, List[Optional[Tuple[array, array]]]] = {}
+        self._anchor_rows: Dict[Tuple[float, float], array] = {}
+
+    def idx(self, poi: Dict[str, Any]) -> Optional[int]:
+        return self._index.get(_poi_key(poi))
+
+    def ids(self, pois: List[Dict[str, Any]]) -> Optional[List[int]]:
+        out = [self.idx(p) for p in pois]
+        return None if any(i is None for i in out) else out
+
+    def _km_row(self, i: int) -> array:
+        row = self._km_rows[i]
+        if row is None:
+            lat, lon = self._lat[i], self._lon[i]
+            row = array("d", (haversine_km(lat, lon, self._lat[j], self._lon[j]) for j in range(*self._span[i])))
+            self._km_rows[i] = row
+        return row
+
+    def _in_row(self, i: int, j: int) -> bool:
+        lo, hi = self._span[i]
+        return lo <= j < hi
+
+    def km(self, i: int, j: int) -> float:
+        if not self._in_row(i, j):
+            return haversine_km(self._lat[i], self._lon[i], self._lat[j], self._lon[j])
+        return self._km_row(i)[j - self._span[i][0]]
+
+    def _mode_row(self, i: int, mode: str) -> Tuple[array, array]:
+        rows = self._mode_rows.setdefault(mode, [None] * self.n)
+        r = rows[i]
+        if r is None:
+            speed = move_speed_kmh(mode)
+            km_row = self._km_row(i)
+            r = (array("d", (d / speed * 60.0 for d in km_row)), array("d", (_leg_overhead(d, mode) for d in km_row)))
+            rows[i] = r
+        return r
+
+    def minutes(self, i: int, j: int, mode: str, factor: float = 1.0) -> float:
+        speed = move_speed_kmh(mode) * factor
+        if speed < 3.0 or not self._in_row(i, j):
+            # max(3.0, speed) 하한에 걸리는 경우(기본 모드 값으로는 안 생김)/구간 밖 쌍만 직접 계산
+            return _leg_minutes(self.km(i, j), mode, speed)
+        travel, overhead = self._mode_row(i, mode)
+        j -= self._span[i][0]
+        return travel[j] / factor + overhead[j]
+
+    def km_from(self, lat: float, lon: float) -> array:
+        # 호텔처럼 POI가 아닌 기준점 → 모든 POI까지 거리(기준점별 1회)
+        key = (round(lat, 6), round(lon, 6))
+        row = self._anchor_rows.get(key)
+        if row is None:
+            row = array("d", (haversine_km(lat, lon, self._lat[j], self._lon[j]) for j in range(self.n)))
+            self._anchor_rows[key] = row
+        return row
+
+
+def estimate_route_time_minutes(
+    points: List[Tuple[float, float]],
+    mode: str,
+    return_to_center: bool = True,
+    radius_km: float = 8.0,    
+    matrix: Optional[TravelTimeMatrix] = None,
+    ids: Optional[List[int]] = None,
+    stays: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """
+    ✅ Improved realism:
+    - Short leg => less overhead
+    - Dense area => slightly slower effective speed
+    - matrix/ids(points와 같은 순서의 POI 인덱스)가 있으면 구간 값은 행렬에서 조회
+    - stays(POI별 체류 분, 없으면 60분)까지 합산해 8시간 초과 여부 표시
+    """
+    stay_min = int(sum(stays)) if stays is not None else 60 * len(points)  # POI 체류시간
+    
+    if not points or len(points) == 1:
+        total_min = 0               # 이동시간 없음
+        total_km = 0.0
+
+        return {
+            "mode": mode,
+            "total_minutes": total_min,
+            "total_km": total_km,
+            "stay_minutes": stay_min,
+            "day_total_minutes": stay_min,
+            "overload": stay_min > DAY_BUDGET_MIN,
+            "legs": [],
+            "note": "POI가 0~1개라 이동시간 없이 체류시간만 계산했어요.",
+        }
+
+    factor = _density_factor(len(points), radius_km)
+    speed = move_speed_kmh(mode) * factor
+    if matrix is None or ids is None or len(ids) != len(points):
+        matrix, ids = None, None
+
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    center = (sum(lats) / len(lats), sum(lons) / len(lons))
+
+    legs = []
+    total_km = 0.0
+    total_min = 0.0
+
+    for i in range(len(points) - 1):
+        if matrix is not None:
+            km = matrix.km(ids[i], ids[i + 1])
+            minutes = matrix.minutes(ids[i], ids[i + 1], mode, factor)
+        else:
+            a = points[i]
+            b = points[i + 1]
+            km = haversine_km(a[0], a[1], b[0], b[1])
+            minutes = _leg_minutes(km, mode, speed)
+        legs.append({"from": i, "to": i + 1, "km": round(km, 2), "minutes": int(round(minutes))})
+        total_km += km
+        total_min += minutes
+
+    if return_to_center:
+        last = points[-1]
+        km = haversine_km(last[0], last[1], center[0], center[1])
+        minutes = _leg_minutes(km, mode, speed)
+        legs.append({"from": len(points) - 1, "to": "center", "km": round(km, 2), "minutes": int(round(minutes))})
+        total_km += km
+        total_min += minutes
+
+    day_total = int(round(total_min)) + stay_min
+    return {
+        "mode": mode,
+        "total_minutes": int(round(total_min)),
+        "total_km": round(total_km, 2),
+        "stay_minutes": stay_min,
+        "day_total_minutes": day_total,
+        "overload": day_total > DAY_BUDGET_MIN,  # 8시간 초과
+        "legs": legs,
+        "note": "추정치(직선거리 기반 보정)라 실제 교통/경로에 따라 달라질 수 있어요.",
+    }
+
+
+def build_day_travel_times(
+    day_map: Dict[int, List[Dict[str, Any]]],
+    styles: List[str],
+    radius_km: float,
+    move_mode_setting: str,
+    return_to_center: bool,
+    matrix: Optional[TravelTimeMatrix] = None,
+) -> Dict[int, Dict[str, Any]]:
+    day_times = {}
+    inferred = infer_move_mode(styles, radius_km)
+
+    for d, pois in day_map.items():
+        pts = [(p["lat"], p["lon"]) for p in pois]
+        mode = move_mode_setting
+        if mode == "자동":
+            mode = inferred
+        ids = matrix.ids(pois) if matrix is not None else None
+        day_times[d] = estimate_route_time_minutes(
+            pts,
+            mode=mode,
+            return_to_center=return_to_center,
+            radius_km=radius_km,
+            matrix=matrix,
+            ids=ids,
+            stays=[poi_stay_minutes(p) for p in pois],
+        )
+
+    return day_times
+
+
+# =========================
+# Weather-aware re-ranking
+# =========================
+INDOOR_TYPES = {"문화", "카페", "맛집"}
+OUTDOOR_TYPES = {"자연", "관광"}
+
+
+def classify_day_weather(w: Optional[Dict[str, Any]]) -> str:
+    # "bad"(비/폭염/한파) / "good"(맑고 무난) / "mixed" / "unknown"
+    if not w or w.get("tmax") is None or w.get("tmin") is None:
+        return "unknown"
+    prcp = float(w.get("prcp") or 0.0)
+    if prcp >= 5.0 or w["tmax"] >= 33 or w["tmin"] <= -8:
+        return "bad"
+    if prcp < 1.0 and 5 <= w["tmax"] <= 30:
+        return "good"
+    return "mixed"
+
+
+def _weather_cost(poi: Dict[str, Any], kind: str) -> float:
+    t = poi.get("type")
+    if kind == "bad" and t in OUTDOOR_TYPES:
+        return 1.0
+    if kind == "good" and t in INDOOR_TYPES:
+        return 0.4  # 맑은 날 실내는 '아까운' 정도
+    return 0.0
+
+
+def rerank_days_by_weather(
+    day_map: Dict[int, List[Dict[str, Any]]],
+    forecast_daily: Optional[List[Dict[str, Any]]],
+    start_date: date,
+    matrix: Optional[TravelTimeMatrix] = None,
+    day_groups: Optional[Dict[int, str]] = None,
+    detour_weight: float = 0.15,
+) -> Tuple[Dict[int, List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    이미 받은 예보로 Day 클러스터 간 POI 맞교환(추가 API 호출 없음).
+    - 비/폭염/한파 날엔 실내(문화·카페·맛집), 맑은 날엔 야외(자연·관광)
+    - 이득 = 날씨 비용 감소 - detour_weight × (원래 클러스터 중심 대비 늘어난 km)
+    - 같은 그룹(멀티시티면 같은 경유지) 안에서만, 하루 POI 개수는 그대로
+    returns: (새 day_map, 교환 기록)
+    """
+    by_date = {w.get("date"): w for w in (forecast_daily or [])}
+    kinds = {d: classify_day_weather(by_date.get((start_date + timedelta(days=d - 1)).isoformat())) for d in day_map}
+    if not any(k in ("bad", "good") for k in kinds.values()):
+        return day_map, []
+
+    day_groups = day_groups or {}
+    plan = {d: list(ps) for d, ps in day_map.items()}
+    centers = {}
+    for d, ps in plan.items():
+        if ps:
+            centers[d] = (sum(p["lat"] for p in ps) / len(ps), sum(p["lon"] for p in ps) / len(ps))
+
+    def dist(p: Dict[str, Any], d: int) -> float:
+        c = centers.get(d)
+        return haversine_km(p["lat"], p["lon"], c[0], c[1]) if c else 0.0
+
+    swaps: List[Dict[str, Any]] = []
+    for _ in range(4):
+        changed = False
+        for d in sorted(plan):
+            for i, p in enumerate(plan[d]):
+                if _weather_cost(p, kinds[d]) <= 0:
+                    continue
+                best = None
+                for e in plan:
+                    if e == d or day_groups.get(e) != day_groups.get(d):
+                        continue
+                    for j, q in enumerate(plan[e]):
+                        gain = (
+                            _weather_cost(p, kinds[d]) + _weather_cost(q, kinds[e])
+                            - _weather_cost(p, kinds[e]) - _weather_cost(q, kinds[d])
+                        )
+                        if gain <= 0:
+                            continue
+                        gain -= detour_weight * (dist(p, e) + dist(q, d) - dist(p, d) - dist(q, e))
+                        if gain > 1e-9 and (best is None or gain > best[0]):
+                            best = (gain, e, j)
+                if best:
+                    _, e, j = best
+                    q = plan[e][j]
+                    plan[d][i], plan[e][j] = q, p
+                    swaps.append({"poi": p["name"], "from": d, "to": e, "with": q["name"], "weather": kinds[d]})
+                    changed = True
+        if not changed:
+            break
+
+    if swaps:
+        for d in {s["from"] for s in swaps} | {s["to"] for s in swaps}:
+            plan[d] = _nearest_neighbor_order(plan[d], matrix=matrix)
+    return plan, swaps
+
+
+# =========================
+# Opening hours
+# =========================
+_OH_DAYS = {"Mo": 0, "Tu": 1, "We": 2, "Th": 3, "Fr": 4, "Sa": 5, "Su": 6}
+_OH_MONTHS = {m: i for i, m in enumerate(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])}
+_OH_SEL = r"{t}(?:\s*-\s*{t})?(?:\s*,\s*{t}(?:\s*-\s*{t})?)*"
+_OH_DAY_T = "(?:" + "|".join(_OH_DAYS) + ")"
+_OH_MONTH_T = "(?:" + "|".join(_OH_MONTHS) + ")"
+_OH_RULE_RE = re.compile(
+    r"^(?:(" + _OH_SEL.format(t=_OH_MONTH_T) + r")\s*:?\s+)?(?:(" + _OH_SEL.format(t=_OH_DAY_T) + r")\b\s*)?(.*)$"
+)
+# ";" = 덮어쓰는 규칙, 요일/월/PH로 시작하는 "," = 덧붙이는 규칙
+_OH_SPLIT_RE = re.compile(
+    r"(\s*;\s*|(?:(?<=\d)|(?<=off)|(?<=closed))\s*,\s*(?=(?:" + "|".join([*_OH_DAYS, *_OH_MONTHS, "PH"]) + r")\b))"
+)
+# 공휴일(PH): 일정 날짜가 공휴일인지 모르니 평일 규칙만 씀 → "PH ..." 규칙은 건너뛰고 "Su,PH"의 PH는 지움
+_OH_PH_ONLY_RE = re.compile(r"^PH\b(?!\s*,)")
+_OH_PH_SEL_RE = re.compile(r"^PH\s*,\s*|\s*,\s*PH\b")
+_OH_SPAN_RE = re.compile(r"^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})$")
+
+Intervals = Tuple[Tuple[int, int], ...]
+
+
+def _oh_mask(sel: Optional[str], names: Dict[str, int]) -> int:
+    # "Mo-Fr,Su" → 비트마스크 (범위가 넘어가면 wrap: "Fr-Mo", "Nov-Feb")
+    size = len(names)
+    if not sel:
+        return (1 << size) - 1
+    mask = 0
+    for part in sel.split(","):
+        a, _, b = (x.strip() for x in part.partition("-"))
+        lo, hi = names[a], names[b or a]
+        i = lo
+        while True:
+            mask |= 1 << i
+            if i == hi:
+                break
+            i = (i + 1) % size
+    return mask
+
+
+def _oh_spans(times: str) -> Optional[Intervals]:
+    if times in ("", "24/7"):
+        return ((0, 1440),)
+    if times in ("off", "closed"):
+        return ()
+    out = []
+    for span in times.split(","):
+        m = _OH_SPAN_RE.match(span.strip())
+        if not m:
+            return None
+        start = int(m.group(1)) * 60 + int(m.group(2))
+        end = int(m.group(3)) * 60 + int(m.group(4))
+        out.append((start, end if end > start else end + 1440))  # 자정 넘김은 끝분 > 1440
+    return tuple(sorted(out))
+
+
+class OpeningHours:
+    """
+    컴파일된 opening_hours: (월 12 × 요일 7) 칸마다 영업 구간 튜플.
+    - 조회는 표 인덱싱 + 전날 자정 넘김 구간만 붙이면 끝
+    - 같은 구간 튜플은 칸끼리 공유해서 메모리도 작음
+    """
+
+    __slots__ = ("_table",)
+
+    def __init__(self, table: Tuple[Intervals, ...]):
+        self._table = table
+
+    def _cell(self, day: date) -> Intervals:
+        return self._table[(day.month - 1) * 7 + day.weekday()]
+
+    def windows(self, day: date) -> Intervals:
+        prev = self._cell(day - timedelta(days=1))
+        spill = tuple((0, we - 1440) for _, we in prev if we > 1440)
+        return spill + self._cell(day) if spill else self._cell(day)
+
+    def is_open(self, day: date, start_min: int, end_min: int) -> bool:
+        return any(ws <= start_min and end_min <= we for ws, we in self.windows(day))
+
+
+def compile_opening_hours(text: str) -> Optional[OpeningHours]:
+    """
+    OSM opening_hours 문자열 → OpeningHours (못 읽는 규칙이 하나라도 있으면 None=모름)
+    - 지원: 24/7, 월 범위("Apr-Oct"), 요일 범위/목록, 여러 시간 구간, off/closed, 자정 넘김
+    - PH(공휴일) 규칙은 무시하고 나머지 요일 규칙만 반영("Mo-Fr 10:00-18:00; PH off")
+    - 미지원(None): SH, 일출/일몰, 주차(week), "+" 열린 끝 등
+    """
+    parts = _OH_SPLIT_RE.split(text.strip())
+    table: List[Intervals] = [()] * 84
+    seen = False
+    for k in range(0, len(parts), 2):
+        rule = parts[k].strip()
+        additive = k > 0 and parts[k - 1].strip() == ","
+        if not rule or _OH_PH_ONLY_RE.match(rule):
+            continue
+        m = _OH_RULE_RE.match(_OH_PH_SEL_RE.sub("", rule))
+        if not m:
+            return None
+        spans = _oh_spans(m.group(3).strip())
+        if spans is None:
+            return None
+        months = _oh_mask(m.group(1), _OH_MONTHS)
+        weekdays = _oh_mask(m.group(2), _OH_DAYS)
+        for mo in range(12):
+            if not months >> mo & 1:
+                continue
+            for wd in range(7):
+                if weekdays >> wd & 1:
+                    i = mo * 7 + wd
+                    table[i] = tuple(sorted(table[i] + spans)) if additive and spans else spans
+        seen = True
+    if not seen:
+        return None
+    interned: Dict[Intervals, Intervals] = {}
+    return OpeningHours(tuple(interned.setdefault(c, c) for c in table))
+
+
+@st.cache_resource(show_spinner=False)
+def _opening_hours_lru() -> Dict[str, Any]:
+    # 서로 다른 문자열은 세션/리런을 넘어 한 번만 컴파일
+    return {"lock": threading.Lock(), "items": OrderedDict()}
 
-    for d in range(1, days + 1):
-        day_map[d] = _nearest_neighbor_order(day_map[d])
 
-    return day_map
+OPENING_HOURS_LRU = 4096  # 문자열 수 — 목적지 수십 곳 분량
 
 
-def infer_move_mode(styles: List[str], radius_km: float) -> str:
-    if "로드트립" in styles:
-        return "차량"
-    if radius_km <= 3:
-        return "도보"
-    return "대중교통"
+def opening_hours_for(pois: List[Dict[str, Any]]) -> List[Optional[OpeningHours]]:
+    texts = [(p.get("tags") or {}).get("opening_hours") or None for p in pois]
+    lru = _opening_hours_lru()
+    found: Dict[str, Optional[OpeningHours]] = {}
+    with lru["lock"]:
+        for text in texts:
+            if text and text not in found and text in lru["items"]:
+                lru["items"].move_to_end(text)
+                found[text] = lru["items"][text]
+    missing = list(dict.fromkeys(text for text in texts if text and text not in found))
+    if missing:
+        compiled = {text: compile_opening_hours(text) for text in missing}
+        found.update(compiled)
+        with lru["lock"]:
+            lru["items"].update(compiled)
+            while len(lru["items"]) > OPENING_HOURS_LRU:
+                lru["items"].popitem(last=False)
+    return [found[text] if text else None for text in texts]
 
 
-def move_speed_kmh(mode: str) -> float:
-    return {"도보": 4.5, "대중교통": 18.0, "차량": 28.0}.get(mode, 18.0)
+def opening_windows_batch(pois: List[Dict[str, Any]], day: Optional[date]) -> List[Optional[Intervals]]:
+    # None = opening_hours 없음/해석 불가 → 제약 없음
+    if day is None:
+        return [None] * len(pois)
+    return [oh.windows(day) if oh else None for oh in opening_hours_for(pois)]
 
 
-def leg_overhead_min(mode: str) -> float:
-    return {"도보": 3.0, "대중교통": 10.0, "차량": 8.0}.get(mode, 8.0)
+def open_during_batch(pois: List[Dict[str, Any]], day: date, start_min: int, end_min: int) -> List[Optional[bool]]:
+    # "Day N 14:00~16:00에 열려 있나?" (None = 모름)
+    return [oh.is_open(day, start_min, end_min) if oh else None for oh in opening_hours_for(pois)]
 
 
-def estimate_route_time_minutes(
-    points: List[Tuple[float, float]],
+# =========================
+# Day scheduler
+# =========================
+def schedule_day(
+    pois: List[Dict[str, Any]],
+    day_date: Optional[date],
     mode: str,
-    return_to_center: bool = True,
-    radius_km: float = 8.0,    
+    radius_km: float,
+    matrix: Optional[TravelTimeMatrix] = None,
+    start_min: int = DAY_START_MIN,
+    budget_min: int = DAY_BUDGET_MIN,
 ) -> Dict[str, Any]:
     """
-    ✅ Improved realism:
-    - Short leg => less overhead
-    - Dense area => slightly slower effective speed
+    동선 순서대로 타임라인에 채워 넣기(이동 → 영업 시작까지 대기 → 체류).
+    - 영업시간 안에 체류를 못 끝내거나 09:00+8시간을 넘기면 그 POI는 건너뛰고 unfit으로
+    - start_min: 도시 간 이동 등으로 늦게 시작하는 날
     """
-    stay_min = 0  # ✅ 추가: 모든 경로에서 stay_min이 정의되도록 기본값 세팅
-    
-    if not points or len(points) == 1:
-        stay_min = 60 * len(points)  # POI 체류시간
-        total_min = 0               # 이동시간 없음
-        total_km = 0.0
+    factor = _density_factor(len(pois), radius_km)
+    speed = move_speed_kmh(mode) * factor
+    ids = matrix.ids(pois) if matrix is not None else None
+    end_limit = DAY_START_MIN + budget_min
+    opening = opening_windows_batch(pois, day_date)
+
+    def leg(i: int, j: int) -> float:
+        if ids is not None:
+            return matrix.minutes(ids[i], ids[j], mode, factor)
+        a, b = pois[i], pois[j]
+        return _leg_minutes(haversine_km(a["lat"], a["lon"], b["lat"], b["lon"]), mode, speed)
+
+    slots: List[Dict[str, Any]] = []
+    unfit: List[Dict[str, Any]] = []
+    t = float(start_min)
+    last: Optional[int] = None
+    travel_total = 0.0
+    stay_total = 0
+    for i, p in enumerate(pois):
+        travel = leg(last, i) if last is not None else 0.0
+        arrive = t + travel
+        stay = poi_stay_minutes(p)
+        begin: Optional[float] = arrive
+        windows = opening[i]
+        if windows is not None:
+            begin = next((max(arrive, ws) for ws, we in windows if max(arrive, ws) + stay <= we), None)
+            if begin is None:
+                unfit.append({"poi": p, "reason": "영업시간 외"})
+                continue
+        if begin + stay > end_limit:
+            unfit.append({"poi": p, "reason": "시간 부족"})
+            continue
+        slots.append(
+            {
+                "poi": p,
+                "start": int(round(begin)),
+                "end": int(round(begin + stay)),
+                "travel": int(round(travel)),
+                "wait": int(round(begin - arrive)),
+            }
+        )
+        t = begin + stay
+        last = i
+        travel_total += travel
+        stay_total += stay
 
-        return {
-            "mode": mode,
-            "total_minutes": total_min,
-            "total_km": total_km,
-            "stay_minutes": stay_min,
-            "day_total_minutes": stay_min,
-            "overload": stay_min > 480,
-            "legs": [],
-            "note": "POI가 0~1개라 이동시간 없이 체류시간만 계산했어요.",
-        }
+    used = int(round(t)) - DAY_START_MIN
+    return {
+        "date": day_date.isoformat() if day_date else None,
+        "mode": mode,
+        "slots": slots,
+        "unfit": unfit,
+        "stay_minutes": stay_total,
+        "travel_minutes": int(round(travel_total)),
+        "day_total_minutes": used,
+        "overload": bool(unfit),
+    }
 
 
-        return {
-            "mode": mode,
-            "total_minutes": int(round(total_min)),
-            "total_km": round(total_km, 2),
-            "stay_minutes": stay_min,
-            "day_total_minutes": day_total,
-            "overload": day_total > 480,  # 8시간 초과
-            "legs": legs,
-            "note": "이동+체류 합산 추정치(8시간 초과 시 과부하)",
-        }
+def _km_between(a: Dict[str, Any], b: Dict[str, Any], matrix: Optional[TravelTimeMatrix]) -> float:
+    if matrix is not None:
+        i, j = matrix.idx(a), matrix.idx(b)
+        if i is not None and j is not None:
+            return matrix.km(i, j)
+    return haversine_km(a["lat"], a["lon"], b["lat"], b["lon"])
 
-    speed = move_speed_kmh(mode)
-    overhead = leg_overhead_min(mode)
 
-    # Density adjustment (more points in smaller radius => slower)
-    density = len(points) / max(1.0, radius_km)
-    speed *= max(0.72, 1.15 - 0.06 * density)
+def _insert_cheapest(route: List[Dict[str, Any]], poi: Dict[str, Any], matrix: Optional[TravelTimeMatrix]) -> List[Dict[str, Any]]:
+    # 추가 거리가 가장 작은 위치에 끼워 넣기
+    if not route:
+        return [poi]
+    best_pos, best_cost = len(route), _km_between(route[-1], poi, matrix)
+    cost0 = _km_between(poi, route[0], matrix)
+    if cost0 < best_cost:
+        best_pos, best_cost = 0, cost0
+    for k in range(1, len(route)):
+        a, b = route[k - 1], route[k]
+        cost = _km_between(a, poi, matrix) + _km_between(poi, b, matrix) - _km_between(a, b, matrix)
+        if cost < best_cost:
+            best_pos, best_cost = k, cost
+    return route[:best_pos] + [poi] + route[best_pos:]
 
-    lats = [p[0] for p in points]
-    lons = [p[1] for p in points]
-    center = (sum(lats) / len(lats), sum(lons) / len(lons))
 
-    legs = []
-    total_km = 0.0
-    total_min = 0.0
+def schedule_days(
+    day_map: Dict[int, List[Dict[str, Any]]],
+    start_date: Optional[date],
+    mode: str,
+    radius_km: float,
+    matrix: Optional[TravelTimeMatrix] = None,
+    day_groups: Optional[Dict[int, str]] = None,
+    start_offsets: Optional[Dict[int, int]] = None,
+) -> Tuple[Dict[int, List[Dict[str, Any]]], Dict[int, Dict[str, Any]]]:
+    """
+    Day별 타임라인 + 안 들어가는 POI 재배치.
+    - unfit POI는 같은 그룹(멀티시티면 같은 경유지) 중 여유 있는 날부터 최소 추가거리 위치에 넣어봄
+      (기존 POI를 밀어내지 않을 때만 이동)
+    - 어디에도 안 들어가면 원래 날에 남겨두고 overload로 표시
+    returns: (재배치된 day_map, {day: schedule})
+    """
+    day_groups = day_groups or {}
+    start_offsets = start_offsets or {}
+    plan = {d: list(ps) for d, ps in day_map.items()}
+
+    def run(d: int, pois: List[Dict[str, Any]]) -> Dict[str, Any]:
+        day_date = start_date + timedelta(days=d - 1) if start_date else None
+        return schedule_day(
+            pois, day_date, mode, radius_km, matrix=matrix, start_min=DAY_START_MIN + int(start_offsets.get(d, 0))
+        )
 
-    def leg_minutes(km: float) -> float:
-        local_overhead = overhead
-        if km < 0.8:
-            local_overhead *= 0.6
-        elif km > 8 and mode == "대중교통":
-            local_overhead += 5
-        return (km / max(3.0, speed)) * 60.0 + local_overhead
+    sched = {d: run(d, ps) for d, ps in plan.items()}
+    pending = [(d, u["poi"]) for d in sorted(sched) for u in sched[d]["unfit"]]
+    for d, p in pending:
+        others = sorted(
+            (e for e in plan if e != d and day_groups.get(e) == day_groups.get(d)),
+            key=lambda e: sched[e]["day_total_minutes"],
+        )
+        for e in others:
+            trial = _insert_cheapest(plan[e], p, matrix)
+            s = run(e, trial)
+            placed = {id(x["poi"]) for x in s["slots"]}
+            if id(p) in placed and all(id(x["poi"]) in placed for x in sched[e]["slots"]):
+                plan[d] = [q for q in plan[d] if q is not p]
+                plan[e], sched[e] = trial, s
+                sched[d] = run(d, plan[d])
+                break
 
-    for i in range(len(points) - 1):
-        a = points[i]
-        b = points[i + 1]
-        km = haversine_km(a[0], a[1], b[0], b[1])
-        minutes = leg_minutes(km)
-        legs.append({"from": i, "to": i + 1, "km": round(km, 2), "minutes": int(round(minutes))})
-        total_km += km
-        total_min += minutes
+    return plan, sched
 
-    if return_to_center:
-        last = points[-1]
-        km = haversine_km(last[0], last[1], center[0], center[1])
-        minutes = leg_minutes(km)
-        legs.append({"from": len(points) - 1, "to": "center", "km": round(km, 2), "minutes": int(round(minutes))})
-        total_km += km
-        total_min += minutes
 
+def schedule_summary(sched: Dict[str, Any]) -> Dict[str, Any]:
+    # meta/내보내기용(POI dict 대신 이름/유형만)
     return {
-        "mode": mode,
-        "total_minutes": int(round(total_min)),
-        "total_km": round(total_km, 2),
-        "legs": legs,
-        "note": "추정치(직선거리 기반 보정)라 실제 교통/경로에 따라 달라질 수 있어요.",
+        **{k: v for k, v in sched.items() if k not in ("slots", "unfit")},
+        "slots": [
+            {
+                "name": s["poi"]["name"],
+                "type": s["poi"].get("type"),
+                "start": format_clock(s["start"]),
+                "end": format_clock(s["end"]),
+                "travel": s["travel"],
+                "wait": s["wait"],
+            }
+            for s in sched["slots"]
+        ],
+        "unfit": [{"name": u["poi"]["name"], "type": u["poi"].get("type"), "reason": u["reason"]} for u in sched["unfit"]],
     }
 
 
-def build_day_travel_times(
-    day_map: Dict[int, List[Dict[str, Any]]],
+# =========================
+# Multi-city
+# =========================
+def split_destination_stops(text: str) -> List[str]:
+    # "서울→경주→부산" / "서울 -> 경주 > 부산" (쉼표는 "Vancouver, BC" 같은 표기라 구분자로 안 씀)
+    return [p.strip() for p in re.split(r"\s*(?:→|->|⇒|>|~)\s*", text or "") if p.strip()]
+
+
+def split_days_by_richness(richness: List[float], days: int) -> List[int]:
+    """
+    POI 풍부도에 비례해 일수 분배(최대 잔여 방식).
+    - 일수 ≥ 경유지 수: 모든 경유지 최소 1일
+    - 일수 < 경유지 수: 풍부한 순으로 1일씩, 나머지는 경유만
+    """
+    n = len(richness)
+    if n == 0 or days <= 0:
+        return [0] * n
+    w = [max(1.0, float(r)) for r in richness]
+    if days < n:
+        top = set(sorted(range(n), key=lambda i: -w[i])[:days])
+        return [1 if i in top else 0 for i in range(n)]
+
+    rest = days - n
+    quotas = [rest * x / sum(w) for x in w]
+    alloc = [1 + int(q) for q in quotas]
+    for i in sorted(range(n), key=lambda i: -(quotas[i] - int(quotas[i])))[: days - sum(alloc)]:
+        alloc[i] += 1
+    return alloc
+
+
+def transfer_mode(km: float, styles: List[str]) -> str:
+    if km >= 700:
+        return "항공"
+    if "로드트립" in styles:
+        return "차량"
+    return "대중교통"
+
+
+def transfer_speed_kmh(mode: str) -> float:
+    # 도시 내 move_speed_kmh와 같은 모델, 간선(고속도로/KTX/항공) 기준 속도
+    return {"항공": 650.0, "대중교통": 110.0, "차량": 75.0, "도보": 4.5}.get(mode, 90.0)
+
+
+def transfer_overhead_min(mode: str) -> float:
+    # 역/공항 접근, 대기, 체크인
+    return {"항공": 150.0, "대중교통": 40.0, "차량": 15.0, "도보": 0.0}.get(mode, 30.0)
+
+
+def estimate_transfer(a: Dict[str, Any], b: Dict[str, Any], styles: List[str]) -> Dict[str, Any]:
+    line_km = haversine_km(a["lat"], a["lon"], b["lat"], b["lon"])
+    mode = transfer_mode(line_km, styles)
+    km = line_km if mode == "항공" else line_km * 1.25  # 도로/철로 우회 계수
+    minutes = (km / transfer_speed_kmh(mode)) * 60.0 + transfer_overhead_min(mode)
+    return {"mode": mode, "km": round(km, 1), "minutes": int(round(minutes))}
+
+
+def transfers_by_day(transfers: Optional[List[Dict[str, Any]]]) -> Dict[int, List[Dict[str, Any]]]:
+    # 경유만 하는 도시(0일 배정)가 있으면 같은 날 이동이 여러 번 → 순서대로 모음
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for t in transfers or []:
+        out.setdefault(t["day"], []).append(t)
+    return out
+
+
+def build_multi_city_itinerary(
+    stops: List[Dict[str, Any]],
     styles: List[str],
+    days: int,
     radius_km: float,
-    move_mode_setting: str,
-    return_to_center: bool,
-) -> Dict[int, Dict[str, Any]]:
-    day_times = {}
-    inferred = infer_move_mode(styles, radius_km)
+    exclude_ids: Optional[Set[str]] = None,
+    matrix: Optional[TravelTimeMatrix] = None,
+) -> Dict[str, Any]:
+    """
+    stops: [{"name", "geo", "pois"}] (경로 순서, 좌표 있는 것만)
+    - 경유지별로 build_itinerary_from_pois → 전체 Day 번호로 이어붙임
+    - 도시 간 이동은 다음 경유지 첫날에 기록
+    """
+    alloc = split_days_by_richness([len(s.get("pois") or []) for s in stops], days)
+    poi_daymap: Dict[int, List[Dict[str, Any]]] = {}
+    day_stops: Dict[int, str] = {}
+    transfers: List[Dict[str, Any]] = []
+
+    day = 1
+    for i, (stop, n) in enumerate(zip(stops, alloc)):
+        if i > 0:
+            t = estimate_transfer(stops[i - 1]["geo"], stop["geo"], styles)
+            transfers.append({"from": stops[i - 1]["name"], "to": stop["name"], "day": min(day, days), **t})
+        if n == 0:
+            continue
+        sub = build_itinerary_from_pois(
+            stop.get("pois") or [], styles, days=n, radius_km=radius_km, exclude_ids=exclude_ids, matrix=matrix
+        )
+        for k in range(1, n + 1):
+            poi_daymap[day] = sub.get(k, [])
+            day_stops[day] = stop["name"]
+            day += 1
 
-    for d, pois in day_map.items():
-        pts = [(p["lat"], p["lon"]) for p in pois]
-        mode = move_mode_setting
-        if mode == "자동":
-            mode = inferred
-        day_times[d] = estimate_route_time_minutes(pts, mode=mode, return_to_center=return_to_center, radius_km=radius_km)
+    for d in range(1, days + 1):
+        poi_daymap.setdefault(d, [])
+    return {"poi_daymap": poi_daymap, "day_stops": day_stops, "transfers": transfers, "stop_days": alloc}
 
-    return day_times
+
+def format_minutes(minutes: int) -> str:
+    h, m = divmod(int(minutes), 60)
+    return f"{h}시간 {m}분" if h else f"{m}분"
 
 
 # =========================
@@ -1202,20 +3814,50 @@ def build_checklist(destination_scope: str, month: str, style: List[str], party_
 # =========================
 # Plan builders
 # =========================
-def plan_from_poi_daymap(dest: str, days: int, day_map: Dict[int, List[Dict[str, Any]]], styles: List[str], party: str) -> Dict[str, Any]:
+def plan_from_poi_daymap(
+    dest: str,
+    days: int,
+    day_map: Dict[int, List[Dict[str, Any]]],
+    styles: List[str],
+    party: str,
+    day_stops: Optional[Dict[int, str]] = None,
+    transfers: Optional[List[Dict[str, Any]]] = None,
+    schedule: Optional[Dict[int, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    day_stops = day_stops or {}
+    schedule = schedule or {}
+    transfer_by_day = transfers_by_day(transfers)
     day_blocks = []
     for d in range(1, days + 1):
-        pois = day_map.get(d, [])
-        am = pois[:2]
-        pm = pois[2:4]
-        night = pois[4:6]
+        sched = schedule.get(d)
+        if sched:
+            # 타임라인 시작 시각 기준으로 오전(~12시)/오후(~17시)/밤
+            slots = sched["slots"]
+            am = [s["poi"] for s in slots if s["start"] < 12 * 60]
+            pm = [s["poi"] for s in slots if 12 * 60 <= s["start"] < 17 * 60]
+            night = [s["poi"] for s in slots if s["start"] >= 17 * 60]
+            start_at = {id(s["poi"]): s["start"] for s in slots}
+        else:
+            pois = day_map.get(d, [])
+            am = pois[:2]
+            pm = pois[2:4]
+            night = pois[4:6]
+            start_at = {}
 
         def fmt(items):
             if not items:
                 return "취향 코스(여유) / 근처 산책 / 카페"
-            return " → ".join([f"{p['name']}({p['type']})" for p in items])
+            return " → ".join(
+                [(f"{format_clock(start_at[id(p)])} " if id(p) in start_at else "") + f"{p['name']}({p['type']})" for p in items]
+            )
 
         am_line = f"☀️ 오전: {fmt(am)}"
+        ts = transfer_by_day.get(d)
+        if ts:
+            moves = " → ".join([ts[0]["from"]] + [t["to"] for t in ts])
+            total = sum(t["minutes"] for t in ts)
+            modes = "/".join(dict.fromkeys(t["mode"] for t in ts))
+            am_line = f"☀️ 오전: 🚄 {moves} 이동(약 {format_minutes(total)}, {modes}) 후 {fmt(am)}"
         pm_line = f"🌤️ 오후: {fmt(pm)}"
         night_line = f"🌙 밤: {fmt(night)}"
         if "식도락" in styles:
@@ -1224,8 +3866,11 @@ def plan_from_poi_daymap(dest: str, days: int, day_map: Dict[int, List[Dict[str,
             am_line += " + 느긋하게(마음의 평화 우선)"
         if "유흥" in styles:
             night_line += " + 바/야경 스팟 옵션"
+        if sched and sched["unfit"]:
+            night_line += " / ⚠️ 시간·영업시간상 빠듯: " + ", ".join(u["poi"]["name"] for u in sched["unfit"])
 
-        day_blocks.append({"day": d, "title": f"Day {d}", "plan": [am_line, pm_line, night_line]})
+        title = f"Day {d} · {day_stops[d]}" if d in day_stops else f"Day {d}"
+        day_blocks.append({"day": d, "title": title, "plan": [am_line, pm_line, night_line]})
 
     headline = f"✨ {dest} {days}일 플랜 (feat. {party} 모먼트) — 동선은 효율, 감성은 과몰입"
     summary = "근처 POI를 자동 수집해서 ‘하루 동선’ 기준으로 묶고, 가까운 순으로 정렬했어. 너는 그냥 즐기기만 하면 됨 😎"
@@ -1237,6 +3882,10 @@ def build_rule_based_plan(
     km: Optional[float],
     snapshot: Optional[Dict[str, Any]],
     poi_daymap: Optional[Dict[int, List[Dict[str, Any]]]] = None,
+    day_stops: Optional[Dict[int, str]] = None,
+    transfers: Optional[List[Dict[str, Any]]] = None,
+    schedule: Optional[Dict[int, Dict[str, Any]]] = None,
+    climate: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     days = duration_to_days(payload["duration"])
     styles = payload.get("travel_style", [])
@@ -1251,11 +3900,15 @@ def build_rule_based_plan(
     wx_line = month_hint(payload.get("travel_month", "상관없음"))
     if snapshot:
         wx_line += f" / 최근 스냅샷: 평균 {snapshot['avg_min']}~{snapshot['avg_max']}°C, 강수 {snapshot['total_prcp']}mm(7일)"
+    if climate:
+        wx_line += f" / {format_climate(climate)}"
 
     mode_line = "자유여행이면 동선 최적화가 승부!" if travel_mode == "자유여행" else "패키지면 체력 관리가 승부!"
 
     if poi_daymap:
-        plan = plan_from_poi_daymap(dest, days, poi_daymap, styles, party)
+        plan = plan_from_poi_daymap(
+            dest, days, poi_daymap, styles, party, day_stops=day_stops, transfers=transfers, schedule=schedule
+        )
     else:
         day_blocks = []
         for d in range(1, days + 1):
@@ -1291,6 +3944,9 @@ def build_rule_based_plan(
         f"🚶 이동 팁: {mode_line}",
         "✅ 안전빵: 핵심 스팟은 오전에, 변수는 오후에(‘플랜 B’가 승자)",
     ]
+    if transfers:
+        legs = " / ".join(f"{t['from']}→{t['to']} {format_minutes(t['minutes'])}({t['mode']})" for t in transfers)
+        tips.insert(2, f"🚄 도시 간 이동(추정): {legs}")
     plan["tips"] = tips
     return plan
 
@@ -1324,6 +3980,7 @@ def _validate_plan_schema(plan: Dict[str, Any]) -> Tuple[bool, str]:
 
 
 def call_openai_plan(openai_api_key: str, payload: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    OpenAI = _openai_client_cls()
     if OpenAI is None:
         return None, "openai 패키지가 없어요. `pip install openai` 해주세요."
     try:
@@ -1353,7 +4010,7 @@ def call_openai_plan(openai_api_key: str, payload: Dict[str, Any]) -> Tuple[Opti
 
     user_input = json.dumps(payload, ensure_ascii=False)
 
-    try:
+    def create() -> Dict[str, Any]:
         resp = client.responses.create(
             model=model,
             instructions=instructions,
@@ -1362,15 +4019,28 @@ def call_openai_plan(openai_api_key: str, payload: Dict[str, Any]) -> Tuple[Opti
             include=["web_search_call.action.sources"],
             max_output_tokens=1700,
         )
+        text = getattr(resp, "output_text", None)
+        if not text:
+            try:
+                text = resp.output[0].content[0].text
+            except Exception:
+                text = None
+        try:
+            dumped = resp.model_dump() if hasattr(resp, "model_dump") else None
+        except Exception:
+            dumped = None
+        return {"text": text, "output": (dumped or {}).get("output") or []}
+
+    t0 = time.perf_counter()
+    try:
+        fx = http_fixtures()
+        raw = fx.call("openai", {"model": model, "instructions": instructions, "input": user_input}, create) if fx else create()
     except Exception as e:
+        observe_upstream("openai", time.perf_counter() - t0, type(e).__name__)
         return None, f"OpenAI 호출 실패: {e}"
+    observe_upstream("openai", time.perf_counter() - t0, "ok")
 
-    text = getattr(resp, "output_text", None)
-    if not text:
-        try:
-            text = resp.output[0].content[0].text
-        except Exception:
-            text = None
+    text = raw.get("text")
     if not text:
         return None, "OpenAI 응답 텍스트 추출 실패"
 
@@ -1395,9 +4065,8 @@ def call_openai_plan(openai_api_key: str, payload: Dict[str, Any]) -> Tuple[Opti
         sources = []
 
     try:
-        dumped = resp.model_dump() if hasattr(resp, "model_dump") else None
-        if dumped and "output" in dumped:
-            for item in dumped["output"]:
+        if raw["output"]:
+            for item in raw["output"]:
                 if item.get("type") == "web_search_call":
                     action = item.get("action", {})
                     srcs = action.get("sources", []) or []
@@ -1440,8 +4109,9 @@ def ensure_itinerary_edits(days: int, plan: Dict[str, Any]):
     sset("runtime.itinerary_edits", edits)
 
 
-def apply_itinerary_edits(plan: Dict[str, Any]) -> Dict[str, Any]:
-    edits = sget("runtime.itinerary_edits", {}) or {}
+def apply_itinerary_edits(plan: Dict[str, Any], edits: Optional[Dict[int, Dict[str, str]]] = None) -> Dict[str, Any]:
+    if edits is None:
+        edits = sget("runtime.itinerary_edits", {}) or {}
     new_plan = json.loads(json.dumps(plan))
     for b in new_plan.get("day_blocks", []):
         try:
@@ -1500,19 +4170,42 @@ def make_ics(bundle: Dict[str, Any]) -> str:
 
 
 def make_pdf_bytes(bundle: Dict[str, Any]) -> Optional[bytes]:
-    if rl_canvas is None or A4 is None or mm is None:
+    buf = BytesIO()
+    if not write_pdf(bundle, buf):
         return None
+    return buf.getvalue()
 
-    from io import BytesIO
 
-    buf = BytesIO()
+def write_pdf(bundle: Dict[str, Any], out) -> bool:
+    """
+    PDF를 out(파일 객체)에 바로 씀 — reportlab이 없으면 False
+    - 긴 줄은 폭에 맞춰 줄바꿈, Day 블록은 한 페이지에 들어가면 쪼개지 않음(30일 플랜도 한 번만 그림)
+    - 쪽번호는 "p. N"만(전체 쪽수를 쓰려면 두 번 그려야 해서 생략)
+    """
+    rl = _reportlab()
+    if rl is None:
+        return False
+    A4, rl_canvas, mm = rl
+    simple_split = lazy_import("reportlab.lib.utils").simpleSplit
 
     payload = bundle.get("payload", {})
     plan = bundle.get("plan", {})
     meta = bundle.get("meta", {})
 
-    c = rl_canvas.Canvas(buf, pagesize=A4)
+    c = rl_canvas.Canvas(out, pagesize=A4, pageCompression=1)
     width, height = A4
+    margin = 20 * mm
+    page_no = [1]
+
+    def new_page():
+        c.setFont("Helvetica", 8)
+        c.drawRightString(width - 18 * mm, 10 * mm, f"p. {page_no[0]}")
+        c.showPage()
+        page_no[0] += 1
+        return height - margin
+
+    def ensure(y, need):
+        return new_page() if y - need < margin else y
 
     def draw_title(text, y):
         c.setFont("Helvetica-Bold", 18)
@@ -1526,14 +4219,20 @@ def make_pdf_bytes(bundle: Dict[str, Any]) -> Optional[bytes]:
         c.setFont("Helvetica-Bold", 12)
         c.drawString(18 * mm, y, title)
 
-    def draw_bullets(lines_, y, leading=12):
+    def wrap(line):
+        parts = simple_split(str(line), "Helvetica", 10, width - 22 * mm - 18 * mm - 8) or [""]
+        return [f"• {parts[0]}"] + [f"   {p}" for p in parts[1:]]
+
+    def draw_bullets(lines_, y, leading=12, keep_together=False):
+        rows = [r for line in lines_ for r in wrap(line)]
+        if keep_together and len(rows) * leading <= height - 2 * margin:
+            y = ensure(y, len(rows) * leading)
         c.setFont("Helvetica", 10)
-        for line in lines_:
-            if y < 20 * mm:
-                c.showPage()
-                y = height - 20 * mm
+        for row in rows:
+            if y < margin:
+                y = new_page()
                 c.setFont("Helvetica", 10)
-            c.drawString(22 * mm, y, f"• {line}")
+            c.drawString(22 * mm, y, row)
             y -= leading
         return y
 
@@ -1551,6 +4250,7 @@ def make_pdf_bytes(bundle: Dict[str, Any]) -> Optional[bytes]:
     start_date_str = payload.get("start_date", "")
 
     y -= 4 * mm
+    y = ensure(y, 14 * mm)
     draw_section("Input Summary", y)
     y -= 6 * mm
     y = draw_bullets(
@@ -1568,17 +4268,20 @@ def make_pdf_bytes(bundle: Dict[str, Any]) -> Optional[bytes]:
     )
 
     y -= 4 * mm
+    y = ensure(y, 14 * mm)
     draw_section("Headline", y)
     y -= 6 * mm
     y = draw_bullets([plan.get("headline", "")], y)
 
     y -= 2 * mm
+    y = ensure(y, 14 * mm)
     draw_section("Summary", y)
     y -= 6 * mm
     y = draw_bullets([plan.get("summary", "")], y)
 
     day_times = meta.get("day_travel_times", {}) or {}
     y -= 2 * mm
+    y = ensure(y, 14 * mm)
     draw_section("Estimated Travel Time (per day)", y)
     y -= 6 * mm
     day_lines = []
@@ -1588,17 +4291,19 @@ def make_pdf_bytes(bundle: Dict[str, Any]) -> Optional[bytes]:
     y = draw_bullets(day_lines if day_lines else ["(no data)"], y)
 
     y -= 2 * mm
+    y = ensure(y, 14 * mm + 8 * 12)  # 제목만 페이지 끝에 남지 않게 첫 Day 블록 자리까지
     draw_section("Day-by-Day", y)
     y -= 6 * mm
     for b in plan.get("day_blocks", []) or []:
         title = b.get("title", f"Day {b.get('day','')}")
         lines_ = b.get("plan", []) or []
-        y = draw_bullets([f"{title}:"] + [f"  {ln}" for ln in lines_], y)
+        y = draw_bullets([f"{title}:"] + [f"  {ln}" for ln in lines_], y, keep_together=True)
         y -= 2
 
     tips = plan.get("tips", []) or []
     if tips:
         y -= 4 * mm
+        y = ensure(y, 14 * mm)
         draw_section("Tips", y)
         y -= 6 * mm
         y = draw_bullets(tips, y)
@@ -1606,6 +4311,7 @@ def make_pdf_bytes(bundle: Dict[str, Any]) -> Optional[bytes]:
     sources = plan.get("sources", []) or []
     if sources:
         y -= 4 * mm
+        y = ensure(y, 14 * mm)
         draw_section("Sources", y)
         y -= 6 * mm
         src_lines = []
@@ -1618,21 +4324,115 @@ def make_pdf_bytes(bundle: Dict[str, Any]) -> Optional[bytes]:
                 src_lines.append(str(s))
         y = draw_bullets(src_lines, y)
 
-    c.showPage()
+    new_page()
     c.save()
-    return buf.getvalue()
+    return True
+
+
+# =========================
+# Export service
+# =========================
+EXPORT_CACHE_MAX = int(os.getenv("EXPORT_CACHE_MAX", "32"))
+
+EXPORT_FORMATS = [
+    # (fmt, 버튼 라벨, 확장자, mime)
+    ("json", "📥 JSON", "json", "application/json"),
+    ("ics", "🗓️ ICS(캘린더)", "ics", "text/calendar"),
+    ("pdf", "🧾 PDF", "pdf", "application/pdf"),
+]
+
+
+def bundle_hash(bundle: Dict[str, Any]) -> str:
+    # payload+plan+meta(생성 시각·trace 포함) → 같은 생성 결과면 세션이 달라도 같은 값
+    doc = {k: bundle.get(k) for k in ("payload", "plan", "meta")}
+    doc["payload"] = {k: v for k, v in (doc["payload"] or {}).items() if k != "start_date_obj"}
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def edits_hash(edits: Optional[Dict[int, Dict[str, str]]]) -> str:
+    return hashlib.sha1(json.dumps(edits or {}, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+def render_export(fmt: str, bundle: Dict[str, Any], edits: Optional[Dict[int, Dict[str, str]]]) -> Optional[bytes]:
+    """편집 반영 후 한 형식만 생성 (PDF인데 reportlab이 없으면 None)"""
+    final = {**bundle, "plan": apply_itinerary_edits(bundle["plan"], edits or {})}
+    doc = {
+        "payload": final["payload"],
+        "plan": final["plan"],
+        "meta": final["meta"],
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    if fmt == "json":
+        return json.dumps(bundle_export(final), ensure_ascii=False, indent=2).encode("utf-8")
+    if fmt == "ics":
+        return make_ics(doc).encode("utf-8")
+    if fmt == "pdf":
+        buf = BytesIO()
+        return buf.getvalue() if write_pdf(doc, buf) else None
+    raise ValueError(f"unknown export format: {fmt}")
+
+
+class ExportService:
+    """
+    내보내기 파일을 요청될 때만 생성 — (bundle 해시, 편집 해시, 형식)별 결과를 프로세스 단위 LRU로 공유
+    - get(): 다운로드 버튼에 그대로 넘길 BytesIO (생성 불가면 None)
+    - has(): 이미 만들어 둔 파일이 있는지 (UI에서 ‘만들기’ 버튼 생략용)
+    """
+
+    def __init__(self, max_items: int = EXPORT_CACHE_MAX):
+        self.max_items = max(1, max_items)
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple[str, str, str], Optional[bytes]]" = OrderedDict()
+
+    @staticmethod
+    def key(fmt: str, bundle_sig: str, edits: Optional[Dict[int, Dict[str, str]]]) -> Tuple[str, str, str]:
+        return bundle_sig, edits_hash(edits), fmt
+
+    def has(self, key: Tuple[str, str, str]) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def get(
+        self,
+        fmt: str,
+        bundle: Dict[str, Any],
+        edits: Optional[Dict[int, Dict[str, str]]] = None,
+        bundle_sig: Optional[str] = None,
+    ) -> Optional[BytesIO]:
+        key = self.key(fmt, bundle_sig or bundle_hash(bundle), edits)
+        cache_lookup("export")
+        with self._lock:
+            hit = key in self._items
+            if hit:
+                self._items.move_to_end(key)
+                data = self._items[key]
+        if not hit:
+            cache_miss("export")
+            data = render_export(fmt, bundle, edits)
+            with self._lock:
+                self._items[key] = data
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+        return None if data is None else BytesIO(data)
+
+
+@st.cache_resource(show_spinner=False)
+def export_service() -> ExportService:
+    return ExportService()
 
 
 # =========================
 # Map
 # =========================
-def render_map(dest_geo: Dict[str, Any], pois: List[Dict[str, Any]]):
+def render_map(dest_geo: Dict[str, Any], pois: List[Dict[str, Any]], stops: Optional[List[Dict[str, Any]]] = None):
     if not dest_geo:
         st.info("지도는 목적지 좌표를 못 찾으면 표시가 어려워요. (도시/나라를 더 정확히 써줘봐!)")
         return
 
     layers = []
     dest_data = [{"lat": dest_geo["lat"], "lon": dest_geo["lon"], "name": dest_geo.get("display_name", "Destination"), "kind": "DEST"}]
+    if stops and len(stops) > 1:
+        dest_data = [{"lat": s["lat"], "lon": s["lon"], "name": s["name"], "kind": "STOP"} for s in stops]
     layers.append(
         pdk.Layer(
             "ScatterplotLayer",
@@ -1672,6 +4472,13 @@ def render_map(dest_geo: Dict[str, Any], pois: List[Dict[str, Any]]):
 
 
     view = pdk.ViewState(latitude=dest_geo["lat"], longitude=dest_geo["lon"], zoom=11)
+    if len(dest_data) > 1:
+        # 경유지 전체가 보이도록 중심/줌 조정
+        lats = [d["lat"] for d in dest_data]
+        lons = [d["lon"] for d in dest_data]
+        span = max(max(lats) - min(lats), max(lons) - min(lons), 0.05)
+        zoom = max(3, min(11, int(round(math.log2(360.0 / span))) - 1))
+        view = pdk.ViewState(latitude=sum(lats) / len(lats), longitude=sum(lons) / len(lons), zoom=zoom)
     deck = pdk.Deck(layers=layers, initial_view_state=view, tooltip={"text": "{name} ({kind})"}, map_style="https://basemaps.cartocdn.com/gl/positron-gl-style/style.json", )
     st.pydeck_chart(deck, use_container_width=True)
 
@@ -1679,6 +4486,40 @@ def render_map(dest_geo: Dict[str, Any], pois: List[Dict[str, Any]]):
 # =========================
 # UI
 # =========================
+def render_trace_waterfall(tr: Optional[Dict[str, Any]], render_ms: Optional[float] = None):
+    # 생성 단계 워터폴: 막대 위치/길이 = 루트 대비 시작/소요 시간
+    if not tr:
+        st.caption("trace 없음(캐시된 번들)")
+        return
+    total = max(float(tr.get("ms") or 0.0), 1e-6)
+    rows = []
+    for depth, node in flatten_trace(tr):
+        a = node.get("attrs") or {}
+        bits = [f"{node['ms']:.0f}ms"]
+        if "cache_lookups" in a:
+            bits.append(f"cache hit {max(0, a['cache_lookups'] - a.get('cache_misses', 0))}/{a['cache_lookups']}")
+        if a.get("requests"):
+            bits.append(f"{a['requests']} req")
+        if a.get("bytes"):
+            bits.append(f"{a['bytes'] / 1024:.0f} KB")
+        for k in ("source", "pois", "gazetteer_hits", "error"):
+            if k in a:
+                bits.append(f"{k}={a[k]}")
+        left = 100.0 * node["start_ms"] / total
+        width = max(0.5, 100.0 * node["ms"] / total)
+        rows.append(
+            f"<div style='display:flex;align-items:center;font-size:12px;line-height:18px'>"
+            f"<div style='width:38%;padding-left:{depth * 12}px;white-space:nowrap;overflow:hidden'>"
+            f"{html.escape(node['name'])} <span style='opacity:.6'>{html.escape(' · '.join(bits))}</span></div>"
+            f"<div style='flex:1;position:relative;height:10px'>"
+            f"<div style='position:absolute;left:{left:.2f}%;width:{width:.2f}%;height:10px;"
+            f"border-radius:3px;background:{'#4c78a8' if depth else '#9ecae9'}'></div></div></div>"
+        )
+    st.markdown("".join(rows), unsafe_allow_html=True)
+    if render_ms is not None:
+        st.caption(f"직전 화면 렌더: {render_ms:.0f}ms")
+
+
 def render_header():
     st.markdown(CSS, unsafe_allow_html=True)
     st.markdown(
@@ -1822,6 +4663,10 @@ def render_sidebar():
         ),
     )
 
+DURATION_OPTIONS = ["당일치기", "3일", "5일", "10일 이상"]
+STYLE_OPTIONS = ["힐링", "식도락", "유흥", "로드트립", "액티비티", "쇼핑", "문화/예술", "자연", "테마파크"]
+
+
 def page1():
     st.markdown(
         """
@@ -1859,7 +4704,8 @@ def page1():
           <h3>2) 희망 여행지 🌍</h3>
           <div class="tm-tip">
               아래 칸에는 <b>국가 ❌ / 도시 ⭕</b>로 입력해줘!<br/>
-              (예: ❌ 캐나다 → ⭕ 밴쿠버 / 토론토)
+              (예: ❌ 캐나다 → ⭕ 밴쿠버 / 토론토)<br/>
+              여러 도시를 돌면 <b>→</b>로 이어서 입력 (예: 서울→경주→부산)
           </div>
         """,
         unsafe_allow_html=True,
@@ -1881,103 +4727,655 @@ def page1():
             ),
         )
 
-    nav = st.columns([1, 1, 2])
-    with nav[2]:
-        if st.button("다음 👉 (추가 정보로)", use_container_width=True):
-            st.session_state.step = 2
+    nav = st.columns([1, 1, 2])
+    with nav[2]:
+        if st.button("다음 👉 (추가 정보로)", use_container_width=True):
+            st.session_state.step = 2
+
+
+def page2():
+    st.markdown(
+        """
+        <div class="tm-card">
+          <h3>추가 정보는 ‘디테일의 악마’ 모드 🧠</h3>
+          <div class="tm-tip">여기서부터 여행 퀄이 확 달라져. (진짜임)</div>
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+
+    c1, c2 = st.columns(2)
+    with c1:
+        sset(
+            "input.duration",
+            st.selectbox("여행 일정", DURATION_OPTIONS, index=DURATION_OPTIONS.index(sget("input.duration", "3일"))),
+        )
+        sset(
+            "input.budget",
+            st.number_input("예상 예산(원)", 0, 20000000, int(sget("input.budget", 1000000)), step=50000),
+        )
+
+    with c2:
+        sset(
+            "input.travel_style",
+            st.multiselect(
+                "여행 스타일(복수 선택 가능)",
+                STYLE_OPTIONS,
+                default=sget("input.travel_style", ["힐링"]),
+            ),
+        )
+
+    nav = st.columns([1, 1, 2])
+    with nav[0]:
+        if st.button("👈 이전", use_container_width=True):
+            st.session_state.step = 1
+    with nav[2]:
+        if st.button("여행 계획 뽑기 ✨ (이동시간까지)", use_container_width=True):
+            st.session_state.step = 3
+
+
+# =========================
+# Cache warm-up (recent traffic)
+# =========================
+# 생성된 플랜의 지오코딩 쿼리/좌표/POI 반경을 롤링 로그(JSONL)에 남기고,
+# 프로세스 시작 시 자주 나온 것부터 백그라운드 스레드로 미리 불러 st.cache_data를 채움(서빙은 안 막음).
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") != "0"
+WARMUP_LOG_PATH = os.getenv("WARMUP_LOG_PATH", os.path.join(APP_CACHE_DIR, "traffic.jsonl"))
+WARMUP_LOG_MAX = int(os.getenv("WARMUP_LOG_MAX", "5000") or 5000)  # 넘으면 최근 절반만 남김
+WARMUP_WINDOW_H = float(os.getenv("WARMUP_WINDOW_H", "72") or 72)
+WARMUP_TOP = int(os.getenv("WARMUP_TOP", "20") or 20)
+WARMUP_INTERVAL_S = float(os.getenv("WARMUP_INTERVAL_S", "1.0") or 1.0)  # 항목 사이 쉬는 시간(공유 rate limit과 별개)
+
+
+class TrafficLog:
+    def __init__(self, path: str, max_lines: int = WARMUP_LOG_MAX):
+        self.path = path
+        self.max_lines = max_lines
+        self._lock = threading.Lock()
+        self._lines: Optional[int] = None
+
+    def record(self, entries: List[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        now = round(time.time())
+        text = "".join(json.dumps({"t": now, **e}, ensure_ascii=False) + "\n" for e in entries)
+        with self._lock:
+            try:
+                if self._lines is None:
+                    self._lines = 0
+                    if os.path.exists(self.path):
+                        with open(self.path, "rb") as f:
+                            self._lines = sum(1 for _ in f)
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(text)
+                self._lines += len(entries)
+                if self._lines > self.max_lines:
+                    self._compact()
+            except OSError as e:
+                logger.warning("traffic log write failed (%s): %s", self.path, e)
+
+    def _compact(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            keep = f.readlines()[-(self.max_lines // 2) :]
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(keep)
+        os.replace(tmp, self.path)
+        self._lines = len(keep)
+
+    def top(self, n: int, window_h: float = WARMUP_WINDOW_H) -> List[Dict[str, Any]]:
+        # (쿼리, 반경, 개수)별 최근 빈도순 → 캐시 키와 같은 단위
+        if not os.path.exists(self.path):
+            return []
+        since = time.time() - window_h * 3600.0
+        counts: Dict[Tuple[Any, ...], int] = {}
+        latest: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue
+                if e.get("t", 0) < since or not e.get("q"):
+                    continue
+                key = (e["q"], e.get("r"), e.get("n"))
+                counts[key] = counts.get(key, 0) + 1
+                latest[key] = e
+        ranked = sorted(counts, key=lambda k: counts[k], reverse=True)[:n]
+        return [{**latest[k], "hits": counts[k]} for k in ranked]
+
+
+@st.cache_resource(show_spinner=False)
+def traffic_log() -> TrafficLog:
+    return TrafficLog(WARMUP_LOG_PATH)
+
+
+def record_traffic(entries: List[Dict[str, Any]]) -> None:
+    if WARMUP_ENABLED:
+        traffic_log().record(entries)
+
+
+def _warm_one(item: Dict[str, Any]) -> None:
+    geo = geocode_place(item["q"])
+    lat = geo["lat"] if geo else item.get("lat")
+    lon = geo["lon"] if geo else item.get("lon")
+    if lat is None or lon is None or item.get("r") is None:
+        return  # 출발지 등 지오코딩만 필요한 항목
+    fetch_open_meteo_daily(lat, lon)
+    fetch_pois_overpass(lat, lon, radius_km=float(item["r"]), limit=int(item["n"]))
+
+
+@st.cache_resource(show_spinner=False)
+def start_cache_warmup() -> Dict[str, Any]:
+    """
+    프로세스당 1번: 최근 트래픽 상위 WARMUP_TOP개를 데몬 스레드에서 순서대로 prefetch.
+    - 반환 dict가 진행 상황(state/total/done/failed/current) — 디버그 패널·metrics에서 읽음
+    """
+    status: Dict[str, Any] = {"state": "disabled", "total": 0, "done": 0, "failed": 0, "current": None}
+    if not WARMUP_ENABLED:
+        return status
+    items = traffic_log().top(WARMUP_TOP)
+    status.update(state="running" if items else "idle", total=len(items), started_at=time.time())
+    if not items:
+        return status
+
+    def run():
+        m = metrics()
+        m.set("travelmaker_warmup_items", len(items), state="total")
+        for item in items:
+            status["current"] = item["q"]
+            try:
+                _warm_one(item)
+                status["done"] += 1
+            except Exception as e:
+                status["failed"] += 1
+                logger.warning("warm-up failed (%s): %s", item["q"], e)
+            m.set("travelmaker_warmup_items", status["done"], state="done")
+            m.set("travelmaker_warmup_items", status["failed"], state="failed")
+            time.sleep(WARMUP_INTERVAL_S)
+        status.update(state="done", current=None, finished_at=time.time())
+        logger.info(
+            "cache warm-up done: %s/%s ok, %s failed in %.1fs",
+            status["done"], status["total"], status["failed"], status["finished_at"] - status["started_at"],
+        )
+
+    threading.Thread(target=run, name="cache-warmup", daemon=True).start()
+    logger.info("cache warm-up started: %s items from %s", len(items), WARMUP_LOG_PATH)
+    return status
+
+
+# =========================
+# Bundle store (precomputed plans)
+# =========================
+# cli.py batch 가 인기 조합을 미리 계산해 넣어두는 디스크 저장소. 디렉터리가 있으면 세션/API가 먼저 조회.
+# 저장 단위는 날짜/인원/예산/출발지와 무관한 단계만(precompute_trip: 장소 + POI + 일자 묶기).
+# 날씨/날씨 재배치/숙소(체크인 날짜)/타임라인/플랜은 서빙 시점 입력으로 다시 계산 → 배치를 매일 돌릴 필요 X.
+# JSON으로 저장(웹 앱/serve가 읽는 파일이라 코드 실행 가능한 형식은 안 씀). int 키 dict(day → ...)는 읽을 때 복원.
+BUNDLE_STORE_DIR = os.getenv("BUNDLE_STORE_DIR", os.path.join(APP_CACHE_DIR, "bundles"))
+BUNDLE_STORE_TTL_S = float(os.getenv("BUNDLE_STORE_TTL_H", "24") or 24) * 3600.0
+
+
+# 저장소 키 = 저장 내용이 실제로 의존하는 입력만(배치가 바꾸는 값). 나머지는 서빙 시점 값으로 계산
+BUNDLE_STORE_INPUT_FIELDS = ("destination_scope", "destination_text", "duration", "travel_style")
+BUNDLE_STORE_CONFIG_FIELDS = ("poi_radius_km", "poi_limit", "poi_types", "exclude_ids")
+
+# JSON이 문자열로 바꾸는 day(int) 키 dict 경로
+BUNDLE_INT_KEYED = (("clusters", "poi_daymap"), ("clusters", "day_stops"))
+
+
+def _precomputed_from_json(doc: Dict[str, Any]) -> Dict[str, Any]:
+    for path in BUNDLE_INT_KEYED:
+        parent = doc
+        for k in path[:-1]:
+            parent = parent.get(k) or {}
+        d = parent.get(path[-1])
+        if isinstance(d, dict):
+            parent[path[-1]] = {int(k): v for k, v in d.items()}
+    return doc
+
+
+class BundleStore:
+    def __init__(self, root: str, ttl_s: float = BUNDLE_STORE_TTL_S):
+        self.root = root
+        self.ttl_s = ttl_s
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def is_fresh(self, key: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(self._path(key)) < self.ttl_s
+        except OSError:
+            return False
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        # precompute_trip 결과({"places", "clusters"}) 또는 None(없음/만료/읽기 실패)
+        if not self.is_fresh(key):
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            return _precomputed_from_json({"places": doc["places"], "clusters": doc["clusters"]})
+        except Exception as e:
+            logger.warning("bundle store read failed (%s): %s", key, e)
+            return None
+
+    def put(self, key: str, precomputed: Dict[str, Any]) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        doc = {**precomputed, "stored_at": time.time()}
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+        return path
 
 
-def page2():
-    st.markdown(
-        """
-        <div class="tm-card">
-          <h3>추가 정보는 ‘디테일의 악마’ 모드 🧠</h3>
-          <div class="tm-tip">여기서부터 여행 퀄이 확 달라져. (진짜임)</div>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
+@st.cache_resource(show_spinner=False)
+def bundle_store() -> Optional[BundleStore]:
+    # 디렉터리가 없으면(배치를 안 돌린 배포) 조회 자체를 안 함
+    return BundleStore(BUNDLE_STORE_DIR) if os.path.isdir(BUNDLE_STORE_DIR) else None
 
-    c1, c2 = st.columns(2)
-    with c1:
-        sset(
-            "input.duration",
-            st.selectbox("여행 일정", ["당일치기", "3일", "5일", "10일 이상"], index=["당일치기", "3일", "5일", "10일 이상"].index(sget("input.duration", "3일"))),
-        )
-        sset(
-            "input.budget",
-            st.number_input("예상 예산(원)", 0, 20000000, int(sget("input.budget", 1000000)), step=50000),
-        )
 
-    with c2:
-        sset(
-            "input.travel_style",
-            st.multiselect(
-                "여행 스타일(복수 선택 가능)",
-                ["힐링", "식도락", "유흥", "로드트립", "액티비티", "쇼핑", "문화/예술", "자연", "테마파크"],
-                default=sget("input.travel_style", ["힐링"]),
-            ),
-        )
+# =========================
+# Planning core (Streamlit 없이도 호출 가능)
+# =========================
+# plan_trip(payload, config)는 세션 상태/위젯을 안 봄 → cli.py plan / serve, 배치, 다른 프론트엔드에서 그대로 사용.
+# generate_bundle()은 세션 상태에서 payload/config를 만들고 결과를 세션에 캐시하는 얇은 래퍼.
+PLAN_CONFIG_SECRETS = ("openai_api_key", "amadeus_client_id", "amadeus_client_secret")
 
-    nav = st.columns([1, 1, 2])
-    with nav[0]:
-        if st.button("👈 이전", use_container_width=True):
-            st.session_state.step = 1
-    with nav[2]:
-        if st.button("여행 계획 뽑기 ✨ (이동시간까지)", use_container_width=True):
-            st.session_state.step = 3
+
+def payload_from_input(inp: Dict[str, Any]) -> Dict[str, Any]:
+    # 입력 dict(세션 input.* 또는 API JSON) → payload. 빠진 값은 기본값, start_date는 date/ISO 문자열 모두 허용
+    inp = {**default_app_state()["input"], **{k: v for k, v in (inp or {}).items() if v is not None}}
+    start = inp["start_date"]
+    if isinstance(start, str):
+        start = date.fromisoformat(start[:10])
+    return {
+        "travel_month": inp["travel_month"],
+        "party_count": int(inp["party_count"]),
+        "party_type": inp["party_type"],
+        "destination_scope": inp["destination_scope"],
+        "destination_text": inp["destination_text"],
+        "duration": inp["duration"],
+        "travel_style": list(inp["travel_style"] or []),
+        "budget": int(inp["budget"]),
+        "start_city": inp["start_city"],
+        "start_date": start.isoformat(),
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "start_date_obj": start,
+        "travel_mode": inp["travel_mode"],
+    }
 
 
 def build_payload() -> Dict[str, Any]:
+    return payload_from_input(sget("input") or {})
+
+
+def plan_config_from_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    ui = state.get("ui") or {}
     return {
-        "travel_month": sget("input.travel_month"),
-        "party_count": int(sget("input.party_count")),
-        "party_type": sget("input.party_type"),
-        "destination_scope": sget("input.destination_scope"),
-        "destination_text": sget("input.destination_text"),
-        "duration": sget("input.duration"),
-        "travel_style": sget("input.travel_style"),
-        "budget": int(sget("input.budget")),
-        "start_city": sget("input.start_city"),
-        "start_date": sget("input.start_date").isoformat(),
-        "generated_at": datetime.now().isoformat(timespec="seconds"),
-        "start_date_obj": sget("input.start_date"),
-        "travel_mode": sget("input.travel_mode"),
+        "poi_radius_km": float(ui.get("poi_radius_km", 8)),
+        "poi_limit": int(ui.get("poi_limit", 50)),
+        "poi_types": list(ui.get("poi_types") or []),
+        "move_mode": ui.get("move_mode", "자동"),
+        "include_return_to_center": bool(ui.get("include_return_to_center", True)),
+        "openai_api_key": (ui.get("openai_api_key") or "").strip(),
+        "use_amadeus_hotel": bool(ui.get("use_amadeus_hotel")),
+        "amadeus_client_id": ui.get("amadeus_client_id") or "",
+        "amadeus_client_secret": ui.get("amadeus_client_secret") or "",
+        "hotel": dict(state.get("hotel") or {}),
+        "exclude_ids": sorted((state.get("runtime") or {}).get("poi_user_exclude_ids") or []),
+    }
+
+
+def default_plan_config() -> Dict[str, Any]:
+    return plan_config_from_state(default_app_state())
+
+
+def resolve_plan_config(config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    base = default_plan_config()
+    config = config or {}
+    return {
+        **base,
+        **config,
+        "hotel": {**base["hotel"], **(config.get("hotel") or {})},
+        "exclude_ids": sorted({parse_poi_id(v) for v in config.get("exclude_ids") or []}),
     }
 
 
 def payload_signature(payload: Dict[str, Any]) -> str:
     copy = dict(payload)
     copy.pop("start_date_obj", None)
+    copy.pop("generated_at", None)  # 생성 시각은 입력이 아님(넣으면 매 초 캐시 miss)
     return json.dumps(copy, ensure_ascii=False, sort_keys=True)
 
 
+def plan_signature(payload: Dict[str, Any], config: Dict[str, Any]) -> str:
+    # 결과에 영향 주는 입력 전체. 시크릿은 유무만, 제외 POI는 '재최적화' 버튼으로만 반영(UI 동작 유지)
+    cfg = {k: (bool(v) if k in PLAN_CONFIG_SECRETS else v) for k, v in config.items() if k != "exclude_ids"}
+    return payload_signature(payload) + "|" + json.dumps(cfg, ensure_ascii=False, sort_keys=True, default=str)
+
+
+@st.cache_resource(show_spinner=False)
+def _travel_matrix_lru() -> Dict[str, Any]:
+    return {"lock": threading.Lock(), "items": OrderedDict()}
+
+
+TRAVEL_MATRIX_LRU = 16
+
+
+def travel_matrix_for(pois: List[Dict[str, Any]], groups: Optional[List[int]] = None) -> TravelTimeMatrix:
+    # 같은 POI 집합이면(옵션만 바뀐 재생성, 같은 목적지의 다른 세션 등) 이전 행렬 재사용
+    key = (tuple(_poi_key(p) for p in pois), tuple(groups or ()))
+    lru = _travel_matrix_lru()
+    cache_lookup("travel_matrix")
+    with lru["lock"]:
+        matrix = lru["items"].get(key)
+        if matrix is not None:
+            lru["items"].move_to_end(key)
+            return matrix
+    cache_miss("travel_matrix")
+    matrix = TravelTimeMatrix(pois, groups)
+    with lru["lock"]:
+        lru["items"][key] = matrix
+        while len(lru["items"]) > TRAVEL_MATRIX_LRU:
+            lru["items"].popitem(last=False)
+    return matrix
+
+
+def plan_trip(
+    payload: Dict[str, Any], config: Optional[Dict[str, Any]] = None, precomputed: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    payload(payload_from_input 모양) + config(default_plan_config 키) → (bundle, err).
+    - 세션 상태/Streamlit 위젯 없이 동작. trace/metrics/profiling은 그대로 붙음
+    - precomputed: 저장소의 precompute_trip 결과 — 장소/POI/일자 묶기는 건너뛰고 날짜 의존 단계만 계산
+    - err: OpenAI 실패 사유(규칙 기반 플랜으로 대체된 경우), 그 외 None
+    """
+    config = resolve_plan_config(config)
+    sig = plan_signature(payload, config)
+
+    # ✅ 단계별 span(geocode/weather/overpass/...) → 로그(JSON 줄) + 디버그 패널 워터폴
+    sig_id = hashlib.sha1(sig.encode("utf-8")).hexdigest()[:12]
+    m = metrics()
+    m.inc("travelmaker_bundles_in_progress")
+    try:
+        with profiled("generate_bundle", sig), trace("generate_bundle", sig=sig_id) as root:
+            bundle, err = _build_bundle(payload, config, precomputed)
+    finally:
+        m.inc("travelmaker_bundles_in_progress", -1)
+    bundle["meta"]["trace"] = root.to_dict()
+    m.observe("travelmaker_plan_seconds", root.ms / 1000.0)
+    for child in root.children:
+        m.observe("travelmaker_stage_seconds", child.ms / 1000.0, stage=child.name)
+    m.set("travelmaker_last_plan_pois", bundle["meta"]["poi_used"])
+    return bundle, err
+
+
+def bundle_store_key(payload: Dict[str, Any], config: Dict[str, Any]) -> str:
+    # 시작일/인원/예산/출발지/숙소·이동 설정/시크릿은 키에서 뺌(서빙 시점 값으로 계산) → 배치 결과가 라이브 입력에 맞음.
+    # 제외 POI는 포함('재최적화' 결과가 섞이면 안 됨)
+    config = resolve_plan_config(config)
+    sig = {
+        "input": {k: payload.get(k) for k in BUNDLE_STORE_INPUT_FIELDS},
+        "config": {k: config.get(k) for k in BUNDLE_STORE_CONFIG_FIELDS},
+    }
+    sig["input"]["destination_text"] = " ".join(str(sig["input"]["destination_text"] or "").split())
+    return hashlib.sha1(json.dumps(sig, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def precompute_trip(payload: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    cli.py batch용: 날짜 의존 없는 단계만 → {"places", "clusters"} (JSON 저장 가능, BundleStore.put)
+    - places: 경유지 geocode + 경유지별 POI(_place_context) / clusters: 일자 묶기(_cluster_days)
+    """
+    config = resolve_plan_config(config)
+    with trace("precompute", sig=bundle_store_key(payload, config)[:12]):
+        places, _ = _place_context(payload, config)
+        stops = places["stops"]
+        pois = [p for stop in stops for p in stop["pois"]]
+        ctx = {
+            **places,
+            "radius_km": float(config["poi_radius_km"]),
+            "pois_filtered": pois,
+            "matrix": travel_matrix_for(pois, [len(stop["pois"]) for stop in stops]),
+        }
+        with span("clustering", pois=len(pois)):
+            clusters = _cluster_days(payload, config, ctx)
+    return {"places": places, "clusters": clusters}
+
+
+def cached_plan_trip(payload: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+    # 배치로 미리 계산된 장소/일자 묶기가 있으면 날짜 의존 단계만, 없으면 전체 plan_trip
+    store = bundle_store()
+    if store is not None:
+        cache_lookup("bundle_store")
+        hit = store.get(bundle_store_key(payload, config or {}))
+        if hit is not None:
+            return plan_trip(payload, config, precomputed=hit)
+        cache_miss("bundle_store")
+    return plan_trip(payload, config)
+
+
+COMPARE_MAX_VARIANTS = 4
+COMPARE_FIELDS = ("duration", "travel_style")  # 변형마다 바꿀 수 있는 입력(나머지는 공유)
+
+
+def compare_plans(
+    payload: Dict[str, Any],
+    config: Optional[Dict[str, Any]],
+    variants: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    같은 목적지로 일정/스타일만 바꾼 변형 N개를 한 번에 생성.
+    - geocode/날씨/POI는 한 번만(_trip_context), 일자 묶기/이동시간/숙소/플랜은 변형별 병렬
+      → 각 변형은 단독 생성(plan_trip)과 같은 결과. 숙소 조회는 캐시라 같은 일정 중심이면 재사용
+    - variants: [{"label": "3일", "duration": "3일"}, {"label": "식도락", "travel_style": ["식도락"]}, ...]
+    - 반환: [{"label", "bundle", "error"}] (입력 순서, 최대 COMPARE_MAX_VARIANTS개)
+    """
+    if not variants:
+        raise ValueError("비교할 변형이 없어요.")
+    config = resolve_plan_config(config)
+    items = []
+    for i, v in enumerate(variants[:COMPARE_MAX_VARIANTS]):
+        vp = dict(payload)
+        for k in COMPARE_FIELDS:
+            if v.get(k) is not None:
+                vp[k] = list(v[k]) if k == "travel_style" else v[k]
+        items.append((str(v.get("label") or f"#{i + 1}"), vp))
+    days = max(duration_to_days(vp["duration"]) for _, vp in items)
+
+    def run(item: Tuple[str, Dict[str, Any]]) -> Tuple[Dict[str, Any], Optional[str]]:
+        label, vp = item
+        with span("variant", label=label):
+            return _plan_from_context(vp, config, ctx)
+
+    sig = plan_signature(payload, config) + "|" + json.dumps(variants, ensure_ascii=False, sort_keys=True, default=str)
+    m = metrics()
+    m.inc("travelmaker_bundles_in_progress")
+    try:
+        with profiled("compare_plans", sig), trace("compare_plans", variants=len(items)) as root:
+            ctx = _trip_context(payload, config, days)
+            results = _run_parallel(run, items)
+    finally:
+        m.inc("travelmaker_bundles_in_progress", -1)
+    m.observe("travelmaker_compare_seconds", root.ms / 1000.0)
+
+    tr = root.to_dict()
+    out = []
+    for (label, _), (bundle, err) in zip(items, results):
+        bundle["meta"]["trace"] = tr
+        bundle["meta"]["compare_label"] = label
+        out.append({"label": label, "bundle": bundle, "error": err})
+    return out
+
+
+def compare_summary(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """compare_plans 결과 → 나란히 보기용 행. delta는 첫 번째 변형 대비"""
+    rows = []
+    for r in results:
+        payload, meta = r["bundle"]["payload"], r["bundle"]["meta"]
+        days = duration_to_days(payload["duration"])
+        infos = [v for v in (meta.get("day_travel_times") or {}).values() if isinstance(v, dict) and "total_minutes" in v]
+        total = sum(int(v.get("total_minutes") or 0) for v in infos)
+        hotel = meta.get("selected_hotel") or {}
+        rows.append({
+            "label": r["label"],
+            "duration": payload["duration"],
+            "days": days,
+            "styles": list(payload.get("travel_style") or []),
+            "travel_total_min": total,
+            "travel_avg_min": int(round(total / len(infos))) if infos else 0,
+            "overload_days": sum(1 for v in infos if v.get("overload")),
+            "pois": sum(len(ps) for ps in r["bundle"]["poi_daymap"].values()),
+            "hotel": f"{hotel['name']} ({hotel.get('price', 0):,}원/박)" if hotel.get("name") else None,
+            "budget_per_day": int(payload["budget"]) // max(1, days),
+            "alloc": allocate_budget(int(payload["budget"]), payload.get("travel_mode", "자유여행"), payload.get("travel_style") or []),
+            "headline": r["bundle"]["plan"].get("headline", ""),
+            "error": r.get("error"),
+        })
+    base = rows[0] if rows else None
+    for row in rows:
+        row["delta"] = {
+            k: row[k] - base[k] for k in ("travel_total_min", "travel_avg_min", "overload_days", "pois", "budget_per_day")
+        }
+        row["delta"]["alloc"] = {k: v - base["alloc"].get(k, 0) for k, v in row["alloc"].items()}
+    return rows
+
+
+def bundle_export(bundle: Dict[str, Any], poi_limit: int = 100) -> Dict[str, Any]:
+    # JSON 다운로드 / cli.py plan / HTTP API가 같은 모양으로 내보냄
+    return {
+        "app": APP_NAME,
+        "payload": {k: v for k, v in bundle["payload"].items() if k != "start_date_obj"},
+        "meta": bundle["meta"],
+        "plan": bundle["plan"],
+        "pois": bundle["pois"][:poi_limit],
+        "poi_daymap": {str(d): [poi_id(p) for p in ps] for d, ps in bundle["poi_daymap"].items()},
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
 def generate_bundle() -> Tuple[Dict[str, Any], Optional[str]]:
     payload = build_payload()
-    sig = payload_signature(payload)
+    config = plan_config_from_state(_app_state())
+    sig = plan_signature(payload, config)
 
+    cache_lookup("bundle")
     if sget("cache.last_payload_sig") == sig and sget("cache.last_bundle") is not None:
         return sget("cache.last_bundle"), None
+    cache_miss("bundle")
 
+    bundle, err = cached_plan_trip(payload, config)
+
+    sset("cache.last_payload_sig", sig)
+    sset("cache.last_bundle", bundle)
+    sset("runtime.itinerary_edits", {})
+
+    return bundle, err
+
+
+def _build_bundle(
+    payload: Dict[str, Any], config: Dict[str, Any], precomputed: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    precomputed = precomputed or {}
+    ctx = _trip_context(payload, config, duration_to_days(payload["duration"]), places=precomputed.get("places"))
+    return _plan_from_context(payload, config, ctx, clusters=precomputed.get("clusters"))
+
+
+def _place_context(payload: Dict[str, Any], config: Dict[str, Any], start_text: str = "") -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    날짜/인원/출발지와 무관한 장소 단계: 경유지 geocode → 경유지별 POI → 타입 필터 (JSON으로 저장 가능)
+    - start_text: 출발지도 같은 geocode 묶음으로 조회 → (places, start_geo)
+    """
     dest_text = (payload.get("destination_text") or "").strip()
-    start_text = (payload.get("start_city") or "").strip()
 
-    # 해외인데 도시 힌트가 없으면 city 힌트 추가
-    if payload.get("destination_scope") == "해외" and dest_text:
-        if "," not in dest_text:
-            dest_text = f"{dest_text}, city"
-
-    dest_geo = geocode_place(dest_text) if dest_text else None
-    start_geo = geocode_place(start_text) if start_text else None
-
-    if dest_geo:
-        display = (dest_geo.get("display_name") or "").lower()
-        if any(k in display for k in ["canada", "united states", "japan", "australia"]):
-            st.info(
-                "입력한 값이 ‘국가 단위’로 인식됐을 가능성이 있어요. "
-                "도시로 입력하면 POI·동선·이동시간 정확도가 훨씬 좋아져요! "
-                "예: 밴쿠버 / 토론토 / 도쿄"
-            )
+    # "서울→경주→부산" 처럼 여러 도시면 멀티시티 모드
+    stop_names = split_destination_stops(dest_text) or [dest_text]
+    multi_city = len(stop_names) >= 2
+
+    def with_city_hint(text: str) -> str:
+        # 해외인데 도시 힌트가 없으면 city 힌트 추가
+        if payload.get("destination_scope") == "해외" and text and "," not in text:
+            return f"{text}, city"
+        return text
+
+    # ✅ 출발지 + 모든 경유지를 한 번에(중복 제거 + 병렬 + 공유 rate limit)
+    geo_queries = [with_city_hint(n) for n in stop_names] + [start_text]
+    with span("geocode", queries=len(geo_queries)):
+        geo_results = geocode_many(geo_queries)
+    start_geo = geo_results[-1][0]
+    stop_geos = [g for g, _ in geo_results[:-1]]
+    dest_geo = next((g for g in stop_geos if g), None)
+
+    country_level = bool(dest_geo) and any(
+        k in (dest_geo.get("display_name") or "").lower() for k in ["canada", "united states", "japan", "australia"]
+    )
+
+    radius_km = float(config["poi_radius_km"])
+    poi_limit = int(config["poi_limit"])
+    stops = [{"name": n, "geo": g} for n, g in zip(stop_names, stop_geos) if g]
+
+    # 재시작 후 warm-up용: 캐시 키와 같은 단위(쿼리/좌표/반경/개수)로 기록
+    record_traffic(
+        [{"q": q, "lat": g["lat"], "lon": g["lon"], "r": radius_km, "n": poi_limit} for q, g in zip(geo_queries, stop_geos) if g]
+        + ([{"q": geo_queries[-1]}] if start_geo and geo_queries[-1] else [])
+    )
+
+    def fetch_stop_pois(stop: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        with span(f"stop:{stop['name']}"):
+            cache_lookup("pois")
+            try:
+                got = fetch_pois_or_last(stop["geo"]["lat"], stop["geo"]["lon"], radius_km=radius_km, limit=poi_limit)
+                trace_set(pois=len(got))
+                return got, None
+            except Exception as e:
+                trace_set(error=str(e)[:120])
+                return [], str(e)
+
+    # ✅ 경유지별 POI 병렬 수집(경유지마다 fetch_pois_overpass 캐시 그대로 재사용)
+    overpass_errs = []
+    with span("overpass", stops=len(stops)):
+        fetched = _run_parallel(fetch_stop_pois, stops)
+    for stop, (stop_pois, e) in zip(stops, fetched):
+        stop["pois_all"] = stop_pois
+        if e:
+            overpass_errs.append(f"{stop['name']}: {e}" if multi_city else e)
+
+    allowed_types = set(config["poi_types"] or [])
+    for stop in stops:
+        filtered = [p for p in stop["pois_all"] if (p.get("type") in allowed_types)] if allowed_types else stop["pois_all"]
+        stop["pois"] = filtered or stop["pois_all"]
+
+    places = {
+        "stop_names": stop_names,
+        "stop_geos": stop_geos,
+        "multi_city": multi_city,
+        "dest_geo": dest_geo,
+        "country_level": country_level,
+        "stops": stops,
+        "overpass_err": " / ".join(overpass_errs) or None,
+    }
+    return places, start_geo
+
+
+def _trip_context(
+    payload: Dict[str, Any], config: Dict[str, Any], days: int, places: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    일정/스타일과 무관한 공유 단계: 장소(_place_context) → 출발지 거리 → 날씨(days일치) → 이동시간 행렬
+    - places: 저장소(cli.py batch)에서 읽은 장소 단계 — 있으면 경유지 geocode/POI 수집 생략, 날짜 의존 단계만 실행
+    - 숙소는 일정 중심에 따라 달라지니 여기서 안 함(_plan_from_context, 조회는 캐시됨)
+    """
+    start_text = (payload.get("start_city") or "").strip()
+    if places is None:
+        places, start_geo = _place_context(payload, config, start_text)
+    else:
+        with span("geocode", queries=1, stored=True):
+            start_geo = geocode_many([start_text])[0][0] if start_text else None
+    dest_geo = places["dest_geo"]
 
     km = None
     distance_comment = "거리 계산 보류(도시 입력이 비었거나 검색 실패)"
@@ -1985,89 +5383,183 @@ def generate_bundle() -> Tuple[Dict[str, Any], Optional[str]]:
         km = haversine_km(start_geo["lat"], start_geo["lon"], dest_geo["lat"], dest_geo["lon"])
         distance_comment = f"{km:,.0f} km · {classify_distance(km)}"
 
-    days = duration_to_days(payload["duration"])
-
-    snapshot = fetch_open_meteo_recent_snapshot(dest_geo["lat"], dest_geo["lon"]) if dest_geo else None
     forecast = None
     forecast_note = None
+    climate = None
 
     start_d: date = payload["start_date_obj"]
     delta = (start_d - date.today()).days
-    if dest_geo and -1 <= delta <= 15:
-        forecast = fetch_open_meteo_forecast(dest_geo["lat"], dest_geo["lon"], days)
-        forecast_note = "시작일이 가까워서(±16일) 예보 기반으로 표시했어."
-    else:
-        forecast_note = "시작일이 예보 범위 밖이라 ‘최근 스냅샷 + 월 힌트’로 감 잡기 모드!"
+    with span("weather") as sp:
+        if dest_geo and -1 <= delta <= 15:
+            forecast = fetch_open_meteo_forecast(dest_geo["lat"], dest_geo["lon"], days, start=start_d)
+            forecast_note = "시작일이 가까워서(±16일) 예보 기반으로 표시했어."
+        else:
+            climate = climate_normals(dest_geo["lat"], dest_geo["lon"], start_d.month) if dest_geo else None
+            if climate:
+                forecast_note = f"시작일이 예보 범위 밖이라 {start_d.month}월 평년값(기후 통계)으로 보여줄게."
+            else:
+                forecast_note = "시작일이 예보 범위 밖이라 ‘최근 스냅샷 + 월 힌트’로 감 잡기 모드!"
+        # 평년값이 있으면 '앞으로 7일' 스냅샷은 여행 월과 무관하니 생략(네트워크 0)
+        snapshot = fetch_open_meteo_recent_snapshot(dest_geo["lat"], dest_geo["lon"]) if dest_geo and not climate else None
+        trace_set(source="forecast" if forecast else "climate" if climate else "snapshot" if snapshot else "none")
 
-    pois_all = []
-    overpass_err = None
-    if dest_geo:
-        try:
-            pois_all = fetch_pois_overpass(
-                dest_geo["lat"],
-                dest_geo["lon"],
-                radius_km=float(sget("ui.poi_radius_km")),
-                limit=int(sget("ui.poi_limit")),
-            )
-        except Exception as e:
-            overpass_err = str(e)
-            pois_all = []
+    stops = places["stops"]
+    pois_all = [p for stop in stops for p in stop["pois_all"]]
+    pois_filtered = [p for stop in stops for p in stop["pois"]]
+    # ✅ 동선 최적화/이동시간/호텔 기준 재정렬이 모두 같은 행렬을 조회(행은 경유지 구간 안에서만 계산)
+    matrix = travel_matrix_for(pois_filtered, [len(stop["pois"]) for stop in stops])
+
+    return {
+        **places,
+        "start_geo": start_geo,
+        "km": km,
+        "distance_comment": distance_comment,
+        "forecast": forecast,
+        "forecast_note": forecast_note,
+        "climate": climate,
+        "snapshot": snapshot,
+        "radius_km": float(config["poi_radius_km"]),
+        "pois_all": pois_all,
+        "pois_filtered": pois_filtered,
+        "matrix": matrix,
+    }
 
-    allowed_types = set(sget("ui.poi_types") or [])
-    pois_filtered = [p for p in pois_all if (p.get("type") in allowed_types)] if allowed_types else pois_all
-    if not pois_filtered:
-        pois_filtered = pois_all
 
-    exclude_ids = set(sget("runtime.poi_user_exclude_ids") or set())
+def _cluster_days(payload: Dict[str, Any], config: Dict[str, Any], ctx: Dict[str, Any]) -> Dict[str, Any]:
+    # 일자 묶기(날짜/날씨와 무관) → 저장소에 같이 저장되는 단위
+    days = duration_to_days(payload["duration"])
     styles = payload.get("travel_style", [])
-    poi_daymap = build_itinerary_from_pois(pois_filtered, styles, days=days, radius_km=float(sget("ui.poi_radius_km")), exclude_ids=exclude_ids)
-
-    move_mode_setting = sget("ui.move_mode")
-    day_travel_times = build_day_travel_times(
-        poi_daymap,
-        styles=styles,
-        radius_km=float(sget("ui.poi_radius_km")),
-        move_mode_setting=move_mode_setting,
-        return_to_center=bool(sget("ui.include_return_to_center")),
+    exclude_ids = set(config["exclude_ids"] or [])
+    radius_km, matrix = ctx["radius_km"], ctx["matrix"]
+    if ctx["multi_city"]:
+        return build_multi_city_itinerary(
+            ctx["stops"], styles, days=days, radius_km=radius_km, exclude_ids=exclude_ids, matrix=matrix
+        )
+    poi_daymap = build_itinerary_from_pois(
+        ctx["pois_filtered"], styles, days=days, radius_km=radius_km, exclude_ids=exclude_ids, matrix=matrix
     )
+    return {"poi_daymap": poi_daymap, "day_stops": {}, "transfers": [], "stop_days": None}
+
+
+def _plan_from_context(
+    payload: Dict[str, Any], config: Dict[str, Any], ctx: Dict[str, Any], clusters: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    일정/스타일에 따라 달라지는 단계: 일자 묶기 → 날씨 재배치 → 숙소 → 타임라인/이동시간 → 플랜
+    - ctx는 읽기만 → 병렬 변형이 공유. clusters: 저장소에서 읽은 일자 묶기(_cluster_days 결과)
+    """
+    days = duration_to_days(payload["duration"])
+    start_d: date = payload["start_date_obj"]
+    multi_city = ctx["multi_city"]
+    stop_names, stop_geos = ctx["stop_names"], ctx["stop_geos"]
+    start_geo, dest_geo, country_level = ctx["start_geo"], ctx["dest_geo"], ctx["country_level"]
+    km, distance_comment = ctx["km"], ctx["distance_comment"]
+    forecast, forecast_note, climate, snapshot = ctx["forecast"], ctx["forecast_note"], ctx["climate"], ctx["snapshot"]
+    if forecast:  # 비교 모드 ctx는 가장 긴 변형 기준(days=max) → 이 변형의 일수만큼만
+        forecast = {**forecast, "daily": forecast["daily"][:days]}
+    radius_km, matrix = ctx["radius_km"], ctx["matrix"]
+    pois_all, pois_filtered, overpass_err = ctx["pois_all"], ctx["pois_filtered"], ctx["overpass_err"]
+    stops = [dict(stop) for stop in ctx["stops"]]  # 멀티시티가 stop["days"]를 씀
+
+    styles = payload.get("travel_style", [])
+    with span("clustering", pois=len(pois_filtered), days=days, stored=clusters is not None):
+        if clusters is None:
+            clusters = _cluster_days(payload, config, ctx)
+        poi_daymap = clusters["poi_daymap"]
+        day_stops: Dict[int, str] = clusters["day_stops"]
+        transfers: List[Dict[str, Any]] = clusters["transfers"]
+        if multi_city:
+            for stop, n in zip(stops, clusters["stop_days"]):
+                stop["days"] = n
+
+        # ✅ 예보가 있으면 비 오는 날 ↔ 맑은 날 사이 실내/야외 POI 맞교환(이미 받은 예보만 사용)
+        poi_daymap, weather_swaps = rerank_days_by_weather(
+            poi_daymap,
+            forecast.get("daily") if forecast else None,
+            start_d,
+            matrix=matrix,
+            day_groups=day_stops,
+        )
+
+    move_mode_setting = config["move_mode"]
     # ===== Hotel Recommendation =====
-    hotel_opts = sget("hotel")
-    hotels = recommend_hotels(
-        poi_daymap=poi_daymap,
-        styles=styles,
-        hotel_opts=hotel_opts,
-        payload=payload,   # 🔥 이 한 줄이 핵심
+    # 멀티시티면 경유지별로 따로(각 경유지 Day들의 중심 기준)
+    hotel_opts = config["hotel"]
+    amadeus = (
+        {"client_id": config["amadeus_client_id"], "client_secret": config["amadeus_client_secret"]}
+        if config["use_amadeus_hotel"]
+        else None
     )
+    groups: Dict[Optional[str], Dict[int, List[Dict[str, Any]]]] = {}
+    for d, ps in poi_daymap.items():
+        groups.setdefault(day_stops.get(d), {})[d] = ps
+
+    def recommend_for(item: Tuple[Optional[str], Dict[int, List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        name, sub = item
+        hs = recommend_hotels(
+            poi_daymap=sub,
+            styles=styles,
+            hotel_opts=hotel_opts,
+            payload=payload,   # 🔥 이 한 줄이 핵심
+            amadeus=amadeus,
+        )
+        return [{**h, "stop": name} for h in hs] if name else hs
+
+    hotels = []
+    selected_by_stop: Dict[Optional[str], Dict[str, Any]] = {}
+    with span("hotels", groups=len(groups)):
+        hotel_results = _run_parallel(recommend_for, list(groups.items()))
+    for (name, _), hs in zip(groups.items(), hotel_results):
+        hotels += hs
+        if hs:
+            selected_by_stop[name] = hs[0]
 
     selected_hotel = hotels[0] if hotels else None
 
-    if selected_hotel and hotel_opts.get("reorder_by_hotel"):
+    if selected_by_stop and hotel_opts.get("reorder_by_hotel"):
+        def hotel_dist(h: Optional[Dict[str, Any]], p: Dict[str, Any]) -> float:
+            if not h:
+                return 0.0
+            i = matrix.idx(p)
+            return matrix.km_from(h["lat"], h["lon"])[i] if i is not None else haversine_km(h["lat"], h["lon"], p["lat"], p["lon"])
+
         poi_daymap = {
-            d: sorted(
-                ps,
-                key=lambda p: haversine_km(
-                    selected_hotel["lat"],
-                    selected_hotel["lon"],
-                    p["lat"],
-                    p["lon"],
-                ),
-            )
+            d: sorted(ps, key=lambda p, h=selected_by_stop.get(day_stops.get(d)): hotel_dist(h, p))
             for d, ps in poi_daymap.items()
         }
 
+    # ✅ 체류+이동+영업시간으로 Day 타임라인(8시간) → 안 들어가는 POI는 같은 도시 다른 날로
+    day_mode = infer_move_mode(styles, radius_km) if move_mode_setting == "자동" else move_mode_setting
+    with span("routing", mode=day_mode):
+        poi_daymap, day_schedule = schedule_days(
+            poi_daymap,
+            payload["start_date_obj"],
+            day_mode,
+            radius_km,
+            matrix=matrix,
+            day_groups=day_stops,
+            start_offsets={d: sum(t["minutes"] for t in ts) for d, ts in transfers_by_day(transfers).items()},
+        )
         day_travel_times = build_day_travel_times(
             poi_daymap,
             styles=styles,
-            radius_km=float(sget("ui.poi_radius_km")),
+            radius_km=radius_km,
             move_mode_setting=move_mode_setting,
-            return_to_center=bool(sget("ui.include_return_to_center")),
+            return_to_center=bool(config["include_return_to_center"]),
+            matrix=matrix,
         )
+    for d, sc in day_schedule.items():
+        info = day_travel_times.setdefault(d, {})
+        info["schedule"] = schedule_summary(sc)
+        info["overload"] = sc["overload"]
+    for d, ts in transfers_by_day(transfers).items():
+        day_travel_times.setdefault(d, {})["transfers"] = ts
     mode_used = None
     if day_travel_times:
         mode_used = day_travel_times.get(1, {}).get("mode") or None
 
     err = None
-    openai_key = (sget("ui.openai_api_key") or "").strip()
+    openai_key = (config["openai_api_key"] or "").strip()
     plan = None
 
     enriched_payload = dict(payload)
@@ -2075,21 +5567,54 @@ def generate_bundle() -> Tuple[Dict[str, Any], Optional[str]]:
     enriched_payload["distance_km_estimate"] = km
     enriched_payload["distance_comment"] = distance_comment
     enriched_payload["weather_snapshot"] = snapshot
+    enriched_payload["climate_normals"] = climate
     enriched_payload["weather_forecast_daily"] = forecast.get("daily") if forecast else None
     enriched_payload["poi_sample"] = [{"name": p["name"], "type": p["type"], "quality": p.get("quality", 0)} for p in pois_filtered[:25]]
     enriched_payload["estimated_day_travel_times"] = {
         str(d): {"mode": info.get("mode"), "total_minutes": info.get("total_minutes"), "total_km": info.get("total_km")}
         for d, info in day_travel_times.items()
     }
+    enriched_payload["day_timelines"] = {
+        str(d): [f"{s_['start']}-{s_['end']} {s_['name']}" for s_ in info["schedule"]["slots"]]
+        for d, info in day_travel_times.items()
+        if info.get("schedule")
+    }
+    if multi_city:
+        enriched_payload["route_stops"] = [{"name": st_["name"], "days": st_.get("days", 0)} for st_ in stops]
+        enriched_payload["intercity_transfers"] = transfers
     enriched_payload["note"] = "이동시간은 직선거리 기반 보정치임(실제 경로/교통상황과 다를 수 있음)."
 
     if openai_key:
-        plan, err = call_openai_plan(openai_key, enriched_payload)
+        with span("openai"):
+            plan, err = call_openai_plan(openai_key, enriched_payload)
+            trace_set(ok=bool(plan))
+        if not plan:
+            count_fallback("openai_rule_based")
 
     if not plan:
-        plan = build_rule_based_plan(payload, km=km, snapshot=snapshot, poi_daymap=poi_daymap)
+        with span("plan"):
+            plan = build_rule_based_plan(
+                payload,
+                km=km,
+                snapshot=snapshot,
+                poi_daymap=poi_daymap,
+                day_stops=day_stops,
+                transfers=transfers,
+                schedule=day_schedule,
+                climate=climate,
+            )
+
+    if weather_swaps:
+        swapped_days = sorted({s_["from"] for s_ in weather_swaps if s_["weather"] == "bad"})
+        plan.setdefault("tips", [])
+        plan["tips"].insert(
+            0,
+            f"🌧️ 날씨 반영: 예보상 궂은 날(Day {', '.join(map(str, swapped_days))})은 실내 위주, 맑은 날은 야외 위주로 {len(weather_swaps)}곳 자리 바꿈"
+            if swapped_days
+            else f"☀️ 날씨 반영: 맑은 날에 야외 스팟이 오도록 {len(weather_swaps)}곳 자리 바꿈",
+        )
 
-    totals = [v.get("total_minutes", 0) for v in day_travel_times.values() if isinstance(v, dict)]
+    totals = [v.get("total_minutes", 0) for v in day_travel_times.values() if isinstance(v, dict) and "total_minutes" in v]
     if totals:
         avg_min = int(round(sum(totals) / len(totals)))
         plan.setdefault("tips", [])
@@ -2097,22 +5622,39 @@ def generate_bundle() -> Tuple[Dict[str, Any], Optional[str]]:
 
     meta = {
         "dest_geo": dest_geo,
+        "country_level_hint": country_level,
         "start_geo": start_geo,
         "distance_km": km,
         "distance_comment": distance_comment,
         "weather_snapshot": snapshot,
         "weather_forecast": forecast,
         "weather_note": forecast_note,
+        "climate_normals": climate,
         "poi_total": len(pois_all),
         "poi_used": len(pois_filtered),
         "day_travel_times": day_travel_times,
+        "weather_swaps": weather_swaps,
         "move_mode_setting": move_mode_setting,
         "move_mode_used": mode_used
-        or (infer_move_mode(styles, float(sget("ui.poi_radius_km"))) if move_mode_setting == "자동" else move_mode_setting),
+        or (infer_move_mode(styles, radius_km) if move_mode_setting == "자동" else move_mode_setting),
         "generated_at": datetime.now().isoformat(timespec="seconds"),
         "hotel_recommendations": hotels,
         "selected_hotel": selected_hotel,
         "overpass_error": overpass_err,
+        "stops": [
+            {
+                "name": stop["name"],
+                "display_name": stop["geo"].get("display_name"),
+                "lat": stop["geo"]["lat"],
+                "lon": stop["geo"]["lon"],
+                "days": stop.get("days"),
+                "poi_count": len(stop["pois"]),
+            }
+            for stop in stops
+        ],
+        "stops_not_found": [n for n, g in zip(stop_names, stop_geos) if n and not g],
+        "day_stops": day_stops,
+        "transfers": transfers,
     }
 
     bundle = {
@@ -2123,12 +5665,240 @@ def generate_bundle() -> Tuple[Dict[str, Any], Optional[str]]:
         "plan": plan,
         "exported_at": datetime.now().isoformat(timespec="seconds"),
     }
+    return bundle, err
 
-    sset("cache.last_payload_sig", sig)
-    sset("cache.last_bundle", bundle)
-    sset("runtime.itinerary_edits", {})
 
-    return bundle, err
+# =========================
+# Page 3 (fragments)
+# =========================
+# st.fragment(1.37+) 안의 위젯은 그 함수만 다시 실행 → 편집/제외 체크/내보내기가 페이지 전체를 다시 그리지 않음
+# 구버전 Streamlit이면 일반 함수(전체 rerun)로 동작
+_st_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+
+def fragment(fn):
+    return _st_fragment(fn) if _st_fragment else fn
+
+
+def rerun_app():
+    """fragment 안에서 바뀐 값이 다른 fragment(내보내기 등)에도 보여야 할 때 — 페이지 전체 rerun"""
+    if not _st_fragment:
+        return  # fragment가 없으면 위젯이 이미 전체 rerun을 일으킴
+    try:
+        st.rerun(scope="app")
+    except TypeError:  # experimental_fragment 시절 st.rerun()에는 scope가 없음(기본이 전체)
+        st.rerun()
+
+
+POI_TABLE_LIMIT = 60
+
+
+def page3_inputs(bundle: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    bundle에서 파생되는 page3 렌더 입력 — bundle이 바뀔 때만 다시 계산 (위젯 rerun마다 반복 X)
+    - day_entries: [(day, day_block | None)] — Day별 fragment 단위
+    - poi_rows: 제외 표(이름/타입/퀄리티/중심 거리) / alloc, checklist: 예산·체크리스트 탭
+    """
+    memo = sget("cache.page3_inputs")
+    if memo is not None and memo["bundle"] is bundle:
+        return memo
+
+    payload, meta, plan, pois = bundle["payload"], bundle["meta"], bundle["plan"], bundle["pois"]
+    styles = payload.get("travel_style", [])
+    days = duration_to_days(payload["duration"])
+
+    dest_geo = meta.get("dest_geo")
+    dest_name = dest_geo["display_name"] if dest_geo else (payload.get("destination_text") or "미입력(이러면 추천이 ‘감’이 됨)")
+    stops = meta.get("stops") or []
+    if len(stops) > 1:
+        dest_name = " → ".join(f"{s_['name']}({s_.get('days') or 0}일)" for s_ in stops)
+
+    day_entries: List[Tuple[Any, Optional[Dict[str, Any]]]] = []
+    for b in plan.get("day_blocks", []):
+        try:
+            day_entries.append((int(b.get("day")), b))
+        except Exception:
+            day_entries.append((b.get("day", "?"), b))
+    covered = {d for d, _ in day_entries}
+    day_entries += [(d, None) for d in range(1, days + 1) if d not in covered]
+
+    poi_rows = []
+    if pois:
+        center_lat = dest_geo["lat"] if dest_geo else pois[0]["lat"]
+        center_lon = dest_geo["lon"] if dest_geo else pois[0]["lon"]
+        for p in pois[:POI_TABLE_LIMIT]:
+            poi_rows.append({
+                "pid": poi_id(p),
+                "name": p["name"],
+                "type": p["type"],
+                "quality": f"{float(p.get('quality') or 0):.2f}",
+                "dist": f"{haversine_km(center_lat, center_lon, p['lat'], p['lon']):.1f}km",
+            })
+
+    memo = {
+        "bundle": bundle,
+        "days": days,
+        "styles": styles,
+        "dest_geo": dest_geo,
+        "dest_name": dest_name,
+        "stops": stops,
+        "day_times": meta.get("day_travel_times", {}) or {},
+        "day_entries": day_entries,
+        "poi_rows": poi_rows,
+        "alloc": allocate_budget(int(payload["budget"]), payload.get("travel_mode", "자유여행"), styles),
+        "checklist": build_checklist(payload["destination_scope"], payload["travel_month"], styles, payload["party_type"]),
+        "bundle_hash": bundle_hash(bundle),
+    }
+    sset("cache.page3_inputs", memo)
+    return memo
+
+
+@fragment
+def render_day_fragment(d: Any, block: Optional[Dict[str, Any]], info: Optional[Dict[str, Any]], editable: bool):
+    """Day 하나(편집칸 + 보기) — 편집하면 이 Day만 다시 그리고, 값이 바뀌었으면 내보내기까지 전체 rerun"""
+    if editable and isinstance(d, int):
+        with st.expander(f"Day {d} 편집하기", expanded=(d == 1)):
+            edits = sget("runtime.itinerary_edits", {})
+            ed = edits.get(d, {"am": "", "pm": "", "night": ""})
+            before = dict(ed)
+            ed["am"] = st.text_input(f"Day {d} - 오전", value=ed["am"], key=f"edit_am_{d}")
+            ed["pm"] = st.text_input(f"Day {d} - 오후", value=ed["pm"], key=f"edit_pm_{d}")
+            ed["night"] = st.text_input(f"Day {d} - 밤", value=ed["night"], key=f"edit_night_{d}")
+            edits[d] = ed
+            sset("runtime.itinerary_edits", edits)
+            if ed != before:
+                rerun_app()  # 내보내기 fragment가 편집 전 파일을 계속 내주지 않게
+        if block is not None:
+            block = dict(block, plan=[ed["am"], ed["pm"], ed["night"]])
+
+    if block is None:
+        return
+    day = block.get("day", "?")
+    title = block.get("title", f"Day {day}")
+    with st.expander(f"{title} (Day {day})", expanded=(str(day) == "1")):
+        if info:
+            st.write(f"**⏱️ 이동시간 추정:** {info.get('total_minutes',0)}분 · {info.get('total_km',0)}km · {info.get('mode','')}")
+            if info.get("overload"):
+                st.caption("⚠️ 8시간 안에 다 못 들어가는 날이에요(이동시간 탭 참고).")
+            st.caption(info.get("note", ""))
+        for it in block.get("plan", []):
+            st.write(f"- {it}")
+
+
+@fragment
+def render_poi_exclude_fragment(poi_rows: List[Dict[str, Any]]):
+    """POI 제외 표 — 체크박스를 눌러도 이 표만 다시 그림 (반영은 ‘재최적화’ 버튼으로)"""
+    cols = st.columns([3, 1, 1, 1, 1])
+    cols[0].markdown("**이름**")
+    cols[1].markdown("**타입**")
+    cols[2].markdown("**퀄리티**")
+    cols[3].markdown("**제외**")
+    cols[4].markdown("**대략거리(중심)**")
+
+    exclude_set = set(sget("runtime.poi_user_exclude_ids") or set())
+    for i, r in enumerate(poi_rows):
+        row = st.columns([3, 1, 1, 1, 1])
+        row[0].write(r["name"])
+        row[1].write(r["type"])
+        row[2].write(r["quality"])
+
+        checked = row[3].checkbox("", value=(r["pid"] in exclude_set), key=f"exclude_{r['pid']}_{i}")
+        if checked:
+            exclude_set.add(r["pid"])
+        else:
+            exclude_set.discard(r["pid"])
+
+        row[4].write(r["dist"])
+
+    sset("runtime.poi_user_exclude_ids", exclude_set)
+    st.caption("제외 변경 후 아래 ‘재최적화’ 버튼을 누르면 일정/이동시간이 새로 계산돼요.")
+
+
+@fragment
+def render_export_fragment(bundle: Dict[str, Any], bundle_sig: str):
+    """
+    내보내기 — 파일은 ‘만들기’를 누를 때만 생성 (렌더마다 JSON/ICS/PDF를 미리 만들지 않음)
+    - 같은 bundle·편집 상태로 이미 만든 파일은 export_service()에서 바로 꺼냄(다른 세션 포함)
+    """
+    edits = sget("runtime.itinerary_edits", {}) or {}
+    svc = export_service()
+    for fmt, label, ext, mime in EXPORT_FORMATS:
+        if not svc.has(svc.key(fmt, bundle_sig, edits)):
+            if not st.button(f"{label} 파일 만들기", key=f"export_make_{fmt}", use_container_width=True):
+                continue
+        with st.spinner(f"{ext.upper()} 만드는 중…"):
+            data = svc.get(fmt, bundle, edits, bundle_sig=bundle_sig)
+        if data is None:
+            st.info("PDF 내보내기는 `reportlab` 설치가 필요해요: `pip install reportlab`")
+            continue
+        st.download_button(
+            f"{label} 다운로드",
+            data=data,
+            file_name=f"travel-maker_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}",
+            mime=mime,
+            key=f"export_dl_{fmt}",
+            use_container_width=True,
+        )
+
+
+COMPARE_UI_SLOTS = 3
+
+
+@fragment
+def render_compare_fragment():
+    """
+    비교 모드 — 일정/스타일만 바꾼 변형을 한 번에 생성해서 나란히 (장소·날씨·숙소 후보 조회는 한 번만)
+    - 결과는 cache.compare에 입력 서명과 함께 보관(기준 입력이 바뀌면 숨김)
+    """
+    payload = build_payload()
+    config = plan_config_from_state(_app_state())
+    cur_duration = payload["duration"]
+    cur_styles = [s_ for s_ in payload.get("travel_style", []) if s_ in STYLE_OPTIONS]
+
+    st.caption("같은 여행지로 ‘3일 vs 5일’, ‘힐링 vs 식도락’처럼 일정·스타일만 바꿔서 비교해요. 첫 번째 칸이 기준이에요.")
+    cols = st.columns(COMPARE_UI_SLOTS)
+    variants = []
+    for i, col in enumerate(cols):
+        with col:
+            on = st.checkbox(f"변형 {i + 1}", value=(i < 2), key=f"cmp_on_{i}", disabled=(i == 0))
+            default_duration = cur_duration if i != 1 else DURATION_OPTIONS[(DURATION_OPTIONS.index(cur_duration) + 1) % len(DURATION_OPTIONS)]
+            duration = st.selectbox("일정", DURATION_OPTIONS, index=DURATION_OPTIONS.index(default_duration), key=f"cmp_dur_{i}")
+            styles = st.multiselect("스타일", STYLE_OPTIONS, default=cur_styles, key=f"cmp_style_{i}")
+            if on or i == 0:
+                label = f"{duration} · {', '.join(styles) if styles else '스타일 없음'}"
+                variants.append({"label": label, "duration": duration, "travel_style": styles})
+
+    key = plan_signature(payload, config) + "|" + json.dumps(variants, ensure_ascii=False, sort_keys=True)
+    saved = sget("cache.compare")
+    if st.button("비교 플랜 만들기 🆚", use_container_width=True, disabled=len(variants) < 2):
+        with st.spinner(f"변형 {len(variants)}개 생성 중… (공유 조회 1번 + 변형별 동선/이동시간)"):
+            rows = compare_summary(compare_plans(payload, config, variants))
+        saved = {"key": key, "rows": rows}
+        sset("cache.compare", saved)
+    if not saved or saved["key"] != key:
+        return
+
+    rows = saved["rows"]
+    out_cols = st.columns(len(rows))
+    for i, (col, r) in enumerate(zip(out_cols, rows)):
+        d = r["delta"] if i else None
+        with col:
+            st.markdown(f"**{r['label']}**" + (" (기준)" if i == 0 else ""))
+            st.caption(r["headline"])
+            st.metric("총 이동시간", format_minutes(r["travel_total_min"]), delta=f"{d['travel_total_min']:+}분" if d else None, delta_color="inverse")
+            st.metric("하루 평균 이동", f"{r['travel_avg_min']}분", delta=f"{d['travel_avg_min']:+}분" if d else None, delta_color="inverse")
+            st.metric("하루 예산", f"{r['budget_per_day']:,}원", delta=f"{d['budget_per_day']:+,}원" if d else None)
+            st.write(f"- 방문 POI: {r['pois']}곳" + (f" ({d['pois']:+})" if d else ""))
+            if r["overload_days"]:
+                st.write(f"- ⚠️ 빡빡한 날: {r['overload_days']}일")
+            if r["hotel"]:
+                st.write(f"- 🏨 {r['hotel']}")
+            st.write("- 예산 분배:")
+            for k, v in r["alloc"].items():
+                delta = d["alloc"].get(k, 0) if d else 0
+                st.write(f"  - {k}: {v:,}원" + (f" ({delta:+,})" if delta else ""))
+            if r["error"]:
+                st.caption(f"자동 플랜으로 생성: {r['error']}")
 
 
 def page3():
@@ -2150,7 +5920,8 @@ def page3():
     plan = bundle["plan"]
     pois = bundle["pois"]
     poi_daymap = bundle["poi_daymap"]
-    day_times = meta.get("day_travel_times", {}) or {}
+    view = page3_inputs(bundle)
+    day_times = view["day_times"]
 
     if err:
         msg = str(err).lower()
@@ -2161,13 +5932,23 @@ def page3():
         else:
             st.warning(f"🤖 AI 응답이 불안정해서 자동 플랜으로 전환했어요.\n\n사유: {err}")
 
+    if meta.get("country_level_hint"):
+        st.info(
+            "입력한 값이 ‘국가 단위’로 인식됐을 가능성이 있어요. "
+            "도시로 입력하면 POI·동선·이동시간 정확도가 훨씬 좋아져요! "
+            "예: 밴쿠버 / 토론토 / 도쿄"
+        )
+
     if meta.get("overpass_error"):
         st.info(f"POI 수집이 불안정했을 수 있어요(Overpass). 필요하면 반경/개수를 줄이거나 다시 시도해줘.\n\n사유: {meta['overpass_error']}")
 
-    dest_geo = meta.get("dest_geo")
-    dest_name = dest_geo["display_name"] if dest_geo else (payload.get("destination_text") or "미입력(이러면 추천이 ‘감’이 됨)")
-    styles = payload.get("travel_style", [])
-    days = duration_to_days(payload["duration"])
+    dest_geo = view["dest_geo"]
+    dest_name = view["dest_name"]
+    stops = view["stops"]
+    if meta.get("stops_not_found"):
+        st.info(f"못 찾은 경유지는 빼고 계획했어요: {', '.join(meta['stops_not_found'])}")
+    styles = view["styles"]
+    days = view["days"]
 
     st.markdown(
         f"""
@@ -2197,14 +5978,17 @@ def page3():
     st.write(f"- 안내: {meta.get('weather_note','')}")
     if snapshot:
         st.write(f"- 최근 7일 스냅샷: 평균 {snapshot['avg_min']}~{snapshot['avg_max']}°C, 누적 강수 {snapshot['total_prcp']}mm")
+    climate = meta.get("climate_normals")
+    if climate:
+        st.write(f"- {format_climate(climate)} (최근 {climate['years']}년 자료)")
     if forecast and forecast.get("daily"):
         st.write("- 예보(최대 16일 범위):")
         for d in forecast["daily"][: min(len(forecast["daily"]), days)]:
             st.write(f"  - {d['date']}: {d['tmin']}~{d['tmax']}°C, 강수 {d['prcp']}mm")
     st.markdown("</div>", unsafe_allow_html=True)
 
-    tab_plan, tab_move, tab_poi, tab_hotel, tab_budget, tab_check, tab_export = st.tabs(
-        ["🧾 플랜", "⏱️ 이동시간", "🗺️ 지도+POI", "🏨 숙소", "💸 예산", "✅ 체크리스트", "📤 내보내기"]
+    tab_plan, tab_move, tab_poi, tab_hotel, tab_budget, tab_compare, tab_check, tab_export = st.tabs(
+        ["🧾 플랜", "⏱️ 이동시간", "🗺️ 지도+POI", "🏨 숙소", "💸 예산", "🆚 비교", "✅ 체크리스트", "📤 내보내기"]
     )
 
     with tab_plan:
@@ -2221,39 +6005,15 @@ def page3():
 
         ensure_itinerary_edits(days, plan)
 
-        if sget("ui.enable_edit", True):
+        editable = bool(sget("ui.enable_edit", True))
+        if editable:
             st.caption("편집 모드 ON ✅ (오전/오후/밤을 바꿔서 ‘내 플랜’로 커스터마이징)")
-            for d in range(1, days + 1):
-                with st.expander(f"Day {d} 편집하기", expanded=(d == 1)):
-                    edits = sget("runtime.itinerary_edits", {})
-                    ed = edits.get(d, {"am": "", "pm": "", "night": ""})
-                    ed["am"] = st.text_input(f"Day {d} - 오전", value=ed["am"], key=f"edit_am_{d}")
-                    ed["pm"] = st.text_input(f"Day {d} - 오후", value=ed["pm"], key=f"edit_pm_{d}")
-                    ed["night"] = st.text_input(f"Day {d} - 밤", value=ed["night"], key=f"edit_night_{d}")
-                    edits[d] = ed
-                    sset("runtime.itinerary_edits", edits)
-            final_plan = apply_itinerary_edits(plan)
-        else:
-            final_plan = plan
 
         st.markdown('<div class="tm-section-title">📆 Day-by-Day</div>', unsafe_allow_html=True)
-        for b in final_plan.get("day_blocks", []):
-            day = b.get("day", "?")
-            title = b.get("title", f"Day {day}")
-            items = b.get("plan", [])
-            with st.expander(f"{title} (Day {day})", expanded=(str(day) == "1")):
-                try:
-                    dnum = int(day)
-                except Exception:
-                    dnum = None
-                if dnum and dnum in day_times:
-                    info = day_times[dnum]
-                    st.write(f"**⏱️ 이동시간 추정:** {info.get('total_minutes',0)}분 · {info.get('total_km',0)}km · {info.get('mode','')}")
-                    st.caption(info.get("note", ""))
-                for it in items:
-                    st.write(f"- {it}")
+        for d, block in view["day_entries"]:
+            render_day_fragment(d, block, day_times.get(d), editable)
 
-        tips = final_plan.get("tips", []) or []
+        tips = plan.get("tips", []) or []
         if tips:
             st.markdown('<div class="tm-section-title">🧠 꿀팁</div>', unsafe_allow_html=True)
             st.markdown('<div class="tm-card">', unsafe_allow_html=True)
@@ -2263,7 +6023,7 @@ def page3():
 
         st.markdown('<div class="tm-section-title">🔎 Sources (AI가 참고한 곳)</div>', unsafe_allow_html=True)
         st.markdown('<div class="tm-card">', unsafe_allow_html=True)
-        sources = final_plan.get("sources", []) or []
+        sources = plan.get("sources", []) or []
         if sources:
             for s in sources:
                 if isinstance(s, dict):
@@ -2277,8 +6037,6 @@ def page3():
             st.write("- (OpenAI 키 없이 생성했거나, 모델이 출처를 못 가져온 경우 비어있을 수 있어요.)")
         st.markdown("</div>", unsafe_allow_html=True)
 
-        bundle["plan"] = final_plan
-
     with tab_move:
         st.markdown(
             """
@@ -2300,6 +6058,19 @@ def page3():
                     expanded=(d == 1),
                 ):
                     st.caption(info.get("note", ""))
+                    for t in info.get("transfers") or []:
+                        st.write(f"- 🚄 도시 간 이동: {t['from']} → {t['to']} · {t['km']}km / {format_minutes(t['minutes'])} ({t['mode']})")
+                    sc = info.get("schedule")
+                    if sc and sc.get("slots"):
+                        st.write(f"- 타임라인(이동+체류 {format_minutes(sc['day_total_minutes'])}):")
+                        for s_ in sc["slots"]:
+                            wait = f", 대기 {s_['wait']}분" if s_["wait"] else ""
+                            st.write(f"  - {s_['start']}~{s_['end']} {s_['name']}({s_['type']}) · 이동 {s_['travel']}분{wait}")
+                    if sc and sc.get("unfit"):
+                        st.warning(
+                            "⚠️ 8시간/영업시간 안에 못 넣은 곳: "
+                            + ", ".join(f"{u['name']}({u['reason']})" for u in sc["unfit"])
+                        )
                     legs = info.get("legs", [])
                     if not legs:
                         st.write("- (이동 구간 없음)")
@@ -2329,7 +6100,7 @@ def page3():
         if sget("ui.show_map", True):
             st.markdown('<div class="tm-section-title">🗺️ 지도</div>', unsafe_allow_html=True)
             st.markdown('<div class="tm-card">', unsafe_allow_html=True)
-            render_map(dest_geo, pois)
+            render_map(dest_geo, pois, stops=stops)
             st.markdown("</div>", unsafe_allow_html=True)
 
         st.markdown('<div class="tm-section-title">🧹 POI 정리(원치 않는 곳 제외)</div>', unsafe_allow_html=True)
@@ -2338,37 +6109,7 @@ def page3():
         if not pois:
             st.info("POI를 못 가져왔어… (목적지 좌표/Overpass 상태 확인). 그래도 플랜은 계속 가능!")
         else:
-            cols = st.columns([3, 1, 1, 1, 1])
-            cols[0].markdown("**이름**")
-            cols[1].markdown("**타입**")
-            cols[2].markdown("**퀄리티**")
-            cols[3].markdown("**제외**")
-            cols[4].markdown("**대략거리(중심)**")
-
-            exclude_set = set(sget("runtime.poi_user_exclude_ids") or set())
-            center_lat = dest_geo["lat"] if dest_geo else pois[0]["lat"]
-            center_lon = dest_geo["lon"] if dest_geo else pois[0]["lon"]
-
-            display_n = min(len(pois), 60)
-            for i in range(display_n):
-                p = pois[i]
-                pid = int(p["osm_id"])
-                row = st.columns([3, 1, 1, 1, 1])
-                row[0].write(p["name"])
-                row[1].write(p["type"])
-                row[2].write(f"{float(p.get('quality') or 0):.2f}")
-
-                checked = row[3].checkbox("", value=(pid in exclude_set), key=f"exclude_{pid}_{i}")
-                if checked:
-                    exclude_set.add(pid)
-                else:
-                    exclude_set.discard(pid)
-
-                dist = haversine_km(center_lat, center_lon, p["lat"], p["lon"])
-                row[4].write(f"{dist:.1f}km")
-
-            sset("runtime.poi_user_exclude_ids", exclude_set)
-            st.caption("제외 변경 후 아래 ‘재최적화’ 버튼을 누르면 일정/이동시간이 새로 계산돼요.")
+            render_poi_exclude_fragment(view["poi_rows"])
         st.markdown("</div>", unsafe_allow_html=True)
 
         st.markdown('<div class="tm-section-title">🧠 일자별 POI(자동 묶기)</div>', unsafe_allow_html=True)
@@ -2403,7 +6144,7 @@ def page3():
                 
     with tab_budget:
         if sget("ui.show_budget", True):
-            alloc = allocate_budget(int(payload["budget"]), payload.get("travel_mode", "자유여행"), styles)
+            alloc = view["alloc"]
             st.markdown('<div class="tm-card">', unsafe_allow_html=True)
             st.markdown('<div class="tm-section-title">💸 예산 분배(추천)</div>', unsafe_allow_html=True)
             st.write(f"- 예산 무드: **{budget_tier(int(payload['budget']))}**")
@@ -2414,9 +6155,12 @@ def page3():
         else:
             st.info("사이드바에서 ‘예산 분배 표시’를 켜면 나와요.")
 
+    with tab_compare:
+        render_compare_fragment()
+
     with tab_check:
         if sget("ui.show_checklist", True):
-            checklist = build_checklist(payload["destination_scope"], payload["travel_month"], styles, payload["party_type"])
+            checklist = view["checklist"]
             st.markdown('<div class="tm-card">', unsafe_allow_html=True)
             st.markdown('<div class="tm-section-title">✅ 체크리스트(준비물)</div>', unsafe_allow_html=True)
             cols = st.columns(3)
@@ -2435,54 +6179,26 @@ def page3():
             """
             <div class="tm-card">
               <div class="tm-section-title">📤 내보내기 (JSON / ICS / PDF)</div>
-              <div class="tm-tip">JSON/캘린더/리포트로 저장 가능.</div>
+              <div class="tm-tip">JSON/캘린더/리포트로 저장 가능. (편집 내용 반영, 누를 때 파일 생성)</div>
             </div>
             """,
             unsafe_allow_html=True,
         )
-
-        export_bundle = {
-            "app": APP_NAME,
-            "payload": {k: v for k, v in payload.items() if k != "start_date_obj"},
-            "meta": meta,
-            "plan": bundle["plan"],
-            "pois": pois[:100],
-            "exported_at": datetime.now().isoformat(timespec="seconds"),
-        }
-        json_bytes = json.dumps(export_bundle, ensure_ascii=False, indent=2).encode("utf-8")
-
-        st.download_button(
-            "📥 JSON 다운로드",
-            data=json_bytes,
-            file_name=f"travel-maker_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-            mime="application/json",
-            use_container_width=True,
-        )
-
-        ics_text = make_ics({"payload": payload, "plan": bundle["plan"], "meta": meta, "exported_at": export_bundle["exported_at"]})
-        st.download_button(
-            "🗓️ ICS(캘린더) 다운로드",
-            data=ics_text.encode("utf-8"),
-            file_name=f"travel-maker_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ics",
-            mime="text/calendar",
-            use_container_width=True,
-        )
-
-        pdf_bytes = make_pdf_bytes({"payload": payload, "plan": bundle["plan"], "meta": meta, "exported_at": export_bundle["exported_at"]})
-        if pdf_bytes is None:
-            st.info("PDF 내보내기는 `reportlab` 설치가 필요해요: `pip install reportlab`")
-        else:
-            st.download_button(
-                "🧾 PDF 다운로드",
-                data=pdf_bytes,
-                file_name=f"travel-maker_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                mime="application/pdf",
-                use_container_width=True,
-            )
+        render_export_fragment(bundle, view["bundle_hash"])
 
     # Debug Panel
     if sget("ui.debug_panel", False):
         with st.expander("🧪 디버그 패널", expanded=False):
+            st.write("생성 단계(trace):")
+            render_trace_waterfall(meta.get("trace"), sget("runtime.last_render_ms"))
+            warm = start_cache_warmup()
+            st.caption(f"캐시 warm-up: {warm['state']} {warm['done']}/{warm['total']} (실패 {warm['failed']})")
+            imp = import_report()
+            st.caption(
+                f"스크립트: cold {imp['cold_module_ms']}ms · 직전 rerun module {imp['last_module_ms']}ms"
+                f" / main {imp['last_main_ms']}ms · runs {imp['runs']}"
+            )
+            st.caption("지연 import: " + (", ".join(f"{k} {v}ms" for k, v in imp["imports"].items()) or "없음"))
             st.write("meta:")
             st.json(meta)
             st.write("payload:")
@@ -2506,7 +6222,19 @@ def page3():
 # App
 # =========================
 def main():
+    record_script_run("module", _SCRIPT_T0)
+    started = time.perf_counter()
+    try:
+        _main()
+    finally:
+        # st.rerun()(예외)으로 빠져나가도 기록
+        record_script_run("main", started)
+
+
+def _main():
     st.set_page_config(page_title=APP_NAME, page_icon="🧳", layout="wide")
+    start_metrics_exporters()
+    start_cache_warmup()
     init_state()
     render_header()
     render_sidebar()
@@ -2516,7 +6244,10 @@ def main():
     elif st.session_state.step == 2:
         page2()
     else:
-        page3()
+        # page3 렌더 전체 시간(생성 포함) → 다음 렌더의 디버그 패널에 표시
+        with profiled("page3", lambda: sget("cache.last_payload_sig") or ""), trace("render") as r:
+            page3()
+        sset("runtime.last_render_ms", round(r.ms, 1))
 
 
 if __name__ == "__main__":
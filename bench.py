@@ -0,0 +1,436 @@
+"""
+Travel-Maker 벤치마크 (Streamlit 없이 실행)
+
+    # 일정 엔진: 합성 POI 배치 × 크기 × 일수 격자
+    python bench.py engine
+    python bench.py engine --quick                       # 작은 격자만
+    python bench.py engine --save-baseline bench_baseline.json
+    python bench.py engine --baseline bench_baseline.json  # 기준 대비 느려지면 exit 1
+
+    # 전체 파이프라인(generate_bundle): 실제 응답을 한 번 녹화 → 지연/오류 주입해서 재생 부하 테스트
+    python bench.py pipeline --record
+    python bench.py pipeline --sessions 200 --concurrency 16 --latency-ms 120 --jitter-ms 60 --error-rate 0.02
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import app
+
+
+# =========================
+# Synthetic POI generators
+# =========================
+CENTER = (37.5665, 126.9780)
+TYPE_WEIGHTS = [("관광", 0.28), ("문화", 0.14), ("자연", 0.12), ("맛집", 0.24), ("카페", 0.14), ("유흥", 0.05), ("편의", 0.03)]
+OPENING_HOURS = ["Mo-Su 09:00-18:00", "Tu-Su 10:00-18:00; Mo off", "Mo-Fr 11:00-22:00; Sa,Su 10:00-23:00", "24/7"]
+
+
+def _offset(lat: float, lon: float, dx_km: float, dy_km: float) -> Tuple[float, float]:
+    return lat + dy_km / 110.574, lon + dx_km / (111.320 * math.cos(math.radians(lat)))
+
+
+def _poi(rng: random.Random, i: int, lat: float, lon: float) -> Dict[str, Any]:
+    types, weights = zip(*TYPE_WEIGHTS)
+    tags = {"opening_hours": rng.choice(OPENING_HOURS)} if rng.random() < 0.35 else {}
+    return {
+        "name": f"POI {i}",
+        "lat": lat,
+        "lon": lon,
+        "type": rng.choices(types, weights)[0],
+        "tags": tags,
+        "osm_id": i + 1,
+        "osm_type": "node",
+        "quality": round(rng.random(), 3),
+        "rank": round(rng.random(), 4),
+    }
+
+
+def gen_uniform(n: int, seed: int, radius_km: float = 8.0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        r = radius_km * math.sqrt(rng.random())
+        a = rng.random() * 2 * math.pi
+        out.append(_poi(rng, i, *_offset(*CENTER, r * math.cos(a), r * math.sin(a))))
+    return out
+
+
+def gen_downtown(n: int, seed: int, radius_km: float = 8.0) -> List[Dict[str, Any]]:
+    # 70%는 반경 1km 안 도심, 나머지는 외곽에 드문드문
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        sigma = 0.6 if rng.random() < 0.7 else radius_km / 2
+        out.append(_poi(rng, i, *_offset(*CENTER, rng.gauss(0, sigma), rng.gauss(0, sigma))))
+    return out
+
+
+def gen_coastal(n: int, seed: int, radius_km: float = 8.0) -> List[Dict[str, Any]]:
+    # 해안선 따라 길쭉한 띠(길이 3×반경, 폭 ~0.8km)
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        t = rng.uniform(-1.5, 1.5) * radius_km
+        out.append(_poi(rng, i, *_offset(*CENTER, t, 0.4 * math.sin(t / 3) + rng.gauss(0, 0.4))))
+    return out
+
+
+def gen_clusters(n: int, seed: int, radius_km: float = 8.0, k: int = 6) -> List[Dict[str, Any]]:
+    # 떨어진 동네 k개(각각 σ≈0.5km)
+    rng = random.Random(seed)
+    centers = [(rng.uniform(-radius_km, radius_km), rng.uniform(-radius_km, radius_km)) for _ in range(k)]
+    out = []
+    for i in range(n):
+        cx, cy = rng.choice(centers)
+        out.append(_poi(rng, i, *_offset(*CENTER, cx + rng.gauss(0, 0.5), cy + rng.gauss(0, 0.5))))
+    return out
+
+
+GENERATORS: Dict[str, Callable[..., List[Dict[str, Any]]]] = {
+    "uniform": gen_uniform,
+    "downtown": gen_downtown,
+    "coastal": gen_coastal,
+    "clusters": gen_clusters,
+}
+
+
+# =========================
+# Engine benchmark
+# =========================
+def _timed(fn: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    # 반복 중 최솟값(ms) — 잡음(GC/스케줄링)에 가장 덜 흔들림
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000.0, out
+
+
+def _traced(fn: Callable[[], Any]) -> Dict[str, float]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        snap = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    stats = snap.statistics("filename")
+    return {"peak_kib": round(peak / 1024, 1), "live_blocks": sum(s.count for s in stats)}
+
+
+def run_engine_case(layout: str, n: int, days: int, seed: int, radius_km: float, repeat: int, mode: str) -> Dict[str, Any]:
+    pois = GENERATORS[layout](n, seed, radius_km)
+    styles: List[str] = []
+    matrix = app.TravelTimeMatrix(pois)
+
+    def itinerary():
+        return app.build_itinerary_from_pois(pois, styles, days=days, radius_km=radius_km, matrix=matrix)
+
+    t_itin, day_map = _timed(itinerary, repeat)
+    picked = [p for ps in day_map.values() for p in ps]
+    points = [(p["lat"], p["lon"]) for p in pois]
+
+    t_kmeans, _ = _timed(lambda: app._kmeans_like(points, k=min(days, n), iters=12), repeat)
+    t_nn, _ = _timed(lambda: [app._nearest_neighbor_order(ps) for ps in day_map.values()], repeat)
+    t_travel, travel = _timed(
+        lambda: app.build_day_travel_times(day_map, styles, radius_km, mode, return_to_center=True, matrix=matrix),
+        repeat,
+    )
+    t_sched, (_, sched) = _timed(
+        lambda: app.schedule_days(day_map, app.date(2026, 5, 4), mode, radius_km, matrix=matrix), repeat
+    )
+    mem = _traced(itinerary)
+
+    return {
+        "case": f"{layout}/n={n}/days={days}",
+        "ms": {
+            "itinerary": round(t_itin, 2),
+            "kmeans_all": round(t_kmeans, 2),
+            "nn_order": round(t_nn, 2),
+            "travel_times": round(t_travel, 2),
+            "schedule": round(t_sched, 2),
+        },
+        "alloc": mem,
+        "quality": {
+            "picked": len(picked),
+            "total_km": round(sum(v.get("total_km", 0.0) for v in travel.values()), 2),
+            "travel_min": sum(v.get("total_minutes", 0) for v in travel.values()),
+            "overload_days": sum(1 for v in sched.values() if v["overload"]),
+            "empty_days": sum(1 for ps in day_map.values() if not ps),
+        },
+    }
+
+
+def _print_table(rows: List[Dict[str, Any]], base: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'case':<28} {'itin ms':>9} {'kmeans':>9} {'nn':>8} {'travel':>8} {'sched':>8} {'peak KiB':>9} {'km':>8} {'over':>5}  vs base")
+    for r in rows:
+        ms, q = r["ms"], r["quality"]
+        b = base.get(r["case"])
+        ratio = f"{ms['itinerary'] / max(0.01, b['ms']['itinerary']):.2f}x" if b else ""
+        print(
+            f"{r['case']:<28} {ms['itinerary']:>9.2f} {ms['kmeans_all']:>9.2f} {ms['nn_order']:>8.2f} "
+            f"{ms['travel_times']:>8.2f} {ms['schedule']:>8.2f} {r['alloc']['peak_kib']:>9.1f} "
+            f"{q['total_km']:>8.1f} {q['overload_days']:>5}  {ratio}"
+        )
+
+
+def compare(rows: List[Dict[str, Any]], base: Dict[str, Dict[str, Any]], tolerance: float, floor_ms: float) -> List[str]:
+    """
+    기준 대비 회귀 목록.
+    - 시간: 단계별로 tolerance배 초과 + floor_ms 이상 차이(아주 짧은 단계의 잡음 무시)
+    - 품질: 총 km 5% 이상 증가, overload 날 증가
+    """
+    problems = []
+    for r in rows:
+        b = base.get(r["case"])
+        if not b:
+            continue
+        for stage, ms in r["ms"].items():
+            old = b["ms"].get(stage)
+            if old is not None and ms > old * tolerance and ms - old > floor_ms:
+                problems.append(f"{r['case']} {stage}: {old:.2f} → {ms:.2f} ms")
+        q, bq = r["quality"], b["quality"]
+        if q["total_km"] > bq["total_km"] * 1.05 + 0.01:
+            problems.append(f"{r['case']} total_km: {bq['total_km']} → {q['total_km']}")
+        if q["overload_days"] > bq["overload_days"]:
+            problems.append(f"{r['case']} overload_days: {bq['overload_days']} → {q['overload_days']}")
+    return problems
+
+
+def cmd_engine(args) -> int:
+    sizes = [50, 200] if args.quick else args.sizes
+    day_counts = [1, 3] if args.quick else args.days
+    rows = []
+    for layout in args.layouts:
+        for n in sizes:
+            for days in day_counts:
+                rows.append(run_engine_case(layout, n, days, args.seed, args.radius_km, args.repeat, args.mode))
+                print(f"  {rows[-1]['case']} done", file=sys.stderr)
+
+    base: Dict[str, Dict[str, Any]] = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = {r["case"]: r for r in json.load(f)["results"]}
+
+    _print_table(rows, base)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": rows}, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "python": sys.version.split()[0], "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"baseline saved: {args.save_baseline}", file=sys.stderr)
+
+    if base:
+        problems = compare(rows, base, args.tolerance, args.floor_ms)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            return 1
+        print(f"OK: {len(rows)} cases within {args.tolerance:.2f}x of baseline")
+    return 0
+
+
+# =========================
+# Pipeline (record / replay load)
+# =========================
+SCENARIOS: List[Dict[str, Any]] = [
+    {"destination_text": "서울", "duration": "3일", "travel_style": ["힐링"]},
+    {"destination_text": "부산", "duration": "5일", "travel_style": ["식도락", "자연"]},
+    {"destination_text": "서울→경주→부산", "duration": "5일", "travel_style": ["문화/예술"]},
+    {"destination_text": "제주", "duration": "3일", "travel_style": ["자연", "로드트립"]},
+    {"destination_scope": "해외", "destination_text": "도쿄", "duration": "5일", "travel_style": ["쇼핑", "식도락"]},
+]
+
+# stage 이름 → 감쌀 app 함수들 (바깥 호출만 집계: 같은 stage 안의 중첩 호출은 무시)
+STAGES: Dict[str, List[str]] = {
+    "geocode": ["geocode_many"],
+    "weather": ["fetch_open_meteo_daily"],
+    "pois": ["fetch_pois_overpass"],
+    "itinerary": ["build_itinerary_from_pois", "build_multi_city_itinerary", "rerank_days_by_weather"],
+    "hotels": ["recommend_hotels"],
+    "schedule": ["schedule_days", "build_day_travel_times"],
+    "llm": ["call_openai_plan"],
+    "plan": ["build_rule_based_plan"],
+}
+
+_active = threading.local()
+
+
+def _instrument() -> None:
+    # 세션별 집계는 detached_session 상태(워커 스레드까지 전달됨)에 담음
+    def wrap(stage: str, fn: Callable) -> Callable:
+        def timed(*a, **kw):
+            running = getattr(_active, "stages", None)
+            if running is None:
+                running = _active.stages = set()
+            state = app._app_state()
+            if stage in running or "bench" not in state:
+                return fn(*a, **kw)
+            running.add(stage)
+            t = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                running.discard(stage)
+                ms = (time.perf_counter() - t) * 1000.0
+                with state["bench"]["lock"]:
+                    state["bench"]["ms"][stage] = state["bench"]["ms"].get(stage, 0.0) + ms
+
+        timed.__wrapped__ = fn
+        return timed
+
+    for stage, names in STAGES.items():
+        for name in names:
+            fn = getattr(app, name)
+            if not hasattr(fn, "__wrapped__"):
+                setattr(app, name, wrap(stage, fn))
+
+
+def run_session(scenario: Dict[str, Any], start_date: date, openai_key: str) -> Dict[str, Any]:
+    state = app.default_app_state()
+    state["input"].update(scenario)
+    state["input"]["start_date"] = start_date
+    state["ui"]["openai_api_key"] = openai_key
+    state["bench"] = {"lock": threading.Lock(), "ms": {}}
+    t = time.perf_counter()
+    error = None
+    with app.detached_session(state):
+        try:
+            _, error = app.generate_bundle()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    ms = dict(state["bench"]["ms"])
+    ms["total"] = (time.perf_counter() - t) * 1000.0
+    return {"scenario": scenario["destination_text"], "ms": ms, "error": error}
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = (len(xs) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def cmd_pipeline(args) -> int:
+    import streamlit as st
+
+    manifest_path = os.path.join(args.fixtures, "manifest.json")
+    openai_key = os.getenv("OPENAI_API_KEY", "") if args.with_llm else ""
+    _instrument()
+
+    if args.record:
+        # 실제 업스트림 호출(순차) → fixture 저장. 시작일도 같이 저장해서 재생 때 같은 요청이 나오게
+        fx = app.HttpFixtures(args.fixtures, "record")
+        app.set_http_fixtures(fx)
+        start_date = date.today()
+        for scn in SCENARIOS:
+            r = run_session(scn, start_date, openai_key)
+            print(f"recorded {r['scenario']}: {r['ms']['total']:.0f} ms" + (f" ({r['error']})" if r["error"] else ""))
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"start_date": start_date.isoformat(), "scenarios": SCENARIOS, "llm": bool(openai_key)}, f, ensure_ascii=False, indent=2)
+        print(json.dumps({**fx.stats, "fixtures": args.fixtures}, ensure_ascii=False))
+        return 0
+
+    if not os.path.exists(manifest_path):
+        raise SystemExit(f"fixture가 없어요: 먼저 `python bench.py pipeline --record --fixtures {args.fixtures}`")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    start_date = date.fromisoformat(manifest["start_date"])
+    scenarios = manifest["scenarios"]
+    if manifest.get("llm"):
+        openai_key = openai_key or "replay"
+
+    fx = app.HttpFixtures(
+        args.fixtures, "replay", latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed
+    )
+    app.set_http_fixtures(fx)
+
+    # 동시 세션 웨이브 단위 실행(--cold면 웨이브마다 Streamlit 캐시 비움 = 콜드 스타트 부하)
+    results: List[Dict[str, Any]] = []
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        for wave in range(0, args.sessions, args.concurrency):
+            if args.cold:
+                st.cache_data.clear()
+            n = min(args.concurrency, args.sessions - wave)
+            batch = [scenarios[(wave + i) % len(scenarios)] for i in range(n)]
+            results += list(ex.map(lambda s: run_session(s, start_date, openai_key), batch))
+    wall = time.perf_counter() - t0
+
+    stages = ["total"] + [s for s in STAGES if any(s in r["ms"] for r in results)]
+    print(f"{'stage':<10} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    summary = {}
+    for stage in stages:
+        xs = [r["ms"][stage] for r in results if stage in r["ms"]]
+        summary[stage] = {"n": len(xs), "p50": _pct(xs, 0.5), "p95": _pct(xs, 0.95), "p99": _pct(xs, 0.99), "max": max(xs)}
+        row = summary[stage]
+        print(f"{stage:<10} {row['n']:>5} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f} {row['max']:>9.1f}")
+    errors = [r for r in results if r["error"]]
+    print(
+        f"sessions={len(results)} concurrency={args.concurrency} wall={wall:.2f}s "
+        f"throughput={len(results) / max(wall, 1e-9):.1f}/s errors={len(errors)} fixtures={fx.stats}"
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "sessions": results, "fixtures": fx.stats}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="bench.py", description="Travel-Maker benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("engine", help="일정 엔진(클러스터링/동선/이동시간/타임라인) 스케일링")
+    p.add_argument("--layouts", nargs="+", default=list(GENERATORS), choices=list(GENERATORS))
+    p.add_argument("--sizes", nargs="+", type=int, default=[50, 500, 2000, 10000])
+    p.add_argument("--days", nargs="+", type=int, default=[1, 3, 10, 30])
+    p.add_argument("--quick", action="store_true", help="n=50,200 × days=1,3만")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--radius-km", type=float, default=8.0)
+    p.add_argument("--mode", default="대중교통", choices=["도보", "대중교통", "차량"])
+    p.add_argument("--repeat", type=int, default=3, help="단계별 반복 횟수(최솟값 사용)")
+    p.add_argument("--json", help="결과 JSON 저장 경로")
+    p.add_argument("--save-baseline", help="이번 결과를 기준으로 저장")
+    p.add_argument("--baseline", help="비교할 기준 JSON (회귀 시 exit 1)")
+    p.add_argument("--tolerance", type=float, default=1.25, help="허용 배수 (기본: %(default)s)")
+    p.add_argument("--floor-ms", type=float, default=1.0, help="이보다 작은 차이는 무시 (기본: %(default)s)")
+    p.set_defaults(func=cmd_engine)
+
+    p = sub.add_parser("pipeline", help="generate_bundle 전체를 녹화된 업스트림 응답으로 부하 테스트")
+    p.add_argument("--fixtures", default=app.HTTP_FIXTURES_DIR, help="fixture 디렉터리 (기본: %(default)s)")
+    p.add_argument("--record", action="store_true", help="실제 API를 호출해서 fixture 녹화")
+    p.add_argument("--with-llm", action="store_true", help="OPENAI_API_KEY로 OpenAI 단계까지 녹화/재생")
+    p.add_argument("--sessions", type=int, default=50)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--latency-ms", type=float, default=0.0, help="재생 응답마다 주입할 지연")
+    p.add_argument("--jitter-ms", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="재생 응답을 timeout으로 바꿀 확률")
+    p.add_argument("--cold", action="store_true", help="웨이브마다 st.cache_data 비우기")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--json", help="세션별 결과 JSON 저장 경로")
+    p.set_defaults(func=cmd_pipeline)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,689 @@
+"""
+Travel-Maker 오프라인 도구 (Streamlit 없이 실행)
+
+    # OSM 추출본(.osm.pbf, pyosmium 필요) → POI 인덱스
+    python cli.py build-poi-index south-korea.osm.pbf
+
+    # 저장해둔 Overpass 응답(JSON) → POI 인덱스 (커버 영역은 --bbox로 명시 권장)
+    python cli.py build-poi-index seoul.json busan.json --bbox 37.40,126.76,37.72,127.20 --bbox 35.03,128.90,35.30,129.25
+
+    # data/gazetteer_places.tsv 수정 후 조회용 gazetteer 재생성
+    python cli.py build-gazetteer
+
+    # 과거 일별 기상 덤프(Open-Meteo archive JSON 또는 CSV) → 월 평년값 파일
+    python cli.py build-climatology archive_seoul.json archive_busan.json daily_obs.csv
+
+    # Streamlit 없이 일정 생성 (입력 키는 앱의 input.*, 설정 키는 GET /config)
+    python cli.py plan trip.json --set poi_limit=30 --set move_mode=도보 --out bundle.json
+    python cli.py serve --port 8765   # curl -d '{"input": {"destination_text": "부산"}}' localhost:8765/plan
+    # 비교: POST /compare {"input": {...}, "variants": [{"label": "3일"}, {"label": "5일", "duration": "5일"}]}
+
+    # 인기 조합 미리 계산 → data/bundles (중단 후 같은 명령으로 재개)
+    python cli.py batch popular.jsonl --workers 4
+
+    # PROFILE_SLOW_MS / PROFILE_SAMPLE_RATE 로 저장된 프로파일 보기 / 비교
+    python cli.py profile-list --top 10
+    python cli.py profile-diff 20250101-0930 20250102-1015
+
+    # `import app` cold start 분해 (python -X importtime) — 지연 import 대상이 새지 않았는지 확인
+    python cli.py import-report --top 15
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import app
+
+
+# =========================
+# POI index build
+# =========================
+def _parse_bbox(text: str) -> Tuple[float, float, float, float]:
+    s, w, n, e = (float(x) for x in text.split(","))
+    if s >= n or w >= e:
+        raise argparse.ArgumentTypeError(f"bbox는 south,west,north,east 순서: {text}")
+    return (s, w, n, e)
+
+
+def _iter_dump_elements(path: str) -> Iterator[Dict[str, Any]]:
+    def chunks():
+        with open(path, "rb") as f:
+            while True:
+                b = f.read(1024 * 1024)
+                if not b:
+                    return
+                yield b
+
+    yield from app._iter_json_array_items(chunks(), "elements")
+
+
+def _iter_pbf_elements(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    .osm.pbf → Overpass JSON 모양의 element(dict).
+    - way: 노드 좌표 평균을 center로, multipolygon relation: 바깥 링 평균을 center로
+    """
+    try:
+        import osmium
+    except Exception:
+        raise SystemExit("pbf 입력은 pyosmium이 필요해요: `pip install osmium`")
+
+    out: List[Dict[str, Any]] = []
+
+    def centroid(locs) -> Optional[Dict[str, float]]:
+        pts = [(l.lat, l.lon) for l in locs if l.valid()]
+        if not pts:
+            return None
+        return {"lat": sum(p[0] for p in pts) / len(pts), "lon": sum(p[1] for p in pts) / len(pts)}
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if app._is_poi_candidate(tags) and n.location.valid():
+                out.append({"type": "node", "id": n.id, "lat": n.location.lat, "lon": n.location.lon, "tags": tags})
+
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if not app._is_poi_candidate(tags):
+                return
+            center = centroid(nd.location for nd in w.nodes)
+            if center:
+                out.append({"type": "way", "id": w.id, "center": center, "tags": tags})
+
+        def area(self, a):
+            if a.from_way():
+                return  # 닫힌 way는 way()에서 이미 처리
+            tags = {t.k: t.v for t in a.tags}
+            if not app._is_poi_candidate(tags):
+                return
+            for ring in a.outer_rings():
+                center = centroid(nd.location for nd in ring)
+                if center:
+                    out.append({"type": "relation", "id": a.orig_id(), "center": center, "tags": tags})
+                break
+
+    Handler().apply_file(path, locations=True)
+    yield from out
+
+
+def _pbf_header_bbox(path: str) -> Optional[Tuple[float, float, float, float]]:
+    try:
+        import osmium
+
+        reader = osmium.io.Reader(path, osmium.osm.osm_entity_bits.NOTHING)
+        box = reader.header().box()
+        reader.close()
+        if box.valid():
+            return (box.bottom_left.lat, box.bottom_left.lon, box.top_right.lat, box.top_right.lon)
+    except Exception:
+        pass
+    return None
+
+
+def cmd_build_poi_index(args) -> int:
+    pois: List[Dict[str, Any]] = []
+    coverage: List[Tuple[float, float, float, float]] = list(args.bbox or [])
+
+    for path in args.inputs:
+        is_pbf = path.endswith(".pbf")
+        elements = _iter_pbf_elements(path) if is_pbf else _iter_dump_elements(path)
+        got = list(app._iter_overpass_pois(elements))
+        pois += got
+        print(f"{path}: {len(got)} POIs", file=sys.stderr)
+
+        if not args.bbox:
+            box = _pbf_header_bbox(path) if is_pbf else None
+            if box is None and got:
+                # 범위 명시가 없으면 실제 POI 분포 범위만 커버로 인정(보수적)
+                box = (
+                    min(p["lat"] for p in got),
+                    min(p["lon"] for p in got),
+                    max(p["lat"] for p in got),
+                    max(p["lon"] for p in got),
+                )
+            if box:
+                coverage.append(box)
+
+    stats = app.write_poi_index(pois, args.out, coverage, source=",".join(os.path.basename(p) for p in args.inputs))
+    print(json.dumps({**stats, "out": args.out, "coverage": coverage}, ensure_ascii=False))
+    return 0
+
+
+# =========================
+# Gazetteer build
+# =========================
+# 접두 일치로 잡히면 안 되는 짧은 질의(여러 도시의 앞부분) — 빌드 후 확인
+GAZETTEER_MUST_MISS = ("san", "San", "par", "tok", "van", "new")
+
+
+def cmd_build_gazetteer(args) -> int:
+    stats = app.build_gazetteer(args.src, args.out)
+    gaz = app.Gazetteer(args.out)
+    hits = {q: gaz.lookup(q) for q in GAZETTEER_MUST_MISS}
+    leaked = {q: h["display_name"] for q, h in hits.items() if h}
+    print(json.dumps({**stats, "out": args.out}, ensure_ascii=False))
+    if leaked:
+        print(f"⚠️ 짧은 접두 질의가 한 장소로 잡힘(조회 규칙 확인): {leaked}", file=sys.stderr)
+        return 1
+    return 0
+
+
+# =========================
+# Climatology build
+# =========================
+ClimateSample = Tuple[float, float, str, Optional[float], Optional[float], Optional[float]]
+
+_CSV_COLUMNS = {
+    "date": ("date", "time"),
+    "lat": ("lat", "latitude"),
+    "lon": ("lon", "longitude"),
+    "tmax": ("tmax", "temperature_2m_max"),
+    "tmin": ("tmin", "temperature_2m_min"),
+    "prcp": ("prcp", "precipitation_sum"),
+}
+
+
+def _num(v: Any) -> Optional[float]:
+    if v is None or v == "":
+        return None
+    return float(v)
+
+
+def _iter_archive_json(path: str) -> Iterator[ClimateSample]:
+    # Open-Meteo archive 응답(단일 또는 여러 지점 리스트)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for loc in data if isinstance(data, list) else [data]:
+        lat, lon = float(loc["latitude"]), float(loc["longitude"])
+        d = loc.get("daily") or {}
+        cols = [d.get(k) or [] for k in ("time", "temperature_2m_max", "temperature_2m_min", "precipitation_sum")]
+        for day, tmax, tmin, prcp in zip(*cols):
+            yield lat, lon, day, _num(tmax), _num(tmin), _num(prcp)
+
+
+def _iter_csv(path: str) -> Iterator[ClimateSample]:
+    # 헤더: date,lat,lon,tmax,tmin,prcp (Open-Meteo 컬럼명도 허용)
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        cols = {}
+        for field, names in _CSV_COLUMNS.items():
+            col = next((c for c in reader.fieldnames or [] if c.strip().lower() in names), None)
+            if col is None:
+                raise SystemExit(f"{path}: '{field}' 컬럼이 없어요 (필요: date,lat,lon,tmax,tmin,prcp)")
+            cols[field] = col
+        for row in reader:
+            yield (
+                float(row[cols["lat"]]),
+                float(row[cols["lon"]]),
+                row[cols["date"]][:10],
+                _num(row[cols["tmax"]]),
+                _num(row[cols["tmin"]]),
+                _num(row[cols["prcp"]]),
+            )
+
+
+def cmd_build_climatology(args) -> int:
+    def samples() -> Iterator[ClimateSample]:
+        for path in args.inputs:
+            yield from (_iter_csv(path) if path.endswith(".csv") else _iter_archive_json(path))
+
+    stats = app.write_climatology(
+        samples(), args.out, source=",".join(os.path.basename(p) for p in args.inputs), cell_deg=args.cell_deg
+    )
+    print(json.dumps({**stats, "out": args.out}, ensure_ascii=False))
+    return 0
+
+
+# =========================
+# Headless planning (plan / serve)
+# =========================
+def _read_json(path: str) -> Any:
+    if path == "-":
+        return json.load(sys.stdin)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _parse_set(text: str) -> Tuple[str, Any]:
+    # key=value, value는 JSON으로 해석되면 JSON(숫자/리스트/불리언), 아니면 문자열
+    key, sep, raw = text.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"key=value 형식이어야 해요: {text}")
+    try:
+        return key.strip(), json.loads(raw)
+    except ValueError:
+        return key.strip(), raw
+
+
+def _dump_bundle(bundle: Dict[str, Any], err: Optional[str], pois: int) -> str:
+    return json.dumps({**app.bundle_export(bundle, poi_limit=pois), "error": err}, ensure_ascii=False, indent=2, default=str)
+
+
+def cmd_plan(args) -> int:
+    inp = _read_json(args.input)
+    config = _read_json(args.config) if args.config else {}
+    config.update(dict(args.set or []))
+    if not config.get("openai_api_key") and os.getenv("OPENAI_API_KEY"):
+        config["openai_api_key"] = os.environ["OPENAI_API_KEY"]
+
+    bundle, err = app.plan_trip(app.payload_from_input(inp.get("input", inp)), config)
+    text = _dump_bundle(bundle, err, args.pois)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if err:
+        print(f"⚠️ {err}", file=sys.stderr)
+    return 0
+
+
+def cmd_serve(args) -> int:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    pois = args.pois
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, body: str, ctype: str = "application/json; charset=utf-8"):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/healthz":
+                self._send(200, json.dumps({"ok": True, "warmup": app.start_cache_warmup()}, default=str))
+            elif path == "/metrics":
+                self._send(200, app.metrics().render(), "text/plain; version=0.0.4; charset=utf-8")
+            elif path == "/config":
+                cfg = {k: v for k, v in app.default_plan_config().items() if k not in app.PLAN_CONFIG_SECRETS}
+                self._send(200, json.dumps(cfg, ensure_ascii=False))
+            else:
+                self._send(404, '{"error": "not found"}')
+
+        def do_POST(self):
+            path = self.path.split("?", 1)[0]
+            if path not in ("/plan", "/compare"):
+                self._send(404, '{"error": "not found"}')
+                return
+            try:
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                payload = app.payload_from_input(req.get("input") or {})
+                variants = req.get("variants") or []
+                if path == "/compare" and (not isinstance(variants, list) or len(variants) < 2):
+                    raise ValueError("variants: 2개 이상의 변형 목록이 필요해요")
+            except (ValueError, TypeError, KeyError) as e:
+                self._send(400, json.dumps({"error": f"bad request: {e}"}, ensure_ascii=False))
+                return
+            try:
+                if path == "/plan":
+                    bundle, err = app.cached_plan_trip(payload, req.get("config") or {})
+                    self._send(200, _dump_bundle(bundle, err, pois))
+                    return
+                results = app.compare_plans(payload, req.get("config") or {}, variants)
+            except Exception as e:
+                app.logger.exception("%s failed: %s", path, e)
+                self._send(500, json.dumps({"error": str(e)}, ensure_ascii=False))
+                return
+            body = {
+                "summary": app.compare_summary(results),
+                "variants": [
+                    {"label": r["label"], **app.bundle_export(r["bundle"], poi_limit=pois), "error": r["error"]}
+                    for r in results
+                ],
+            }
+            self._send(200, json.dumps(body, ensure_ascii=False, indent=2, default=str))
+
+        def log_message(self, fmt, *a):
+            app.logger.info("%s %s", self.address_string(), fmt % a)
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    app.start_cache_warmup()
+    print(f"listening on http://{args.host}:{server.server_address[1]}  (POST /plan /compare, GET /healthz /metrics /config)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+# =========================
+# Batch precompute (batch)
+# =========================
+_LIST_FIELDS = {"travel_style", "poi_types", "exclude_ids"}
+_batch_store: Optional["app.BundleStore"] = None
+
+
+def _coerce(field: str, raw: str, like: Any) -> Any:
+    if field in _LIST_FIELDS:
+        vals = [v.strip() for v in raw.replace(",", "|").split("|") if v.strip()]
+        return [app.parse_poi_id(v) for v in vals] if field == "exclude_ids" else vals
+    if isinstance(like, bool):
+        return raw.strip().lower() in ("1", "true", "yes", "y")
+    if isinstance(like, (int, float)):
+        return type(like)(float(raw))
+    return raw
+
+
+def _iter_batch_items(path: str) -> Iterator[Dict[str, Any]]:
+    # JSONL: {"id", "input": {...}, "config": {...}} 또는 입력 필드만 / CSV: 컬럼명 = 입력 필드 또는 설정 키
+    defaults_in = app.default_app_state()["input"]
+    defaults_cfg = app.default_plan_config()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            for n, row in enumerate(csv.DictReader(f), 1):
+                inp, cfg = {}, {}
+                for k, v in row.items():
+                    if not k or v is None or v == "":
+                        continue
+                    k = k.strip()
+                    if k in defaults_in:
+                        inp[k] = _coerce(k, v, defaults_in[k])
+                    elif k in defaults_cfg:
+                        cfg[k] = _coerce(k, v, defaults_cfg[k])
+                yield {"line": n + 1, "id": row.get("id") or str(n), "input": inp, "config": cfg}
+        else:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                doc = json.loads(line)
+                inp = doc.get("input") if "input" in doc else {k: v for k, v in doc.items() if k not in ("id", "config")}
+                yield {"line": n, "id": str(doc.get("id") or n), "input": inp, "config": doc.get("config") or {}}
+
+
+def _batch_init(nominatim_next: Any, overpass_slots: Any, store_dir: str, http_cache: str) -> None:
+    global _batch_store
+    app.install_shared_limits(nominatim_next, overpass_slots)
+    app.WARMUP_ENABLED = False  # 배치 입력은 '최근 트래픽'이 아님
+    _batch_store = app.BundleStore(store_dir)
+    if http_cache:
+        # st.cache_data는 프로세스마다 따로 → 업스트림 응답은 디스크로 워커 간 공유(저장소 TTL 동안)
+        app.set_http_fixtures(app.HttpFixtures(http_cache, "cache", max_age_s=app.BUNDLE_STORE_TTL_S))
+
+
+def _batch_run_group(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # 같은 목적지끼리 한 프로세스에서 연달아 → 프로세스 안 캐시(st.cache_data)도 그룹 안에서 재사용
+    out = []
+    for it in items:
+        t = time.perf_counter()
+        res = {"key": it["key"], "id": it["id"], "line": it["line"]}
+        try:
+            # 날짜 의존 없는 단계(장소/POI/일자 묶기)만 저장 — 날씨/숙소/플랜은 서빙 시점에 계산
+            pre = app.precompute_trip(app.payload_from_input(it["input"]), it["config"])
+            places = pre["places"]
+            poi_used = sum(len(stop["pois"]) for stop in places["stops"])
+            degraded = [
+                msg
+                for cond, msg in (
+                    (not places.get("dest_geo"), "목적지 지오코딩 실패"),
+                    (places.get("overpass_err"), f"Overpass: {places.get('overpass_err')}"),
+                    (not poi_used, "POI 0개"),
+                )
+                if cond
+            ]
+            if degraded:
+                # 일시 장애로 망가진 결과를 TTL 동안 서빙하지 않도록 저장 안 함(재개 시 재시도)
+                res.update(status="error", error="degraded: " + "; ".join(degraded))
+            else:
+                _batch_store.put(it["key"], pre)
+                res.update(status="ok", pois=poi_used)
+        except Exception as e:
+            res.update(status="error", error=f"{type(e).__name__}: {e}")
+        res["ms"] = round((time.perf_counter() - t) * 1000.0, 1)
+        out.append(res)
+    return out
+
+
+def cmd_batch(args) -> int:
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    store = app.BundleStore(args.store)
+    progress_path = args.progress or os.path.join(args.store, "batch-progress.jsonl")
+    os.makedirs(os.path.dirname(os.path.abspath(progress_path)), exist_ok=True)
+
+    # 건너뛰기는 저장소 신선도만 기준 — 중단 후 재실행하면 이미 저장된 항목은 자연히 건너뛰고,
+    # TTL이 지난 항목은 다음 실행에서 다시 계산됨. 진행 기록(JSONL)은 실행 로그일 뿐 건너뛰기에 안 씀
+    results: Dict[str, Dict[str, Any]] = {}  # 이번 입력 파일의 항목만 (리포트/종료 코드 기준)
+    todo: List[Dict[str, Any]] = []
+    queued: Set[str] = set()
+    skipped = 0
+    for it in _iter_batch_items(args.input):
+        try:
+            it["key"] = app.bundle_store_key(app.payload_from_input(it["input"]), it["config"])
+        except (ValueError, TypeError) as e:
+            results[f"line{it['line']}"] = {"key": f"line{it['line']}", "id": it["id"], "line": it["line"], "status": "error", "error": f"입력 오류: {e}"}
+            continue
+        if not args.force and store.is_fresh(it["key"]):
+            results[it["key"]] = {"key": it["key"], "id": it["id"], "line": it["line"], "status": "ok", "skipped": True}
+            skipped += 1
+            continue
+        if it["key"] in queued:
+            continue  # 저장소 키가 같은 행(시작일/인원/예산 등만 다름)은 한 번만 계산
+        queued.add(it["key"])
+        todo.append(it)
+
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for it in todo:
+        dest = " ".join(str(it["input"].get("destination_text") or "").split()).lower()
+        groups.setdefault((str(it["input"].get("destination_scope") or ""), dest), []).append(it)
+    print(f"{len(todo)} to run in {len(groups)} destination groups, {skipped} already done", file=sys.stderr)
+
+    http_cache = "" if args.http_cache == "off" else args.http_cache or os.path.join(args.store, "http-cache")
+    ctx = multiprocessing.get_context()
+    nominatim_next = ctx.Value("d", 0.0)
+    overpass_slots = ctx.BoundedSemaphore(args.overpass_slots)
+    t0 = time.perf_counter()
+    with open(progress_path, "a", encoding="utf-8") as progress:
+
+        def record(rs: List[Dict[str, Any]]) -> None:
+            for r in rs:
+                results[r["key"]] = r
+                progress.write(json.dumps(r, ensure_ascii=False) + "\n")
+                mark = "✓" if r["status"] == "ok" else "✗"
+                print(f"{mark} {r['id']} ({r['ms']:.0f}ms){'' if r['status'] == 'ok' else ' ' + r['error']}", file=sys.stderr)
+            progress.flush()
+
+        if args.workers <= 1:
+            _batch_init(nominatim_next, overpass_slots, args.store, http_cache)
+            for g in groups.values():
+                record(_batch_run_group(g))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=args.workers, mp_context=ctx, initializer=_batch_init, initargs=(nominatim_next, overpass_slots, args.store, http_cache)
+            ) as ex:
+                futures = {ex.submit(_batch_run_group, g): g for g in groups.values()}
+                for fut in as_completed(futures):
+                    try:
+                        record(fut.result())
+                    except Exception as e:  # 워커 프로세스 자체가 죽은 경우
+                        record([{"key": it["key"], "id": it["id"], "line": it["line"], "status": "error", "error": f"worker: {e}", "ms": 0.0} for it in futures[fut]])
+
+    errors = sorted((r for r in results.values() if r["status"] != "ok"), key=lambda r: r.get("line", 0))
+    report_path = args.report or os.path.splitext(progress_path)[0] + "-errors.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(errors, f, ensure_ascii=False, indent=2)
+    ok = sum(1 for r in results.values() if r["status"] == "ok")
+    print(
+        json.dumps(
+            {"ok": ok, "errors": len(errors), "ran": len(todo), "skipped": skipped, "wall_s": round(time.perf_counter() - t0, 1), "store": args.store, "report": report_path},
+            ensure_ascii=False,
+        )
+    )
+    return 1 if errors else 0
+
+
+# =========================
+# Profiles
+# =========================
+def _resolve_profile(name: str, root: str) -> Dict[str, Any]:
+    # 경로, PROFILE_DIR 안의 파일명, 또는 파일명 일부(서명 등)로 지정
+    if os.path.isfile(name):
+        path = name
+    else:
+        hits = [p["file"] for p in app.list_profiles(root) if name in p["file"]]
+        if len(hits) != 1:
+            raise SystemExit(f"'{name}': 프로파일 {len(hits)}개 일치 (파일명을 더 구체적으로)")
+        path = os.path.join(root, hits[0])
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cmd_profile_list(args) -> int:
+    rows = [p for p in app.list_profiles(args.dir) if not args.target or p["target"] == args.target]
+    for p in rows:
+        print(f"{p['file']}  {p['kind']:<8} {p['ms']:>9.0f}ms  sig={p['sig'] or '-'}")
+        for f in app.profile_top(p["doc"], args.top, args.sort):
+            print(f"    {f[args.sort]:>9.1f}ms  {f['func']}")
+    if not rows:
+        print(f"{args.dir}: 프로파일 없음 (PROFILE_SLOW_MS / PROFILE_SAMPLE_RATE 설정 확인)", file=sys.stderr)
+    return 0
+
+
+def cmd_profile_diff(args) -> int:
+    a = _resolve_profile(args.a, args.dir)
+    b = _resolve_profile(args.b, args.dir)
+    print(f"A: {a['target']} {a['kind']} {a['ms']:.0f}ms sig={a['sig']}")
+    print(f"B: {b['target']} {b['kind']} {b['ms']:.0f}ms sig={b['sig']}")
+    if a["kind"] != b["kind"]:
+        print("⚠️ 서로 다른 종류(cprofile vs sampler)라 절대값 비교는 거칠어요", file=sys.stderr)
+    print(f"{'A ms':>10} {'B ms':>10} {'Δ ms':>10}  function")
+    for r in app.diff_profiles(a, b, args.top, args.sort):
+        print(f"{r['a']:>10.1f} {r['b']:>10.1f} {r['delta']:>+10.1f}  {r['func']}")
+    return 0
+
+
+LAZY_MODULES = ("requests", "pydeck", "openai", "reportlab")
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[int, int, int, str]]:
+    """-X importtime 출력 → [(depth, self_us, cumulative_us, module)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            rows.append((depth, int(self_us), int(cum_us), name.strip()))
+        except ValueError:
+            continue
+    return rows
+
+
+def cmd_import_report(args) -> int:
+    root = os.path.dirname(os.path.abspath(app.__file__))
+    code = "import time; t = time.perf_counter(); import app; print((time.perf_counter() - t) * 1000)"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=root, capture_output=True, text=True, timeout=300,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:], file=sys.stderr)
+        return 1
+    rows = _parse_importtime(proc.stderr)
+    print(f"import app: {float(proc.stdout.strip().splitlines()[-1]):.0f}ms (wall, 새 프로세스)")
+    # importtime은 자식을 부모보다 먼저 출력 → "app" 줄 바로 앞의 depth 1 줄들이 app의 직접 import
+    end = next((i for i, r in enumerate(rows) if r[0] == 0 and r[3] == "app"), len(rows))
+    start = max((i + 1 for i, r in enumerate(rows[:end]) if r[0] == 0), default=0)
+    print(f"{'cum ms':>9} {'self ms':>9}  module (app의 직접 import)")
+    top = sorted((r for r in rows[start:end] if r[0] == 1), key=lambda r: -r[2])[: args.top]
+    for _, self_us, cum_us, name in top:
+        print(f"{cum_us / 1000:>9.1f} {self_us / 1000:>9.1f}  {name}")
+    loaded = {r[3] for r in rows}
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    if eager:
+        print(f"⚠️ 지연 import 대상이 import 시점에 로드됨: {', '.join(eager)}", file=sys.stderr)
+        return 2
+    print(f"지연 import 대상 미로드: {', '.join(LAZY_MODULES)}")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="cli.py", description="Travel-Maker offline tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build-poi-index", help="OSM 추출본/Overpass 덤프 → mmap POI 인덱스")
+    p.add_argument("inputs", nargs="+", help=".osm.pbf 또는 Overpass JSON 파일")
+    p.add_argument("--out", default=app.POI_INDEX_PATH, help="출력 경로 (기본: %(default)s)")
+    p.add_argument("--bbox", type=_parse_bbox, action="append", help="커버 영역 south,west,north,east (반복 가능)")
+    p.set_defaults(func=cmd_build_poi_index)
+
+    p = sub.add_parser("build-gazetteer", help="도시/지역 목록 → 정렬된 gazetteer(TSV)")
+    p.add_argument("src", nargs="?", default=os.path.join(os.path.dirname(app.GAZETTEER_PATH), "gazetteer_places.tsv"))
+    p.add_argument("--out", default=app.GAZETTEER_PATH, help="출력 경로 (기본: %(default)s)")
+    p.set_defaults(func=cmd_build_gazetteer)
+
+    p = sub.add_parser("build-climatology", help="과거 일별 기상 덤프 → 셀×월 평년값 파일")
+    p.add_argument("inputs", nargs="+", help="Open-Meteo archive JSON 또는 CSV(date,lat,lon,tmax,tmin,prcp)")
+    p.add_argument("--out", default=app.CLIMATE_PATH, help="출력 경로 (기본: %(default)s)")
+    p.add_argument("--cell-deg", type=float, default=app.CLIMATE_CELL_DEG, help="격자 크기(도) (기본: %(default)s)")
+    p.set_defaults(func=cmd_build_climatology)
+
+    p = sub.add_parser("plan", help="Streamlit 없이 일정 1건 생성 → bundle JSON")
+    p.add_argument("input", help='입력 JSON 파일(또는 -): {"destination_text": "부산", "duration": "3일", ...} 또는 {"input": {...}}')
+    p.add_argument("--config", help="설정 JSON 파일 (키: cli.py serve 의 GET /config 참고)")
+    p.add_argument("--set", type=_parse_set, action="append", metavar="KEY=VALUE", help="설정 덮어쓰기 (반복 가능)")
+    p.add_argument("--out", help="출력 파일 (기본: stdout)")
+    p.add_argument("--pois", type=int, default=100, help="출력에 포함할 POI 수 (기본: %(default)s)")
+    p.set_defaults(func=cmd_plan)
+
+    p = sub.add_parser("serve", help="로컬 HTTP/JSON API (POST /plan)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--pois", type=int, default=100, help="응답에 포함할 POI 수 (기본: %(default)s)")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser(
+        "batch",
+        help="인기 조합의 장소/POI/일자 묶기를 미리 계산 → 번들 저장소 (재개 가능, 날씨/숙소/플랜은 서빙 시 계산)",
+    )
+    p.add_argument("input", help="JSONL({id, input, config}) 또는 CSV(컬럼 = 입력 필드/설정 키, 목록은 | 구분)")
+    p.add_argument("--store", default=app.BUNDLE_STORE_DIR, help="번들 저장소 (기본: %(default)s)")
+    p.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="프로세스 수 (기본: %(default)s)")
+    p.add_argument("--overpass-slots", type=int, default=2, help="전체 워커 합산 동시 Overpass 호출 수 (기본: %(default)s)")
+    p.add_argument("--progress", help="진행 기록 JSONL (기본: <store>/batch-progress.jsonl)")
+    p.add_argument("--report", help="항목별 오류 리포트 JSON (기본: <progress>-errors.json)")
+    p.add_argument("--force", action="store_true", help="이미 끝난/저장소에 있는 항목도 다시 생성")
+    p.add_argument(
+        "--http-cache",
+        help="워커 간 공유 HTTP 응답 캐시 디렉터리 (기본: <store>/http-cache, off = 끔). "
+        "프로세스 안 캐시는 워커마다 따로라 같은 목적지는 한 워커에 묶어서 실행",
+    )
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("profile-list", help="저장된 프로파일 목록 + 함수별 상위 N")
+    p.add_argument("--dir", default=app.PROFILE_DIR, help="프로파일 디렉터리 (기본: %(default)s)")
+    p.add_argument("--target", choices=["generate_bundle", "page3"])
+    p.add_argument("--top", type=int, default=5)
+    p.add_argument("--sort", choices=["self_ms", "cum_ms"], default="self_ms")
+    p.set_defaults(func=cmd_profile_list)
+
+    p = sub.add_parser("profile-diff", help="두 프로파일의 함수별 시간 차이(B - A)")
+    p.add_argument("a", help="파일 경로 또는 파일명 일부")
+    p.add_argument("b", help="파일 경로 또는 파일명 일부")
+    p.add_argument("--dir", default=app.PROFILE_DIR, help="프로파일 디렉터리 (기본: %(default)s)")
+    p.add_argument("--top", type=int, default=20)
+    p.add_argument("--sort", choices=["self_ms", "cum_ms"], default="self_ms")
+    p.set_defaults(func=cmd_profile_diff)
+
+    p = sub.add_parser("import-report", help="`import app` cold start 시간 분해 (python -X importtime)")
+    p.add_argument("--top", type=int, default=15, help="최상위 import 상위 N개 (기본: %(default)s)")
+    p.set_defaults(func=cmd_import_report)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
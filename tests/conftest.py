@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app.py는 패키지가 아니라 저장소 루트의 모듈 → `pytest`를 어디서 돌려도 import 되게
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
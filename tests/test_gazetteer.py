@@ -0,0 +1,73 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="module")
+def gaz():
+    # 저장소에 들어 있는 data/gazetteer.tsv 그대로
+    return app.Gazetteer(app.GAZETTEER_PATH)
+
+
+@pytest.fixture
+def built(tmp_path):
+    src = tmp_path / "places.tsv"
+    src.write_text(
+        "# names\tlat\tlon\tclass\ttype\timportance\tdisplay_name\n"
+        "Granada|그라나다\t37.1773\t-3.5986\tplace\tcity\t0.72\tGranada, Andalucía, España\n"
+        "Granadilla|그라나디야\t28.1186\t-16.5761\tplace\ttown\t0.45\tGranadilla de Abona, Canarias, España\n"
+        "Reykjavik|Reykjavík|레이캬비크\t64.1466\t-21.9426\tplace\tcity\t0.74\tReykjavík, Ísland\n",
+        encoding="utf-8",
+    )
+    out = tmp_path / "gazetteer.tsv"
+    assert app.build_gazetteer(str(src), str(out)) == {"places": 3, "keys": 7}
+    return app.Gazetteer(str(out))
+
+
+@pytest.mark.parametrize(
+    "query,display",
+    [
+        ("Paris", "Paris, Île-de-France, France"),
+        ("san francisco", "San Francisco, California, United States"),
+        ("  San-Francisco ", "San Francisco, California, United States"),
+        ("부산", "부산광역시, 대한민국"),
+        ("Vancouver, city", "Vancouver, British Columbia, Canada"),
+    ],
+)
+def test_exact_match(gaz, query, display):
+    hit = gaz.lookup(query)
+    assert hit is not None and hit["display_name"] == display
+    assert hit["raw"]["source"] == "gazetteer"
+
+
+@pytest.mark.parametrize(
+    "query,display",
+    [
+        ("vancou", "Vancouver, British Columbia, Canada"),
+        ("Pari", "Paris, Île-de-France, France"),
+        ("sanfranc", "San Francisco, California, United States"),
+        ("부산광", "부산광역시, 대한민국"),
+    ],
+)
+def test_prefix_match_accepted(gaz, query, display):
+    hit = gaz.lookup(query)
+    assert hit is not None and hit["display_name"] == display
+
+
+@pytest.mark.parametrize("query", ["San", "par", "tok", "van", "San Fran", "부", "", "   ", "zzzz"])
+def test_prefix_match_rejected(gaz, query):
+    # 짧은/모호한 접두는 Nominatim에 넘김
+    assert gaz.lookup(query) is None
+
+
+def test_prefix_must_converge_on_one_place(built):
+    # "granad"는 길이 조건은 통과하지만 granada / granadilla 두 곳 → 모름
+    assert built.lookup("granad") is None
+    assert built.lookup("Granada")["display_name"] == "Granada, Andalucía, España"
+    assert built.lookup("granadil")["display_name"] == "Granadilla de Abona, Canarias, España"
+
+
+def test_built_aliases_are_normalised(built):
+    assert built.lookup("reykjavík")["display_name"] == "Reykjavík, Ísland"
+    assert built.lookup("Reykjavik")["lat"] == pytest.approx(64.1466)
+    assert built.lookup("레이캬비크")["lon"] == pytest.approx(-21.9426)
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import app
+
+CHUNK_SIZES = [1, 3, 7, 64]
+
+BODY = {
+    "version": 0.6,
+    "osm3s": {"timestamp_osm_base": "2024-05-01T00:00:00Z"},
+    "elements": [
+        {"type": "node", "id": 1, "lat": 37.5665, "lon": 126.978, "tags": {"name": "경복궁", "tourism": "attraction"}},
+        {"type": "way", "id": 123456789, "center": {"lat": 35.1796, "lon": 129.0756}, "tags": {"name": "Café \"Ü\""}},
+        {"type": "node", "id": 3, "lat": -0.5, "lon": 1e-3, "tags": {}},
+        [],
+        None,
+        12,
+    ],
+    "remark": "runtime error: Query timed out in \"query\" at line 3 after 25 seconds.",
+}
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_items_match_json_loads(size):
+    raw = json.dumps(BODY, ensure_ascii=False).encode("utf-8")
+    assert list(app._iter_json_array_items(chunked(raw, size), "elements")) == BODY["elements"]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_pretty_printed_body(size):
+    raw = json.dumps(BODY, ensure_ascii=False, indent=2).encode("utf-8")
+    assert list(app._iter_json_array_items(chunked(raw, size), "elements")) == BODY["elements"]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_rest_collects_keys_after_array(size):
+    # Overpass는 부분 결과여도 200 + 배열 뒤 "remark"
+    raw = json.dumps(BODY, ensure_ascii=False).encode("utf-8")
+    rest = {}
+    items = list(app._iter_json_array_items(chunked(raw, size), "elements", rest=rest))
+    assert items == BODY["elements"]
+    assert rest == {k: v for k, v in BODY.items() if k != "elements"}
+    assert rest["remark"].startswith("runtime error")
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_without_rest_stops_after_array(size):
+    # 배열이 끝나면 나머지 body는 읽지 않음 → 뒤가 깨져 있어도 상관없음
+    raw = b'{"elements": [1, 2.5, "x"], "remark": <not json>'
+    assert list(app._iter_json_array_items(chunked(raw, size), "elements")) == [1, 2.5, "x"]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_numbers_split_across_chunks(size):
+    raw = b'{"elements":[0.6,123,-7e2,true,false,null]}'
+    assert list(app._iter_json_array_items(chunked(raw, size), "elements")) == [0.6, 123, -700.0, True, False, None]
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_empty_array_and_missing_key(size):
+    assert list(app._iter_json_array_items(chunked(b'{"elements": [], "remark": "x"}', size), "elements")) == []
+    rest = {}
+    assert list(app._iter_json_array_items(chunked(b'{"remark": "x"}', size), "elements", rest=rest)) == []
+    assert rest == {"remark": "x"}
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_truncated_body_raises(size):
+    raw = json.dumps(BODY).encode("utf-8")[:-40]
+    with pytest.raises(ValueError):
+        list(app._iter_json_array_items(chunked(raw, size), "elements", rest={}))
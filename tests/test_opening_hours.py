@@ -0,0 +1,142 @@
+from datetime import date, timedelta
+
+import pytest
+
+import app
+
+MON = date(2024, 6, 3)  # 월요일(6월)
+JAN_MON = date(2024, 1, 1)  # 월요일(1월)
+
+
+def day(wd: int, base: date = MON) -> date:
+    return base + timedelta(days=wd)
+
+
+def windows(text: str, d: date):
+    oh = app.compile_opening_hours(text)
+    assert oh is not None, text
+    return oh.windows(d)
+
+
+def test_weekday_range():
+    assert windows("Mo-Fr 09:00-18:00", day(0)) == ((540, 1080),)
+    assert windows("Mo-Fr 09:00-18:00", day(4)) == ((540, 1080),)
+    assert windows("Mo-Fr 09:00-18:00", day(5)) == ()
+
+
+def test_24_7_and_off():
+    assert windows("24/7", day(6)) == ((0, 1440),)
+    assert windows("Mo-Sa 10:00-20:00; Su off", day(6)) == ()
+    assert windows("Mo-Sa 10:00-20:00; Su closed", day(5)) == ((600, 1200),)
+
+
+def test_weekday_wraps():
+    assert windows("Fr-Mo 10:00-16:00", day(6)) == ((600, 960),)
+    assert windows("Fr-Mo 10:00-16:00", day(0)) == ((600, 960),)
+    assert windows("Fr-Mo 10:00-16:00", day(2)) == ()
+
+
+def test_overnight_spills_into_next_day():
+    text = "Fr-Sa 18:00-02:00"
+    assert windows(text, day(4)) == ((1080, 1560),)
+    assert windows(text, day(5)) == ((0, 120), (1080, 1560))
+    assert windows(text, day(6)) == ((0, 120),)
+    assert windows(text, day(0)) == ()
+
+
+def test_overnight_spill_across_month_and_year():
+    oh = app.compile_opening_hours("Dec Su 20:00-01:00")
+    assert oh.windows(date(2024, 12, 29)) == ((1200, 1500),)
+    assert oh.windows(date(2024, 12, 30)) == ((0, 60),)
+
+
+def test_is_open():
+    oh = app.compile_opening_hours("Mo-Fr 09:00-12:00,13:00-18:00")
+    assert oh.is_open(day(0), 9 * 60, 11 * 60)
+    assert not oh.is_open(day(0), 11 * 60, 14 * 60)
+    assert oh.is_open(day(0), 13 * 60, 18 * 60)
+    assert not oh.is_open(day(5), 10 * 60, 11 * 60)
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["Mo-Fr 10:00-18:00; PH off", "Mo-Fr 10:00-18:00; PH 12:00-14:00", "PH off; Mo-Fr 10:00-18:00"],
+)
+def test_ph_rules_are_ignored(text):
+    # 일정 날짜가 공휴일인지 모름 → 평일 규칙만
+    assert windows(text, day(0)) == ((600, 1080),)
+    assert windows(text, day(5)) == ()
+
+
+def test_ph_in_selector_is_dropped():
+    text = "Mo-Sa 09:00-18:00; Su,PH 10:00-14:00"
+    assert windows(text, day(6)) == ((600, 840),)
+    assert windows(text, day(2)) == ((540, 1080),)
+
+
+def test_ph_only_is_unknown():
+    assert app.compile_opening_hours("PH 10:00-12:00") is None
+
+
+def test_month_ranges():
+    text = "Apr-Oct 09:00-19:00; Nov-Mar 10:00-16:00"
+    assert windows(text, MON) == ((540, 1140),)
+    assert windows(text, JAN_MON) == ((600, 960),)
+
+
+def test_month_range_with_weekdays_and_wrap():
+    text = "Nov-Feb Sa-Su 10:00-15:00"
+    assert windows(text, JAN_MON + timedelta(days=5)) == ((600, 900),)
+    assert windows(text, JAN_MON) == ()
+    assert windows(text, day(5)) == ()  # 6월은 범위 밖
+
+
+def test_month_list():
+    text = "Jan,Jul-Aug Mo 08:00-09:00"
+    assert windows(text, JAN_MON) == ((480, 540),)
+    assert windows(text, date(2024, 7, 1)) == ((480, 540),)
+    assert windows(text, MON) == ()
+
+
+def test_semicolon_overrides_earlier_rule():
+    text = "Mo-Fr 09:00-12:00; We 14:00-18:00"
+    assert windows(text, day(2)) == ((840, 1080),)
+    assert windows(text, day(1)) == ((540, 720),)
+
+
+def test_comma_adds_to_earlier_rule():
+    text = "Mo-Fr 09:00-12:00, We 14:00-18:00"
+    assert windows(text, day(2)) == ((540, 720), (840, 1080))
+    assert windows(text, day(1)) == ((540, 720),)
+
+
+def test_comma_between_time_spans_is_not_a_rule():
+    assert windows("Mo 09:00-12:00,13:00-18:00", day(0)) == ((540, 720), (780, 1080))
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["", "sunrise-sunset", "Mo-Fr 09:00+", "Mo-Fr 09:00-18:00; SH off", "week 1-53 Mo 10:00-12:00", "Mo-Fr 9-18"],
+)
+def test_unsupported_is_unknown(text):
+    assert app.compile_opening_hours(text) is None
+
+
+def test_identical_cells_share_one_tuple():
+    oh = app.compile_opening_hours("Mo-Fr 09:00-18:00")
+    assert oh.windows(day(0)) is oh.windows(day(1))
+
+
+def test_opening_hours_for_uses_lru(monkeypatch):
+    calls = []
+    compile_ = app.compile_opening_hours
+    monkeypatch.setattr(app, "compile_opening_hours", lambda text: calls.append(text) or compile_(text))
+    monkeypatch.setattr(app, "OPENING_HOURS_LRU", 2)
+    app._opening_hours_lru()["items"].clear()
+
+    pois = [{"tags": {"opening_hours": t}} for t in ("24/7", "Mo 09:00-10:00", "24/7", "garbage")] + [{"tags": {}}, {}]
+    out = app.opening_hours_for(pois)
+    assert [oh is None for oh in out] == [False, False, False, True, True, True]
+    assert out[0] is out[2]
+    assert calls == ["24/7", "Mo 09:00-10:00", "garbage"]
+    assert list(app._opening_hours_lru()["items"]) == ["Mo 09:00-10:00", "garbage"]